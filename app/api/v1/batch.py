@@ -0,0 +1,41 @@
+from http import HTTPStatus
+from typing import Dict, List, Tuple
+from uuid import UUID
+
+from fastapi import HTTPException, Request
+
+from core import config, json
+from db.cache import get_cache
+
+
+def parse_batch_ids(ids: List[UUID]) -> List[str]:
+    """Уникальные id из запроса к batch ручке в порядке их передачи"""
+    unique_ids = list(dict.fromkeys(str(item_id) for item_id in ids))
+    if len(unique_ids) > config.BATCH_MAX_IDS:
+        raise HTTPException(
+            status_code=HTTPStatus.BAD_REQUEST,
+            detail=f"Too many ids, max {config.BATCH_MAX_IDS}",
+        )
+    return unique_ids
+
+
+async def get_cached_items(
+    request: Request, route_name: str, param_name: str, ids: List[str]
+) -> Tuple[Dict[str, dict], List[str]]:
+    """
+    Получение документов из кэша ответов ручки просмотра по id.
+    Возвращает найденные в кэше документы и id, которых в кэше нет.
+    """
+    keys = {
+        item_id: request.app.url_path_for(route_name, **{param_name: UUID(item_id)}).encode()
+        for item_id in ids
+    }
+    response_cache = await get_cache()
+    entries = await response_cache.get_many(list(keys.values()))
+
+    cached_items = {}
+    for item_id, key in keys.items():
+        entry = entries.get(key)
+        if entry is not None and entry.is_fresh() and entry.status_code == HTTPStatus.OK:
+            cached_items[item_id] = json.loads(entry.body)
+    return cached_items, [item_id for item_id in ids if item_id not in cached_items]
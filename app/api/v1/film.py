@@ -1,14 +1,25 @@
 import enum
 from http import HTTPStatus
-from typing import List, Optional
+from typing import Dict, List, Optional
 from uuid import UUID
 
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from pydantic import UUID4, BaseModel
 
-from services.film import FilmService, get_film_service
+from api.v1.batch import get_cached_items, parse_batch_ids
+from api.v1.params import (
+    is_fast_serialization,
+    parse_cursor,
+    parse_fields,
+    raw_response,
+    set_next_cursor,
+)
+from core import config
+from core.timing import TimedRoute
+from models.film import Film
+from services.film import FILM_LIST_SOURCE_FIELDS, FilmService, get_film_service
 
-router = APIRouter()
+router = APIRouter(route_class=TimedRoute)
 
 
 class FilmOrderingEnum(enum.Enum):
@@ -43,14 +54,46 @@ class FilmListModel(BaseModel):
     imdb_rating: Optional[float]
 
 
+class FilmSuggestModel(BaseModel):
+    id: UUID4
+    title: str
+
+
 @router.get("/{film_id:uuid}/", response_model=FilmDetailsModel)
 async def film_details(
     film_id: UUID, film_service: FilmService = Depends(get_film_service)
 ) -> FilmDetailsModel:
+    if is_fast_serialization("film_details"):
+        doc = await film_service.get_source_by_id(film_id)
+        if not doc:
+            raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail="film not found")
+        return raw_response(get_raw_film_details(doc))
+
     film = await film_service.get_by_id(film_id)
     if not film:
         raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail="film not found")
 
+    return get_film_details(film)
+
+
+@router.get("/batch/", response_model=List[FilmDetailsModel])
+async def film_batch(
+    request: Request,
+    ids: List[UUID] = Query(..., alias="id"),
+    film_service: FilmService = Depends(get_film_service),
+) -> List[FilmDetailsModel]:
+    """Фильмы по списку id. Фильмы из кэша ответов film_details не запрашиваются из elastic"""
+    film_ids = parse_batch_ids(ids)
+    cached_films, missing_ids = await get_cached_items(request, "film_details", "film_id", film_ids)
+    films = await film_service.get_by_ids(missing_ids)
+    return [
+        cached_films[film_id] if film_id in cached_films else get_film_details(films[film_id])
+        for film_id in film_ids
+        if film_id in cached_films or film_id in films
+    ]
+
+
+def get_film_details(film: Film) -> FilmDetailsModel:
     return FilmDetailsModel(
         id=film.id,
         title=film.title,
@@ -63,36 +106,86 @@ async def film_details(
     )
 
 
+def get_raw_film_details(doc: Dict) -> Dict:
+    """Документ фильма из elastic в формате FilmDetailsModel без валидации"""
+    return {
+        "id": doc["id"],
+        "title": doc["title"],
+        "imdb_rating": doc.get("imdb_rating"),
+        "description": doc["description"],
+        "genre": doc["genres"],
+        "actors": doc["actors"],
+        "writers": doc["writers"],
+        "directors": doc["directors"],
+    }
+
+
 @router.get("/", response_model=List[FilmListModel])
 async def film_list(
+    response: Response,
     sort: FilmOrderingEnum = Query(default=FilmOrderingEnum.imdb_rating__desc),
     page_number: int = Query(default=1, ge=1, alias="page[number]"),
     page_size: int = Query(default=50, ge=1, alias="page[size]"),
     filter_genre_id: UUID = Query(None, alias="filter[genre]"),
+    page_cursor: Optional[str] = Query(None, alias="page[cursor]"),
+    fields: Optional[str] = Query(None, description="Поля ответа через запятую"),
     film_service: FilmService = Depends(get_film_service),
 ):
+    """
+    Список фильмов. Для глубокой пагинации вместо page[number] передается page[cursor]
+    из заголовка X-Next-Cursor предыдущей страницы.
+    """
+    source_fields = parse_fields(fields, FilmListModel)
     sort_value, sort_order = sort.name.split("__")
 
     filter_map = {}
     if filter_genre_id:
         filter_map["genre_id"] = filter_genre_id
 
-    films_list = await film_service.get_page(
+    films_list, next_sort_values = await film_service.get_page(
         filter_map=filter_map,
         page_number=page_number,
         page_size=page_size,
         sort_value=sort_value,
         sort_order=sort_order,
+        search_after=parse_cursor(page_cursor),
+        source_fields=source_fields or FILM_LIST_SOURCE_FIELDS,
     )
+    set_next_cursor(response, next_sort_values)
+    if source_fields or is_fast_serialization("film_list"):
+        return raw_response(films_list, response)
     return films_list
 
 
 @router.get("/search/", response_model=List[FilmListModel])
 async def film_search(
+    response: Response,
     page: Optional[int] = 1,
     size: Optional[int] = 50,
     query: Optional[str] = "",
+    cursor: Optional[str] = None,
+    fields: Optional[str] = Query(None, description="Поля ответа через запятую"),
     film_service: FilmService = Depends(get_film_service),
 ) -> List[FilmListModel]:
-    films = await film_service.search_films(page=page, size=size, match_obj=query)
+    source_fields = parse_fields(fields, FilmListModel)
+    films, next_sort_values = await film_service.search_films(
+        page=page,
+        size=size,
+        match_obj=query,
+        search_after=parse_cursor(cursor),
+        source_fields=source_fields or FILM_LIST_SOURCE_FIELDS,
+    )
+    set_next_cursor(response, next_sort_values)
+    if source_fields or is_fast_serialization("film_search"):
+        return raw_response([film["_source"] for film in films], response)
     return [FilmListModel(**film["_source"]) for film in films]
+
+
+@router.get("/suggest/", response_model=List[FilmSuggestModel])
+async def film_suggest(
+    query: str = Query(..., min_length=1),
+    size: int = Query(default=config.SUGGEST_MAX_SIZE, ge=1, le=config.SUGGEST_MAX_SIZE),
+    film_service: FilmService = Depends(get_film_service),
+) -> List[FilmSuggestModel]:
+    """Автодополнение названия фильма по мере ввода запроса"""
+    return await film_service.suggest_films(match_obj=query, size=size)
@@ -4,12 +4,20 @@ from http import HTTPStatus
 from typing import List, Optional
 from uuid import UUID
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from pydantic import UUID4, BaseModel
 
+from api.v1.batch import get_cached_items, parse_batch_ids
+from api.v1.params import (
+    is_fast_serialization,
+    parse_cursor,
+    raw_response,
+    set_next_cursor,
+)
+from core.timing import TimedRoute
 from services.genre import GenreService, get_genre_service
 
-router = APIRouter()
+router = APIRouter(route_class=TimedRoute)
 
 
 class Genre(BaseModel):
@@ -32,21 +40,70 @@ class SortFields(Enum):
 async def genre_details(
     genre_id: UUID, genre_service: GenreService = Depends(get_genre_service)
 ) -> Genre:
+    if is_fast_serialization("genre_details"):
+        doc = await genre_service.get_source_by_id(genre_id)
+        if not doc:
+            raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail="genre not found")
+        return raw_response({"id": doc["id"], "name": doc["name"]})
+
     genre = await genre_service.get_by_id(genre_id)
     if not genre:
         raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail="genre not found")
     return Genre(id=genre.id, name=genre.name)
 
 
+@router.get("/batch/", response_model=List[Genre])
+async def genre_batch(
+    request: Request,
+    ids: List[UUID] = Query(..., alias="id"),
+    genre_service: GenreService = Depends(get_genre_service),
+) -> List[Genre]:
+    """Жанры по списку id. Жанры из кэша ответов genre_details не запрашиваются из elastic"""
+    genre_ids = parse_batch_ids(ids)
+    cached_genres, missing_ids = await get_cached_items(
+        request, "genre_details", "genre_id", genre_ids
+    )
+    genres = await genre_service.get_by_ids(missing_ids)
+    return [
+        (
+            cached_genres[genre_id]
+            if genre_id in cached_genres
+            else Genre(id=genres[genre_id].id, name=genres[genre_id].name)
+        )
+        for genre_id in genre_ids
+        if genre_id in cached_genres or genre_id in genres
+    ]
+
+
 @router.get("/", response_model=List[Genre])
 async def genre_list(
+    response: Response,
     page: Optional[int] = 1,
     size: Optional[int] = 50,
     sort: Optional[SortFields] = SortFields.name__asc,
+    cursor: Optional[str] = None,
     genre_service: GenreService = Depends(get_genre_service),
 ) -> List[Genre]:
     sort_value, sort_order = sort.name.split("__")
-    genres = await genre_service.get_genres_list(
-        page=page, size=size, sort_value=sort_value, sort_order=sort_order
+    # Жанры сортируются по строковым полям id и name
+    search_after = parse_cursor(cursor, value_types=(str,))
+    if is_fast_serialization("genre_list"):
+        genres, next_sort_values = await genre_service.get_genres_source_list(
+            page=page,
+            size=size,
+            sort_value=sort_value,
+            sort_order=sort_order,
+            search_after=search_after,
+        )
+        set_next_cursor(response, next_sort_values)
+        return raw_response(genres, response)
+
+    genres, next_sort_values = await genre_service.get_genres_list(
+        page=page,
+        size=size,
+        sort_value=sort_value,
+        sort_order=sort_order,
+        search_after=search_after,
     )
+    set_next_cursor(response, next_sort_values)
     return [Genre(id=genre.id, name=genre.name) for genre in genres]
@@ -0,0 +1,64 @@
+from http import HTTPStatus
+from typing import Dict, List, Optional, Tuple, Type, Union
+
+from fastapi import HTTPException, Response
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel
+
+from core import config
+from core.pagination import SORT_VALUE_TYPES, decode_cursor, encode_cursor
+
+# Заголовок ответа с курсором следующей страницы
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def parse_cursor(
+    cursor: Optional[str], value_types: Tuple[type, ...] = SORT_VALUE_TYPES
+) -> Optional[List]:
+    """Разбор курсора из параметров запроса, некорректный курсор - ошибка клиента"""
+    if not cursor:
+        return None
+    try:
+        return decode_cursor(cursor, value_types)
+    except ValueError as e:
+        raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail=str(e))
+
+
+def set_next_cursor(response: Response, next_sort_values: Optional[List]) -> None:
+    if next_sort_values:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(next_sort_values)
+
+
+def parse_fields(fields: Optional[str], model: Type[BaseModel]) -> Optional[List[str]]:
+    """
+    Разбор параметра fields - списка полей модели ответа через запятую.
+    Поле id возвращается всегда.
+    """
+    if not fields:
+        return None
+
+    requested_fields = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown_fields = [field for field in requested_fields if field not in model.__fields__]
+    if unknown_fields:
+        raise HTTPException(
+            status_code=HTTPStatus.BAD_REQUEST,
+            detail=f'Unknown fields "{", ".join(unknown_fields)}"',
+        )
+    return ["id", *(field for field in requested_fields if field != "id")]
+
+
+def is_fast_serialization(route_name: str) -> bool:
+    """Ручка отдает документы elastic без валидации, см. config.FAST_SERIALIZATION_ROUTES"""
+    return route_name in config.FAST_SERIALIZATION_ROUTES
+
+
+def raw_response(
+    content: Union[Dict, List[Dict]], response: Optional[Response] = None
+) -> ORJSONResponse:
+    """
+    Ответ отдается без валидации по модели ответа: частичные документы
+    или документы elastic, которые etl пишет в индексы со строгой схемой.
+    Заголовки, выставленные обработчиком в response, сохраняются.
+    """
+    headers = dict(response.headers) if response is not None else None
+    return ORJSONResponse(content=content, headers=headers)
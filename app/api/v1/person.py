@@ -3,12 +3,21 @@ from http import HTTPStatus
 from typing import List, Optional
 from uuid import UUID
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from pydantic import UUID4, BaseModel
 
+from api.v1.batch import get_cached_items, parse_batch_ids
+from api.v1.params import (
+    is_fast_serialization,
+    parse_cursor,
+    raw_response,
+    set_next_cursor,
+)
+from core import config
+from core.timing import TimedRoute
 from services.person import PersonService, get_person_service
 
-router = APIRouter()
+router = APIRouter(route_class=TimedRoute)
 
 
 class RoleType(Enum):
@@ -28,12 +37,19 @@ class Person(BaseModel):
     film_ids: List[UUID4]
 
 
+class PersonSuggest(BaseModel):
+    """Модель ответа для автодополнения имени персоны."""
+
+    id: UUID4
+    full_name: str
+
+
 class PersonFilm(BaseModel):
     """Модель ответа для фильмов в которых учавствовала персона."""
 
     id: UUID4
     title: str
-    imdb_rating: float
+    imdb_rating: Optional[float]
     roles: List[RoleType]
 
 
@@ -47,24 +63,59 @@ async def person_details(
     return Person(id=person.id, full_name=person.full_name, roles=person_roles, film_ids=film_ids)
 
 
+@router.get("/batch/", response_model=List[Person])
+async def person_batch(
+    request: Request,
+    ids: List[UUID] = Query(..., alias="id"),
+    person_service: PersonService = Depends(get_person_service),
+) -> List[Person]:
+    """Персоны по списку id. Персоны из кэша ответов person_details не запрашиваются из elastic"""
+    person_ids = parse_batch_ids(ids)
+    cached_persons, missing_ids = await get_cached_items(
+        request, "person_details", "person_id", person_ids
+    )
+    persons_full_data = await person_service.get_by_ids(missing_ids)
+    persons = []
+    for person_id in person_ids:
+        if person_id in cached_persons:
+            persons.append(cached_persons[person_id])
+        elif person_id in persons_full_data:
+            person, person_roles, film_ids = persons_full_data[person_id]
+            persons.append(
+                Person(
+                    id=person.id,
+                    full_name=person.full_name,
+                    roles=person_roles,
+                    film_ids=film_ids,
+                )
+            )
+    return persons
+
+
 @router.get("/{person_id:uuid}/film/", response_model=List[PersonFilm])
 async def person_film_list(
     person_id: UUID, person_service: PersonService = Depends(get_person_service)
 ) -> List[PersonFilm]:
+    if is_fast_serialization("person_film_list"):
+        return raw_response(await person_service.get_person_film_source_list(person_id))
+
     films = await person_service.get_person_film_list(person_id)
     return [PersonFilm(**film) for film in films]
 
 
 @router.get("/search/", response_model=List[Person])
 async def person_search(
+    response: Response,
     page: Optional[int] = 1,
     size: Optional[int] = 50,
     query: Optional[str] = "",
+    cursor: Optional[str] = None,
     person_service: PersonService = Depends(get_person_service),
 ) -> List[Person]:
-    persons_full_data = await person_service.search_person_by_full_name(
-        page=page, size=size, match_obj=query
+    persons_full_data, next_sort_values = await person_service.search_person_by_full_name(
+        page=page, size=size, match_obj=query, search_after=parse_cursor(cursor)
     )
+    set_next_cursor(response, next_sort_values)
     persons = []
     for person_full_data in persons_full_data:
         person, person_roles, film_ids = person_full_data
@@ -72,3 +123,13 @@ async def person_search(
             Person(id=person.id, full_name=person.full_name, roles=person_roles, film_ids=film_ids)
         )
     return persons
+
+
+@router.get("/suggest/", response_model=List[PersonSuggest])
+async def person_suggest(
+    query: str = Query(..., min_length=1),
+    size: int = Query(default=config.SUGGEST_MAX_SIZE, ge=1, le=config.SUGGEST_MAX_SIZE),
+    person_service: PersonService = Depends(get_person_service),
+) -> List[PersonSuggest]:
+    """Автодополнение имени персоны по мере ввода запроса"""
+    return await person_service.suggest_persons(match_obj=query, size=size)
@@ -0,0 +1,46 @@
+from typing import List
+
+from fastapi import APIRouter, Depends, Query
+from pydantic import BaseModel
+
+from api.v1.film import FilmListModel
+from api.v1.genre import Genre
+from api.v1.person import Person
+from core import config
+from core.timing import TimedRoute
+from services.search import SearchService, get_search_service
+
+router = APIRouter(route_class=TimedRoute)
+
+
+class SearchResult(BaseModel):
+    """Модель ответа для поиска по фильмам, персонам и жанрам"""
+
+    films: List[FilmListModel]
+    persons: List[Person]
+    genres: List[Genre]
+
+
+@router.get("/", response_model=SearchResult)
+async def search(
+    query: str = Query(..., min_length=1),
+    films_size: int = Query(default=10, ge=0, le=config.SEARCH_SECTION_MAX_SIZE),
+    persons_size: int = Query(default=10, ge=0, le=config.SEARCH_SECTION_MAX_SIZE),
+    genres_size: int = Query(default=5, ge=0, le=config.SEARCH_SECTION_MAX_SIZE),
+    search_service: SearchService = Depends(get_search_service),
+) -> SearchResult:
+    """Поиск фильмов по названию, персон по имени и жанров по названию одним запросом"""
+    films, persons_full_data, genres = await search_service.search(
+        match_obj=query,
+        films_size=films_size,
+        persons_size=persons_size,
+        genres_size=genres_size,
+    )
+    return SearchResult(
+        films=films,
+        persons=[
+            Person(id=person.id, full_name=person.full_name, roles=person_roles, film_ids=film_ids)
+            for person, person_roles, film_ids in persons_full_data
+        ],
+        genres=[Genre(id=genre.id, name=genre.name) for genre in genres],
+    )
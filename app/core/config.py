@@ -17,3 +17,96 @@ ELASTIC_DSN = os.getenv("ELASTIC_DSN", "http://localhost:9200/")
 
 # Корень проекта
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Время, в течение которого закэшированный ответ считается свежим, в секундах
+CACHE_EXPIRE_IN_SECONDS = int(os.getenv("CACHE_EXPIRE_IN_SECONDS", 60))
+# Время, в течение которого после CACHE_EXPIRE_IN_SECONDS отдается устаревший ответ,
+# пока он обновляется в фоне
+CACHE_STALE_IN_SECONDS = int(os.getenv("CACHE_STALE_IN_SECONDS", 60 * 10))
+# Время, в течение которого после CACHE_STALE_IN_SECONDS устаревший ответ
+# отдается только при ошибке получения нового ответа
+CACHE_STALE_IF_ERROR_IN_SECONDS = int(os.getenv("CACHE_STALE_IF_ERROR_IN_SECONDS", 60 * 60))
+
+# Сжатие больших ответов в redis: "" - без сжатия, "gzip" или "zstd" (нужен пакет zstandard)
+CACHE_COMPRESSION = os.getenv("CACHE_COMPRESSION", "")
+# Минимальный размер ответа для сжатия, в байтах
+CACHE_COMPRESSION_MIN_SIZE = int(os.getenv("CACHE_COMPRESSION_MIN_SIZE", 4096))
+
+# Канал redis, в который etl публикует id обновленных документов для сброса кэша
+CACHE_INVALIDATION_CHANNEL = os.getenv("CACHE_INVALIDATION_CHANNEL", "cache:invalidate")
+
+# Максимальное количество id в одном запросе к batch ручкам
+BATCH_MAX_IDS = int(os.getenv("BATCH_MAX_IDS", 100))
+
+# Настройки локального (in-process) кэша ответов
+LOCAL_CACHE_MAXSIZE = int(os.getenv("LOCAL_CACHE_MAXSIZE", 256))
+LOCAL_CACHE_TTL = float(os.getenv("LOCAL_CACHE_TTL", 5))
+
+# Время блокировки ключа кэша между воркерами на время вычисления ответа, в секундах.
+# 0 - схлопывание промахов работает только внутри воркера
+CACHE_LOCK_TIMEOUT = float(os.getenv("CACHE_LOCK_TIMEOUT", 0))
+
+# Окно, в течение которого запросы документов elastic по id собираются в один mget,
+# в секундах. 0 - собираются запросы, сделанные в одном шаге event loop
+ELASTIC_LOADER_WINDOW = float(os.getenv("ELASTIC_LOADER_WINDOW", 0))
+# Максимальное количество id в одном mget
+ELASTIC_LOADER_MAX_BATCH_SIZE = int(os.getenv("ELASTIC_LOADER_MAX_BATCH_SIZE", 100))
+
+# Максимальное количество подсказок в ответе ручек автодополнения
+SUGGEST_MAX_SIZE = int(os.getenv("SUGGEST_MAX_SIZE", 10))
+
+# Максимальное количество документов в каждом разделе ответа общего поиска
+SEARCH_SECTION_MAX_SIZE = int(os.getenv("SEARCH_SECTION_MAX_SIZE", 50))
+
+# Ручки, которые отдают документы elastic без валидации моделями pydantic, через запятую.
+# Поддерживаются film_details, film_list, film_search, genre_details, genre_list, person_film_list
+FAST_SERIALIZATION_ROUTES = {
+    route.strip()
+    for route in os.getenv("FAST_SERIALIZATION_ROUTES", "").split(",")
+    if route.strip()
+}
+
+# Интервал проверки версии индекса жанров для обновления каталога жанров в памяти, в секундах
+GENRE_CATALOGUE_REFRESH_INTERVAL = float(os.getenv("GENRE_CATALOGUE_REFRESH_INTERVAL", 60))
+# Максимальное количество жанров в каталоге
+GENRE_CATALOGUE_MAX_SIZE = int(os.getenv("GENRE_CATALOGUE_MAX_SIZE", 10000))
+
+# Бюджет времени на обработку запроса, в секундах. Таймауты обращений к elastic и redis
+# не превышают оставшееся время. 0 - без ограничения
+REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", 5))
+# Таймауты одного обращения к elastic и redis, в секундах
+ELASTIC_TIMEOUT = float(os.getenv("ELASTIC_TIMEOUT", 2))
+REDIS_TIMEOUT = float(os.getenv("REDIS_TIMEOUT", 0.2))
+# Таймаут удаления ответов из кэша по тегам, в секундах. Выполняется вне запросов,
+# а множества тегов популярных документов бывают большими
+REDIS_INVALIDATION_TIMEOUT = float(os.getenv("REDIS_INVALIDATION_TIMEOUT", 5))
+
+# Настройки предохранителей для elastic и redis: цепь размыкается, когда доля ошибок среди
+# последних CIRCUIT_BREAKER_WINDOW вызовов (не меньше CIRCUIT_BREAKER_MIN_CALLS) достигает
+# CIRCUIT_BREAKER_FAILURE_RATE, и остается разомкнутой CIRCUIT_BREAKER_RECOVERY_TIMEOUT секунд
+CIRCUIT_BREAKER_FAILURE_RATE = float(os.getenv("CIRCUIT_BREAKER_FAILURE_RATE", 0.5))
+CIRCUIT_BREAKER_MIN_CALLS = int(os.getenv("CIRCUIT_BREAKER_MIN_CALLS", 20))
+CIRCUIT_BREAKER_WINDOW = int(os.getenv("CIRCUIT_BREAKER_WINDOW", 100))
+CIRCUIT_BREAKER_RECOVERY_TIMEOUT = float(os.getenv("CIRCUIT_BREAKER_RECOVERY_TIMEOUT", 5))
+
+# Заголовок Server-Timing с разбивкой времени обработки запроса
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "true").lower() == "true"
+# Токен для профилирования запроса (заголовок X-Profile-Token или параметр profile),
+# пустой - профилирование выключено. Нужен пакет pyinstrument
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN", "")
+# Интервал сэмплирования профилировщика, в секундах
+PROFILING_INTERVAL = float(os.getenv("PROFILING_INTERVAL", 0.001))
+
+# Адрес и порт сервера при запуске python main.py
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", 8000))
+# Количество воркеров, 0 - по числу доступных процессу ядер
+WORKERS = int(os.getenv("WORKERS", 0))
+# Уровень логирования сервера
+LOG_LEVEL = os.getenv("LOG_LEVEL", "info")
+# Время на завершение запросов в обработке и фоновых задач при остановке воркера, в секундах
+GRACEFUL_SHUTDOWN_TIMEOUT = float(os.getenv("GRACEFUL_SHUTDOWN_TIMEOUT", 30))
+# Максимальное количество соединений с redis и elastic на все воркеры узла,
+# пул каждого воркера получает свою долю
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", 64))
+ELASTIC_MAX_CONNECTIONS = int(os.getenv("ELASTIC_MAX_CONNECTIONS", 64))
@@ -0,0 +1,113 @@
+"""
+Метрики prometheus.
+При запуске нескольких воркеров в переменной окружения PROMETHEUS_MULTIPROC_DIR указывается
+пустой каталог, общий для всех воркеров: значения метрик пишутся в файлы этого каталога,
+а /metrics любого воркера отдает сумму по всем воркерам.
+"""
+
+import glob
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+MULTIPROCESS_MODE = bool(os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+
+# Шаблон пути ручки текущего запроса, например /api/v1/film/{film_id:uuid}/
+current_route: ContextVar[str] = ContextVar("current_route", default="")
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Время обработки запроса",
+    ["method", "route", "status"],
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress",
+    "Запросы в обработке",
+    ["method", "route"],
+    multiprocess_mode="livesum",
+)
+RESPONSE_CACHE = Counter(
+    "response_cache_requests_total",
+    "Результат обращения к кэшу ответов: hit, stale, miss, bypass",
+    ["route", "result"],
+)
+CACHE_TIER = Counter(
+    "cache_tier_requests_total",
+    "Попадания и промахи по уровням кэша ответов",
+    ["tier", "result"],
+)
+ELASTIC_LATENCY = Histogram(
+    "elasticsearch_request_duration_seconds",
+    "Время запроса к elastic",
+    ["index", "operation", "route"],
+)
+REDIS_POOL = Gauge(
+    "redis_pool_connections",
+    "Соединения пула redis: size - открытые, free - свободные",
+    ["state"],
+    multiprocess_mode="livesum",
+)
+
+
+@contextmanager
+def track_elastic(index: str, operation: str) -> Iterator[None]:
+    """Замер времени запроса к elastic с привязкой к ручке, которая его сделала"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        ELASTIC_LATENCY.labels(
+            index=index, operation=operation, route=current_route.get() or "background"
+        ).observe(time.perf_counter() - start)
+
+
+def set_redis_pool_usage(size: int, free: int) -> None:
+    REDIS_POOL.labels(state="size").set(size)
+    REDIS_POOL.labels(state="free").set(free)
+
+
+def render_metrics() -> bytes:
+    if MULTIPROCESS_MODE:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry)
+
+
+def mark_process_dead(pid: int) -> None:
+    """Значения live-метрик завершившегося воркера больше не учитываются"""
+    if MULTIPROCESS_MODE:
+        multiprocess.mark_process_dead(pid)
+
+
+def prepare_multiprocess_dir(workers: int) -> None:
+    """
+    Подготовка каталога метрик запускающим процессом до старта воркеров.
+    Если воркеров несколько, а PROMETHEUS_MULTIPROC_DIR не задан, создается временный каталог.
+    Файлы метрик предыдущего запуска удаляются.
+    """
+    path = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if not path:
+        if workers == 1:
+            return
+        path = tempfile.mkdtemp(prefix="prometheus_")
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = path
+
+    os.makedirs(path, exist_ok=True)
+    for file_path in glob.glob(os.path.join(path, "*.db")):
+        os.remove(file_path)
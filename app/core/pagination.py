@@ -0,0 +1,48 @@
+import base64
+import binascii
+from typing import Dict, List, Optional, Tuple
+
+import orjson
+
+
+def encode_cursor(sort_values: List) -> str:
+    """
+    Курсор для постраничного чтения через search_after.
+    Для клиента курсор непрозрачен - это значения сортировки последнего документа страницы.
+    """
+    return base64.urlsafe_b64encode(orjson.dumps(sort_values)).decode().rstrip("=")
+
+
+# Все списки сортируются по полю (или _score) и по id: курсор - это пара значений
+CURSOR_SIZE = 2
+# Типы первого значения курсора по умолчанию: рейтинг или _score
+SORT_VALUE_TYPES = (int, float)
+
+
+def decode_cursor(cursor: str, value_types: Tuple[type, ...] = SORT_VALUE_TYPES) -> List:
+    """
+    Значения сортировки из курсора. Курсор должен соответствовать сортировке списка:
+    значение поля сортировки одного из value_types и строковый id
+    """
+    try:
+        sort_values = orjson.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (binascii.Error, ValueError):
+        raise ValueError(f'Invalid cursor "{cursor}"')
+
+    if not isinstance(sort_values, list) or len(sort_values) != CURSOR_SIZE:
+        raise ValueError(f'Invalid cursor "{cursor}"')
+    sort_value, doc_id = sort_values
+    if (
+        isinstance(sort_value, bool)
+        or not isinstance(sort_value, value_types)
+        or not isinstance(doc_id, str)
+    ):
+        raise ValueError(f'Invalid cursor "{cursor}"')
+    return sort_values
+
+
+def get_next_sort_values(hits: List[Dict], size: int) -> Optional[List]:
+    """Значения сортировки последнего документа, если за полной страницей могут быть еще"""
+    if len(hits) < size or not hits:
+        return None
+    return hits[-1]["sort"]
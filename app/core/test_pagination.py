@@ -0,0 +1,54 @@
+import base64
+
+import orjson
+import pytest
+
+from core.pagination import decode_cursor, encode_cursor, get_next_sort_values
+
+FILM_ID = "4a74d886-eeaf-4cd6-815a-dd728b8cc0ca"
+
+
+def raw_cursor(value) -> str:
+    return base64.urlsafe_b64encode(orjson.dumps(value)).decode()
+
+
+@pytest.mark.parametrize("sort_values", [[8.1, FILM_ID], [0, FILM_ID], [-1.5, FILM_ID]])
+def test_cursor_round_trip(sort_values):
+    cursor = encode_cursor(sort_values)
+    assert "=" not in cursor
+    assert decode_cursor(cursor) == sort_values
+
+
+def test_cursor_with_string_sort_value():
+    cursor = encode_cursor(["Drama", FILM_ID])
+    assert decode_cursor(cursor, value_types=(str,)) == ["Drama", FILM_ID]
+    # Курсор списка жанров не подходит списку фильмов и наоборот
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+    with pytest.raises(ValueError):
+        decode_cursor(encode_cursor([8.1, FILM_ID]), value_types=(str,))
+
+
+@pytest.mark.parametrize(
+    "cursor",
+    [
+        "",
+        "not a cursor",
+        raw_cursor({"sort": [8.1, FILM_ID]}),
+        raw_cursor([8.1]),
+        raw_cursor([8.1, FILM_ID, FILM_ID]),
+        raw_cursor([None, FILM_ID]),
+        raw_cursor([True, FILM_ID]),
+        raw_cursor([8.1, 1]),
+    ],
+)
+def test_invalid_cursor(cursor):
+    with pytest.raises(ValueError, match="Invalid cursor"):
+        decode_cursor(cursor)
+
+
+def test_next_sort_values_only_after_full_page():
+    hits = [{"sort": [9.2, "a"]}, {"sort": [8.1, "b"]}]
+    assert get_next_sort_values(hits, size=2) == [8.1, "b"]
+    assert get_next_sort_values(hits, size=3) is None
+    assert get_next_sort_values([], size=0) is None
@@ -0,0 +1,145 @@
+import hmac
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Callable, Dict, Iterator, List, Optional
+
+from fastapi import Request, Response
+from fastapi.responses import HTMLResponse
+from fastapi.routing import APIRoute
+
+from core import config
+
+logger = logging.getLogger(__name__)
+
+try:
+    from pyinstrument import Profiler
+except ImportError:
+    Profiler = None
+
+# Заголовок и параметр запроса с токеном для профилирования запроса
+PROFILING_HEADER = "X-Profile-Token"
+PROFILING_PARAM = "profile"
+
+
+class Timings:
+    """Суммарное время и количество замеров по этапам обработки запроса"""
+
+    def __init__(self):
+        self.durations: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+
+    def add(self, name: str, duration: float) -> None:
+        self.durations[name] = self.durations.get(name, 0) + duration
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+    def get(self, name: str) -> float:
+        return self.durations.get(name, 0)
+
+    def server_timing(self, total: float) -> str:
+        """
+        Значение заголовка Server-Timing, время в миллисекундах:
+        cache - поиск в кэше ответов, es - запросы к elastic,
+        validation - обработчик ручки без запросов к elastic (построение моделей),
+        serialization - проверка по модели ответа и сериализация в json.
+        """
+        metrics: List[str] = []
+        if "cache" in self.durations:
+            metrics.append(f"cache;dur={self.get('cache') * 1000:.2f}")
+        if "es" in self.durations:
+            metrics.append(f'es;desc="{self.counts["es"]} calls";dur={self.get("es") * 1000:.2f}')
+        if "handler" in self.durations:
+            validation = max(self.get("handler") - self.get("es"), 0)
+            serialization = max(self.get("route") - self.get("handler"), 0)
+            metrics.append(f"validation;dur={validation * 1000:.2f}")
+            metrics.append(f"serialization;dur={serialization * 1000:.2f}")
+        metrics.append(f"total;dur={total * 1000:.2f}")
+        return ", ".join(metrics)
+
+
+# Замеры текущего запроса, None - замеры выключены
+request_timings: ContextVar[Optional[Timings]] = ContextVar("request_timings", default=None)
+
+
+def start_timings() -> Optional[Timings]:
+    if not config.SERVER_TIMING_ENABLED:
+        return None
+    timings = Timings()
+    request_timings.set(timings)
+    return timings
+
+
+@contextmanager
+def measure(name: str) -> Iterator[None]:
+    """Замер этапа обработки текущего запроса"""
+    timings = request_timings.get()
+    if timings is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - start)
+
+
+def check_profiling() -> None:
+    """Предупреждение при старте, если профилирование включено, но pyinstrument не установлен"""
+    if config.PROFILING_TOKEN and Profiler is None:
+        logger.warning("PROFILING_TOKEN is set, but pyinstrument is not installed")
+
+
+def is_profiling_requested(request: Request) -> bool:
+    """Профилирование запрошено заголовком или параметром запроса с верным токеном"""
+    if not config.PROFILING_TOKEN or Profiler is None:
+        return False
+    token = request.headers.get(PROFILING_HEADER) or request.query_params.get(PROFILING_PARAM)
+    return token is not None and hmac.compare_digest(token, config.PROFILING_TOKEN)
+
+
+def timed_endpoint(endpoint: Callable) -> Callable:
+    # include_router создает ручки заново с уже обернутым обработчиком
+    if getattr(endpoint, "is_timed", False):
+        return endpoint
+
+    @wraps(endpoint)
+    async def wrapper(*args, **kwargs):
+        with measure("handler"):
+            return await endpoint(*args, **kwargs)
+
+    wrapper.is_timed = True
+    return wrapper
+
+
+class TimedRoute(APIRoute):
+    """
+    Ручка с замерами времени обработчика и сериализации ответа для Server-Timing.
+    При запросе профилирования вместо ответа отдается отчет pyinstrument.
+    """
+
+    def __init__(self, path: str, endpoint: Callable, **kwargs):
+        super().__init__(path, timed_endpoint(endpoint), **kwargs)
+
+    def get_route_handler(self) -> Callable:
+        route_handler = super().get_route_handler()
+
+        async def timed_route_handler(request: Request) -> Response:
+            if is_profiling_requested(request):
+                return await profile(route_handler, request)
+            with measure("route"):
+                return await route_handler(request)
+
+        return timed_route_handler
+
+
+async def profile(route_handler: Callable, request: Request) -> Response:
+    profiler = Profiler(interval=config.PROFILING_INTERVAL, async_mode="enabled")
+    profiler.start()
+    try:
+        await route_handler(request)
+    finally:
+        profiler.stop()
+    return HTMLResponse(profiler.output_html())
@@ -1,3 +1,7 @@
+import asyncio
+from typing import Coroutine, Dict, Set, Tuple
+
+
 class async_iterator_wrapper:
     def __init__(self, obj):
         self._it = iter(obj)
@@ -11,3 +15,56 @@ class async_iterator_wrapper:
         except StopIteration:
             raise StopAsyncIteration
         return value
+
+
+async def call_asgi(app, scope: dict) -> Tuple[int, Dict[str, str], bytes]:
+    """Выполнение http запроса без тела к asgi приложению, ответ собирается целиком"""
+    response_start: dict = {}
+    body = []
+    request_sent = False
+    response_complete = asyncio.Event()
+
+    async def receive():
+        # После тела запроса клиент "отключается" только когда ответ получен целиком,
+        # middleware приложения ждут отключения клиента, пока отдают ответ
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await response_complete.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response_start.update(message)
+        elif message["type"] == "http.response.body":
+            body.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                response_complete.set()
+
+    await app(dict(scope), receive, send)
+    headers = {
+        name.decode("latin-1"): value.decode("latin-1")
+        for name, value in response_start.get("headers", [])
+    }
+    return response_start["status"], headers, b"".join(body)
+
+
+# Ссылки на фоновые задачи, чтобы их не удалил сборщик мусора до завершения
+background_tasks: Set[asyncio.Task] = set()
+
+
+def run_in_background(coro: Coroutine) -> asyncio.Task:
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
+async def wait_background_tasks(timeout: float) -> None:
+    """Ожидание фоновых задач при остановке воркера, незавершенные за timeout отменяются"""
+    if not background_tasks:
+        return
+    _, pending = await asyncio.wait(set(background_tasks), timeout=timeout)
+    for task in pending:
+        task.cancel()
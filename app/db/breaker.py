@@ -0,0 +1,126 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from contextvars import ContextVar, Token
+from typing import Awaitable, Callable, Optional, TypeVar
+
+from core import config
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Момент (time.monotonic), к которому должен быть готов ответ на текущий запрос
+request_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+
+class CircuitOpenError(Exception):
+    """Обращение к зависимости отклонено без вызова, т.к. цепь разомкнута"""
+
+
+def set_request_deadline(timeout: float) -> Token:
+    """Бюджет времени на обработку запроса, 0 - без ограничения"""
+    return request_deadline.set(time.monotonic() + timeout if timeout else None)
+
+
+def get_call_timeout(timeout: float) -> Optional[float]:
+    """
+    Таймаут одного обращения к зависимости: не больше timeout
+    и не больше времени, оставшегося до конца бюджета запроса.
+    """
+    deadline = request_deadline.get()
+    if deadline is None:
+        return timeout or None
+
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise asyncio.TimeoutError("Request deadline exceeded")
+    return min(timeout, remaining) if timeout else remaining
+
+
+class CircuitBreaker:
+    """
+    Предохранитель для обращений к зависимости.
+    Цепь размыкается, когда среди последних window вызовов (но не меньше min_calls)
+    доля ошибок достигает failure_rate. Пока цепь разомкнута, вызовы сразу завершаются
+    CircuitOpenError. Через recovery_timeout пропускается один пробный вызов:
+    успешный замыкает цепь, неудачный снова размыкает ее.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_rate: float = config.CIRCUIT_BREAKER_FAILURE_RATE,
+        min_calls: int = config.CIRCUIT_BREAKER_MIN_CALLS,
+        window: int = config.CIRCUIT_BREAKER_WINDOW,
+        recovery_timeout: float = config.CIRCUIT_BREAKER_RECOVERY_TIMEOUT,
+    ):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.recovery_timeout = recovery_timeout
+        self.outcomes: deque = deque(maxlen=window)
+        self.opened_at: Optional[float] = None
+        self.trial_running = False
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    async def call(
+        self,
+        func: Callable[[], Awaitable[T]],
+        timeout: float,
+        is_failure: Callable[[Exception], bool] = lambda e: True,
+    ) -> T:
+        """
+        Вызов func с таймаутом из бюджета запроса.
+        Исключения, для которых is_failure возвращает False (например, 404), ошибками
+        зависимости не считаются.
+        """
+        call_timeout = get_call_timeout(timeout)
+        is_trial = self._before_call()
+        try:
+            result = await asyncio.wait_for(func(), timeout=call_timeout)
+        except asyncio.CancelledError:
+            if is_trial:
+                self.trial_running = False
+            raise
+        except Exception as e:
+            self._record(failed=is_failure(e), is_trial=is_trial)
+            raise
+        self._record(failed=False, is_trial=is_trial)
+        return result
+
+    def _before_call(self) -> bool:
+        """Проверка, можно ли выполнить вызов. Возвращает True для пробного вызова"""
+        if self.opened_at is None:
+            return False
+        if self.trial_running or time.monotonic() - self.opened_at < self.recovery_timeout:
+            raise CircuitOpenError(f'Circuit "{self.name}" is open')
+        self.trial_running = True
+        return True
+
+    def _record(self, failed: bool, is_trial: bool) -> None:
+        if is_trial:
+            self.trial_running = False
+            if failed:
+                self.opened_at = time.monotonic()
+            else:
+                self.opened_at = None
+                self.outcomes.clear()
+                logger.warning(f'Circuit "{self.name}" closed')
+            return
+
+        if self.opened_at is not None:
+            # Результаты вызовов, начатых до размыкания цепи, не учитываются
+            return
+
+        self.outcomes.append(failed)
+        if (
+            len(self.outcomes) >= self.min_calls
+            and sum(self.outcomes) / len(self.outcomes) >= self.failure_rate
+        ):
+            self.opened_at = time.monotonic()
+            logger.error(f'Circuit "{self.name}" opened')
@@ -0,0 +1,414 @@
+import asyncio
+import gzip
+import logging
+import re
+import struct
+import time
+from collections import Counter, OrderedDict
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+)
+
+import aioredis
+
+from core import config, json
+from core.metrics import CACHE_TIER
+from db import redis
+from db.redis import RedisStorage
+
+logger = logging.getLogger(__name__)
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+UUID_RE = re.compile(rb"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}", re.I)
+
+# Списки и поиск зависят от всего индекса: новый документ, изменение порядка или фильтра
+# меняют ответ, хотя id в теле ответа те же. Такие ответы помечаются тегом индекса
+INDEX_TAG_PREFIX = b"index:"
+LIST_PATH_INDEXES = [
+    (re.compile(rb"/api/v1/film/(search/|suggest/)?"), (b"movies",)),
+    (re.compile(rb"/api/v1/genre/"), (b"genres",)),
+    (re.compile(rb"/api/v1/person/(search/|suggest/)"), (b"persons",)),
+    (re.compile(rb"/api/v1/search/"), (b"movies", b"persons", b"genres")),
+]
+
+# Версия, кодек сжатия тела, статус ответа, stale_at, expire_at, размер блока заголовков
+ENVELOPE_HEADER = struct.Struct("!BBHddI")
+ENVELOPE_VERSION = 1
+
+CODEC_NONE, CODEC_GZIP, CODEC_ZSTD = 0, 1, 2
+CODECS = {"gzip": CODEC_GZIP, "zstd": CODEC_ZSTD}
+COMPRESSORS: Dict[int, Callable[[bytes], bytes]] = {
+    CODEC_GZIP: lambda body: gzip.compress(body, compresslevel=1),
+}
+DECOMPRESSORS: Dict[int, Callable[[bytes], bytes]] = {
+    CODEC_NONE: lambda body: body,
+    CODEC_GZIP: gzip.decompress,
+}
+if zstandard is not None:
+    COMPRESSORS[CODEC_ZSTD] = zstandard.ZstdCompressor().compress
+    DECOMPRESSORS[CODEC_ZSTD] = zstandard.ZstdDecompressor().decompress
+
+COMPRESSION_CODEC = CODECS.get(config.CACHE_COMPRESSION, CODEC_NONE)
+if COMPRESSION_CODEC != CODEC_NONE and COMPRESSION_CODEC not in COMPRESSORS:
+    logger.warning(f'Cache compression "{config.CACHE_COMPRESSION}" is not available, disabled')
+
+
+class LocalCache:
+    """
+    In-process кэш с ограничением по размеру (LRU) и времени жизни записей (TTL).
+    Живет в памяти одного воркера и не разделяется между процессами.
+    Записи можно помечать тегами и удалять по ним.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, Tuple[float, Any, Tuple[Hashable, ...]]]" = OrderedDict()
+        self._tags: Dict[Hashable, Set[Hashable]] = {}
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+
+        expire_at, value, _ = item
+        if expire_at <= time.monotonic():
+            self.delete(key)
+            return None
+
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, tags: Iterable[Hashable] = ()) -> None:
+        self.delete(key)
+        tags = tuple(tags)
+        self._data[key] = (time.monotonic() + self.ttl, value, tags)
+        for tag in tags:
+            self._tags.setdefault(tag, set()).add(key)
+
+        while len(self._data) > self.maxsize:
+            self.delete(next(iter(self._data)))
+
+    def delete(self, key: Hashable) -> None:
+        item = self._data.pop(key, None)
+        if item is None:
+            return
+
+        for tag in item[2]:
+            tagged_keys = self._tags[tag]
+            tagged_keys.discard(key)
+            if not tagged_keys:
+                del self._tags[tag]
+
+    def delete_tagged(self, tags: Iterable[Hashable]) -> None:
+        for tag in tags:
+            for key in list(self._tags.get(tag, ())):
+                self.delete(key)
+
+
+class CacheEntry(NamedTuple):
+    """
+    Запись кэша ответов: статус, заголовки и тело ответа в том виде, в котором его отдало
+    приложение. До stale_at ответ свежий, с stale_at до expire_at - устаревший, но может быть
+    отдан, пока обновляется в фоне. После expire_at отдается только при ошибке получения ответа.
+
+    В redis запись хранится в компактном бинарном конверте:
+    заголовок ENVELOPE_HEADER, json список заголовков ответа и тело, возможно сжатое.
+    """
+
+    status_code: int
+    headers: Dict[str, str]
+    body: bytes
+    stale_at: float
+    expire_at: float
+
+    @classmethod
+    def create(cls, status_code: int, headers: Dict[str, str], body: bytes) -> "CacheEntry":
+        now = time.time()
+        stale_at = now + config.CACHE_EXPIRE_IN_SECONDS
+        return cls(
+            status_code=status_code,
+            # Длина тела будет посчитана заново при формировании ответа
+            headers={name: value for name, value in headers.items() if name != "content-length"},
+            body=body,
+            stale_at=stale_at,
+            expire_at=stale_at + config.CACHE_STALE_IN_SECONDS,
+        )
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> Optional["CacheEntry"]:
+        if len(data) < ENVELOPE_HEADER.size:
+            return None
+        version, codec, status_code, stale_at, expire_at, headers_size = (
+            ENVELOPE_HEADER.unpack_from(data)
+        )
+        if version != ENVELOPE_VERSION or codec not in DECOMPRESSORS:
+            # Запись в старом формате или сжатая недоступным кодеком
+            return None
+
+        headers_end = ENVELOPE_HEADER.size + headers_size
+        headers = json.loads(data[ENVELOPE_HEADER.size : headers_end])
+        body = DECOMPRESSORS[codec](data[headers_end:])
+        return cls(
+            status_code=status_code,
+            headers=dict(headers),
+            body=body,
+            stale_at=stale_at,
+            expire_at=expire_at,
+        )
+
+    def to_bytes(self) -> bytes:
+        codec, body = CODEC_NONE, self.body
+        if COMPRESSION_CODEC in COMPRESSORS and len(body) >= config.CACHE_COMPRESSION_MIN_SIZE:
+            codec = COMPRESSION_CODEC
+            body = COMPRESSORS[codec](body)
+
+        headers = json.dumps(list(self.headers.items())).encode()
+        header = ENVELOPE_HEADER.pack(
+            ENVELOPE_VERSION, codec, self.status_code, self.stale_at, self.expire_at, len(headers)
+        )
+        return b"".join((header, headers, body))
+
+    def is_fresh(self) -> bool:
+        return time.time() < self.stale_at
+
+    def is_stale(self) -> bool:
+        return self.stale_at <= time.time() < self.expire_at
+
+
+class CacheStats:
+    """Счетчики попаданий и промахов по уровням кэша"""
+
+    def __init__(self):
+        self.counter: Counter = Counter()
+
+    def hit(self, tier: str) -> None:
+        self.counter[(tier, "hit")] += 1
+        CACHE_TIER.labels(tier=tier, result="hit").inc()
+
+    def miss(self, tier: str) -> None:
+        self.counter[(tier, "miss")] += 1
+        CACHE_TIER.labels(tier=tier, result="miss").inc()
+
+    def as_dict(self) -> Dict[str, Dict[str, int]]:
+        stats: Dict[str, Dict[str, int]] = {}
+        for (tier, result), count in self.counter.items():
+            stats.setdefault(tier, {})[result] = count
+        return stats
+
+
+def get_tags(key: bytes, body: bytes) -> Set[bytes]:
+    """
+    Теги ответа - id фильмов, жанров и персон, встречающиеся в запросе или теле ответа,
+    а у списков и поиска еще и теги индексов (index:movies).
+    По ним ответ удаляется из кэша, когда etl обновляет соответствующие документы.
+    key - путь запроса и строка запроса через "?".
+    """
+    tags = {tag.lower() for tag in UUID_RE.findall(key)} | {
+        tag.lower() for tag in UUID_RE.findall(body)
+    }
+    path = key.split(b"?", 1)[0]
+    for path_re, indexes in LIST_PATH_INDEXES:
+        if path_re.fullmatch(path):
+            tags.update(INDEX_TAG_PREFIX + index for index in indexes)
+    return tags
+
+
+class TieredCache:
+    """
+    Двухуровневый кэш ответов:
+    L1 - LocalCache в памяти воркера, L2 - RedisStorage.
+    При попадании в L2 значение прогревает L1.
+    """
+
+    def __init__(self, local: LocalCache, storage: RedisStorage, stats: CacheStats):
+        self.local = local
+        self.storage = storage
+        self.stats = stats
+
+    async def get(self, key: Hashable) -> Optional[CacheEntry]:
+        entry = self.local.get(key)
+        if entry is not None:
+            self.stats.hit("local")
+            return entry
+        self.stats.miss("local")
+
+        data_in_redis = await self.storage.get_data_in_redis(key=key)
+        entry = CacheEntry.from_bytes(data_in_redis) if data_in_redis is not None else None
+        if entry is None:
+            self.stats.miss("redis")
+            return None
+        self.stats.hit("redis")
+
+        self.local.set(key, entry, tags=get_tags(key, entry.body))
+        return entry
+
+    async def get_many(self, keys: List[bytes]) -> Dict[bytes, CacheEntry]:
+        """Получение нескольких записей, промахи L1 читаются из redis одним запросом"""
+        entries = {}
+        missing_keys = []
+        for key in keys:
+            entry = self.local.get(key)
+            if entry is not None:
+                self.stats.hit("local")
+                entries[key] = entry
+            else:
+                self.stats.miss("local")
+                missing_keys.append(key)
+
+        if not missing_keys:
+            return entries
+
+        data_in_redis = await self.storage.get_many_data_in_redis(keys=missing_keys)
+        for key, data in zip(missing_keys, data_in_redis):
+            entry = CacheEntry.from_bytes(data) if data is not None else None
+            if entry is None:
+                self.stats.miss("redis")
+                continue
+            self.stats.hit("redis")
+            self.local.set(key, entry, tags=get_tags(key, entry.body))
+            entries[key] = entry
+        return entries
+
+    async def set(
+        self, key: Hashable, status_code: int, headers: Dict[str, str], body: bytes
+    ) -> CacheEntry:
+        entry = CacheEntry.create(status_code=status_code, headers=headers, body=body)
+        tags = get_tags(key, body)
+        await self.storage.put_data_from_redis(
+            key=key,
+            value=entry.to_bytes(),
+            expire=config.CACHE_EXPIRE_IN_SECONDS
+            + config.CACHE_STALE_IN_SECONDS
+            + config.CACHE_STALE_IF_ERROR_IN_SECONDS,
+            tags=tags,
+        )
+        self.local.set(key, entry, tags=tags)
+        return entry
+
+    async def invalidate(self, tags: Set[bytes]) -> None:
+        """Удаление из кэша всех ответов, помеченных хотя бы одним из тегов"""
+        self.local.delete_tagged(tags)
+        await self.storage.delete_tagged(tags)
+
+    async def wait(
+        self, key: Hashable, timeout: float, interval: float = 0.05
+    ) -> Optional[CacheEntry]:
+        """Ожидание появления свежего ответа в redis, пока его вычисляет другой воркер"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            await asyncio.sleep(interval)
+            data_in_redis = await self.storage.get_data_in_redis(key=key)
+            entry = CacheEntry.from_bytes(data_in_redis) if data_in_redis is not None else None
+            if entry is not None and entry.is_fresh():
+                self.local.set(key, entry, tags=get_tags(key, entry.body))
+                return entry
+        return None
+
+
+class SingleFlight:
+    """
+    Схлопывание одновременных вызовов с одинаковым ключом.
+    Результат вычисляет только первый вызов (лидер), остальные ждут его результат.
+    Если лидер завершился с ошибкой, ожидающие вычисляют результат самостоятельно.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+
+    def is_running(self, key: Hashable) -> bool:
+        return key in self._calls
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        future = self._calls.get(key)
+        if future is not None:
+            result = await asyncio.shield(future)
+            if result is not None:
+                return result
+            return await func()
+
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        try:
+            result = await func()
+            future.set_result(result)
+            return result
+        finally:
+            del self._calls[key]
+            if not future.done():
+                future.set_result(None)
+
+
+# Локальный кэш и статистика создаются один раз на воркер
+local_cache = LocalCache(maxsize=config.LOCAL_CACHE_MAXSIZE, ttl=config.LOCAL_CACHE_TTL)
+cache_stats = CacheStats()
+single_flight = SingleFlight()
+
+
+# Функция понадобится при внедрении зависимостей
+async def get_cache() -> TieredCache:
+    return TieredCache(local_cache, RedisStorage(await redis.get_redis()), cache_stats)
+
+
+async def invalidate_until_done(
+    response_cache: TieredCache, tags: Set[bytes], max_sleep_time: float = 5
+) -> None:
+    """Удаление ответов по тегам повторяется, пока не выполнится: ошибка redis логируется"""
+    sleep_time = 0.1
+    while True:
+        try:
+            await response_cache.invalidate(tags)
+            return
+        except (aioredis.RedisError, OSError, asyncio.TimeoutError) as e:
+            logger.warning(f"Cache invalidation failed with {e!r}, retry in {sleep_time}s")
+            await asyncio.sleep(sleep_time)
+            sleep_time = min(sleep_time * 2, max_sleep_time)
+
+
+async def listen_invalidations(on_invalidate: Optional[Callable[[str], None]] = None):
+    """
+    Подписка на id документов, обновленных etl, и теги их индексов.
+    Ответы, содержащие эти документы, а также списки и поиск по индексу
+    удаляются из redis и из локального кэша воркера.
+    on_invalidate вызывается с названием индекса обновленных документов.
+    """
+    while True:
+        connection = None
+        try:
+            connection = await aioredis.create_redis(config.REDIS_DSN)
+            (channel,) = await connection.subscribe(config.CACHE_INVALIDATION_CHANNEL)
+            while await channel.wait_message():
+                message = await channel.get_json()
+                tags = {item_id.lower().encode() for item_id in message.get("ids", [])}
+                tags.update(tag.encode() for tag in message.get("tags", []))
+                response_cache = await get_cache()
+                await invalidate_until_done(response_cache, tags)
+                logger.info(
+                    f'Invalidated cache for {len(message.get("ids", []))} '
+                    f'"{message.get("index")}" documents'
+                )
+                if on_invalidate is not None:
+                    on_invalidate(message.get("index"))
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Cache invalidation listener failed, reconnecting")
+            await asyncio.sleep(1)
+        finally:
+            if connection is not None:
+                connection.close()
+                await connection.wait_closed()
@@ -1,7 +1,60 @@
-from elasticsearch import AsyncElasticsearch
+from typing import Any
+
+from elasticsearch import AsyncElasticsearch, TransportError
+from elasticsearch.client.utils import NamespacedClient
+
+from core import config
+from core.metrics import track_elastic
+from core.timing import measure
+from db.breaker import CircuitBreaker
 
 es: AsyncElasticsearch = None
 
 # Функция понадобится при внедрении зависимостей
 async def get_elastic() -> AsyncElasticsearch:
     return es
+
+
+elastic_breaker = CircuitBreaker("elastic")
+
+
+def is_elastic_failure(e: Exception) -> bool:
+    """Ошибки клиента (404, 400) не говорят о проблемах elastic и цепь не размыкают"""
+    if isinstance(e, TransportError):
+        return not isinstance(e.status_code, int) or e.status_code >= 429
+    return True
+
+
+class GuardedElasticsearch:
+    """
+    Обертка над клиентом elastic: каждый запрос выполняется через elastic_breaker
+    с таймаутом ELASTIC_TIMEOUT, ограниченным бюджетом времени запроса.
+    """
+
+    # Методы, которые вызываются без предохранителя
+    UNGUARDED_METHODS = {"close"}
+
+    def __init__(self, client: Any, namespace: str = ""):
+        self.client = client
+        self.namespace = namespace
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self.client, name)
+        if isinstance(attr, NamespacedClient):
+            # es.indices, es.cluster и т.п.
+            return GuardedElasticsearch(attr, namespace=f"{name}.")
+        if name.startswith("_") or name in self.UNGUARDED_METHODS or not callable(attr):
+            return attr
+
+        operation = self.namespace + name
+
+        async def guarded(*args, **kwargs):
+            index = kwargs.get("index") or (args[0] if args and isinstance(args[0], str) else "")
+            with track_elastic(index=index or "_all", operation=operation), measure("es"):
+                return await elastic_breaker.call(
+                    lambda: attr(*args, **kwargs),
+                    timeout=config.ELASTIC_TIMEOUT,
+                    is_failure=is_elastic_failure,
+                )
+
+        return guarded
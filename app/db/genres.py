@@ -0,0 +1,161 @@
+import asyncio
+import logging
+from types import MappingProxyType
+from typing import Dict, List, Optional, Tuple
+
+from elasticsearch import AsyncElasticsearch
+
+from core import config
+
+logger = logging.getLogger(__name__)
+
+GENRES_INDEX = "genres"
+# Поля, по которым сортируются списки жанров
+SORT_FIELDS = ("id", "name")
+SORT_ORDERS = ("asc", "desc")
+
+
+class GenreCatalogue:
+    """
+    Неизменяемый снимок индекса жанров.
+    Хранит документы по id и заранее отсортированные списки для каждой сортировки.
+    Сортировка и значения курсора совпадают с запросом к elastic: поле сортировки, затем id.
+    """
+
+    def __init__(self, docs: List[Dict], version: Tuple):
+        self.version = version
+        self.genres = MappingProxyType({doc["id"]: doc for doc in docs})
+
+        by_id = sorted(docs, key=lambda doc: doc["id"])
+        self.sorted_genres = MappingProxyType(
+            {
+                (field, order): tuple(
+                    sorted(by_id, key=lambda doc: doc[field], reverse=order == "desc")
+                )
+                for field in SORT_FIELDS
+                for order in SORT_ORDERS
+            }
+        )
+
+    def __len__(self) -> int:
+        return len(self.genres)
+
+    def __contains__(self, genre_id: str) -> bool:
+        return genre_id in self.genres
+
+    def get(self, genre_id: str) -> Optional[Dict]:
+        return self.genres.get(genre_id)
+
+    def get_page(
+        self,
+        page: int,
+        size: int,
+        sort_value: str,
+        sort_order: str,
+        search_after: Optional[List] = None,
+    ) -> Tuple[List[Dict], Optional[List]]:
+        """Страница жанров и значения сортировки для следующей страницы"""
+        genres = self.sorted_genres[sort_value, sort_order]
+        if search_after:
+            start = next(
+                (
+                    i
+                    for i, doc in enumerate(genres)
+                    if self._is_after(doc, sort_value, sort_order, search_after)
+                ),
+                len(genres),
+            )
+        else:
+            start = (page - 1) * size
+
+        page_genres = list(genres[start : start + size])
+        if len(page_genres) < size or not page_genres:
+            return page_genres, None
+        last = page_genres[-1]
+        return page_genres, [last[sort_value], last["id"]]
+
+    @staticmethod
+    def _is_after(doc: Dict, sort_value: str, sort_order: str, search_after: List) -> bool:
+        value, genre_id = doc[sort_value], doc["id"]
+        after_value, after_id = search_after[0], search_after[-1]
+        if value != after_value:
+            return value > after_value if sort_order == "asc" else value < after_value
+        return genre_id > after_id
+
+
+genre_catalogue: Optional[GenreCatalogue] = None
+# Создается в работающем event loop при запуске обновления каталога
+refresh_requested: Optional[asyncio.Event] = None
+
+
+def get_genre_catalogue() -> Optional[GenreCatalogue]:
+    """Текущий снимок каталога жанров или None, если каталог еще не загружен"""
+    return genre_catalogue
+
+
+async def get_genres_version(elastic: AsyncElasticsearch) -> Tuple:
+    """Версия индекса жанров: меняется при любой записи или удалении документа"""
+    stats = await elastic.indices.stats(index=GENRES_INDEX, metric="docs,indexing")
+    primaries = stats["_all"]["primaries"]
+    return (
+        primaries["indexing"]["index_total"],
+        primaries["indexing"]["delete_total"],
+        primaries["docs"]["count"],
+    )
+
+
+async def load_genre_catalogue(elastic: AsyncElasticsearch) -> GenreCatalogue:
+    version = await get_genres_version(elastic)
+    # Документы, записанные etl перед сигналом, становятся видны поиску только после refresh
+    await elastic.indices.refresh(index=GENRES_INDEX)
+    response = await elastic.search(
+        index=GENRES_INDEX,
+        size=config.GENRE_CATALOGUE_MAX_SIZE,
+        _source=["id", "name"],
+    )
+    return GenreCatalogue([doc["_source"] for doc in response["hits"]["hits"]], version)
+
+
+async def refresh_genre_catalogue(elastic: AsyncElasticsearch, force: bool = False) -> None:
+    """Загрузка нового снимка каталога, если индекс жанров изменился"""
+    global genre_catalogue
+
+    if not force and genre_catalogue is not None:
+        if await get_genres_version(elastic) == genre_catalogue.version:
+            return
+
+    genre_catalogue = await load_genre_catalogue(elastic)
+    logger.info(f"Genre catalogue loaded, {len(genre_catalogue)} genres")
+
+
+def request_genre_catalogue_refresh(index_name: str) -> None:
+    """Обработчик сигнала etl об обновлении документов индекса index_name"""
+    if index_name == GENRES_INDEX and refresh_requested is not None:
+        refresh_requested.set()
+
+
+async def keep_genre_catalogue_fresh(elastic: AsyncElasticsearch) -> None:
+    """
+    Обновление каталога жанров в фоне: по сигналу etl
+    или при изменении версии индекса, которая проверяется раз в GENRE_CATALOGUE_REFRESH_INTERVAL.
+    Пока каталог не загружен, сервисы читают жанры из elastic.
+    """
+    global refresh_requested
+
+    refresh_requested = asyncio.Event()
+    while True:
+        try:
+            await asyncio.wait_for(
+                refresh_requested.wait(), timeout=config.GENRE_CATALOGUE_REFRESH_INTERVAL
+            )
+        except asyncio.TimeoutError:
+            pass
+
+        force = refresh_requested.is_set()
+        refresh_requested.clear()
+        try:
+            await refresh_genre_catalogue(elastic, force=force)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Genre catalogue refresh failed")
@@ -0,0 +1,95 @@
+import asyncio
+import contextvars
+from typing import Dict, List, Optional
+
+from elasticsearch import AsyncElasticsearch
+
+from core import config
+from core.timing import measure
+from core.utils import run_in_background
+from db.breaker import set_request_deadline
+
+
+class ElasticLoader:
+    """
+    Загрузчик документов одного индекса elastic по id.
+    Запросы документов, сделанные в одном шаге event loop (или в течение window секунд),
+    собираются в один mget. Повторяющиеся id запрашиваются один раз.
+    mget выполняется фоновой задачей вне контекста запросов, которые его ждут,
+    с собственным бюджетом времени timeout. Время ожидания учитывается в замере es
+    каждого из этих запросов.
+    """
+
+    def __init__(
+        self,
+        elastic: AsyncElasticsearch,
+        index: str,
+        window: float = config.ELASTIC_LOADER_WINDOW,
+        max_batch_size: int = config.ELASTIC_LOADER_MAX_BATCH_SIZE,
+        timeout: float = config.REQUEST_TIMEOUT,
+    ):
+        self.elastic = elastic
+        self.index = index
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self.timeout = timeout
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._handle: Optional[asyncio.Handle] = None
+
+    async def load(self, doc_id: str) -> Optional[dict]:
+        """Получение _source документа или None, если документа нет"""
+        future = self._get_future(doc_id)
+        with measure("es"):
+            return await asyncio.shield(future)
+
+    async def load_many(self, doc_ids: List[str]) -> Dict[str, dict]:
+        """Получение _source найденных документов по списку id"""
+        futures = [asyncio.shield(self._get_future(doc_id)) for doc_id in doc_ids]
+        with measure("es"):
+            docs = await asyncio.gather(*futures)
+        return {doc_id: doc for doc_id, doc in zip(doc_ids, docs) if doc is not None}
+
+    def _get_future(self, doc_id: str) -> asyncio.Future:
+        # id приходят и строками, и UUID из параметров пути, а _id в ответе elastic - строка
+        doc_id = str(doc_id)
+        future = self._pending.get(doc_id)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._pending[doc_id] = future
+            if len(self._pending) >= self.max_batch_size:
+                self._dispatch()
+            elif self._handle is None:
+                self._schedule()
+        return future
+
+    def _schedule(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self.window > 0:
+            self._handle = loop.call_later(self.window, self._dispatch)
+        else:
+            self._handle = loop.call_soon(self._dispatch)
+
+    def _dispatch(self) -> None:
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        batch, self._pending = self._pending, {}
+        if batch:
+            # Пустой контекст: замеры, метка маршрута и бюджет времени запроса,
+            # который запустил mget, не относятся к остальным ожидающим запросам
+            contextvars.Context().run(run_in_background, self._load_batch(batch))
+
+    async def _load_batch(self, batch: Dict[str, asyncio.Future]) -> None:
+        set_request_deadline(self.timeout)
+        try:
+            response = await self.elastic.mget(index=self.index, body={"ids": list(batch)})
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        docs = {doc["_id"]: doc["_source"] for doc in response["docs"] if doc.get("found")}
+        for doc_id, future in batch.items():
+            if not future.done():
+                future.set_result(docs.get(doc_id))
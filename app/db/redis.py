@@ -1,6 +1,15 @@
-from aioredis import Redis
+import asyncio
+import logging
+from functools import wraps
+from itertools import chain
+from typing import Any, Iterable, List, Optional
 
-from core import json
+from aioredis import Redis, RedisError
+
+from core import config
+from db.breaker import CircuitBreaker, CircuitOpenError
+
+logger = logging.getLogger(__name__)
 
 redis: Redis = None
 
@@ -9,7 +18,34 @@ async def get_redis() -> Redis:
     return redis
 
 
-CACHE_EXPIRE_IN_SECONDS = 60
+CACHE_EXPIRE_IN_SECONDS = config.CACHE_EXPIRE_IN_SECONDS
+TAG_PREFIX = b"cache:tag:"
+
+redis_breaker = CircuitBreaker("redis")
+
+
+def degrade_on_error(default: Any = None):
+    """
+    Операция хранилища выполняется через redis_breaker с таймаутом REDIS_TIMEOUT.
+    При недоступности redis возвращается default (или default(*args, **kwargs), если это функция),
+    и запрос обрабатывается без кэша.
+    """
+
+    def decorator(method):
+        @wraps(method)
+        async def wrapper(self, *args, **kwargs):
+            try:
+                return await redis_breaker.call(
+                    lambda: method(self, *args, **kwargs), timeout=config.REDIS_TIMEOUT
+                )
+            except (RedisError, OSError, asyncio.TimeoutError, CircuitOpenError) as e:
+                if not isinstance(e, CircuitOpenError):
+                    logger.warning(f"Redis {method.__name__} failed with {e!r}, skipping cache")
+                return default(*args, **kwargs) if callable(default) else default
+
+        return wrapper
+
+    return decorator
 
 
 class RedisStorage:
@@ -18,8 +54,61 @@ class RedisStorage:
     def __init__(self, redis):
         self.redis = redis
 
+    @degrade_on_error()
     async def get_data_in_redis(self, key):
         return await self.redis.get(key=key)
 
-    async def put_data_from_redis(self, key, value):
-        await self.redis.set(key=key, value=json.dumps(value), expire=CACHE_EXPIRE_IN_SECONDS)
+    @degrade_on_error(lambda keys: [None] * len(keys))
+    async def get_many_data_in_redis(self, keys: List[bytes]) -> List[Optional[bytes]]:
+        return await self.redis.mget(*keys)
+
+    @degrade_on_error()
+    async def put_data_from_redis(
+        self, key, value: bytes, expire: int = CACHE_EXPIRE_IN_SECONDS, tags: Iterable[bytes] = ()
+    ):
+        """Сохранение значения и добавление ключа в множества его тегов"""
+        pipe = self.redis.pipeline()
+        pipe.set(key=key, value=value, expire=expire)
+        for tag in tags:
+            pipe.sadd(TAG_PREFIX + tag, key)
+            pipe.expire(TAG_PREFIX + tag, expire)
+        await pipe.execute()
+
+    async def delete_tagged(self, tags: Iterable[bytes]):
+        """
+        Удаление всех ключей, помеченных хотя бы одним из тегов.
+        Выполняется без предохранителя и со своим таймаутом: пропущенная инвалидация оставит
+        устаревшие ответы в кэше до истечения их срока, поэтому ошибка пробрасывается
+        и удаление повторяется.
+        """
+        tag_keys = [TAG_PREFIX + tag for tag in tags]
+        if not tag_keys:
+            return
+
+        async def delete():
+            pipe = self.redis.pipeline()
+            for tag_key in tag_keys:
+                pipe.smembers(tag_key)
+            keys = set(chain.from_iterable(await pipe.execute()))
+            await self.redis.delete(*keys, *tag_keys)
+
+        await asyncio.wait_for(delete(), timeout=config.REDIS_INVALIDATION_TIMEOUT)
+
+    @degrade_on_error(True)
+    async def acquire_lock(self, key, timeout: float) -> bool:
+        """
+        Короткая блокировка ключа между воркерами, снимается сама через timeout.
+        Без redis каждый воркер вычисляет ответ сам.
+        """
+        return bool(
+            await self.redis.set(
+                key=b"lock:" + key,
+                value=b"1",
+                pexpire=int(timeout * 1000),
+                exist=self.redis.SET_IF_NOT_EXIST,
+            )
+        )
+
+    @degrade_on_error()
+    async def release_lock(self, key):
+        await self.redis.delete(b"lock:" + key)
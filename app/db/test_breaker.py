@@ -0,0 +1,139 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from db import breaker
+from db.breaker import CircuitBreaker, CircuitOpenError, get_call_timeout, request_deadline
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(breaker, "time", SimpleNamespace(monotonic=clock))
+    return clock
+
+
+async def succeed():
+    return "ok"
+
+
+async def fail():
+    raise ConnectionError("elastic is down")
+
+
+def call(circuit: CircuitBreaker, func, **kwargs):
+    async def main():
+        return await circuit.call(func, timeout=1, **kwargs)
+
+    return asyncio.run(main())
+
+
+def make_breaker() -> CircuitBreaker:
+    return CircuitBreaker("elastic", failure_rate=0.5, min_calls=4, window=4, recovery_timeout=10)
+
+
+def open_circuit(circuit: CircuitBreaker) -> None:
+    for func in (succeed, fail, succeed, fail):
+        try:
+            call(circuit, func)
+        except ConnectionError:
+            pass
+
+
+def test_circuit_opens_at_failure_rate(clock):
+    circuit = make_breaker()
+    for func in (succeed, fail, succeed):
+        try:
+            call(circuit, func)
+        except ConnectionError:
+            pass
+    # Меньше min_calls вызовов: цепь замкнута
+    assert not circuit.is_open
+
+    with pytest.raises(ConnectionError):
+        call(circuit, fail)
+    assert circuit.is_open
+    with pytest.raises(CircuitOpenError):
+        call(circuit, succeed)
+
+
+def test_client_errors_do_not_open_circuit(clock):
+    circuit = make_breaker()
+    for _ in range(4):
+        with pytest.raises(ConnectionError):
+            call(circuit, fail, is_failure=lambda e: False)
+    assert not circuit.is_open
+
+
+def test_successful_trial_closes_circuit(clock):
+    circuit = make_breaker()
+    open_circuit(circuit)
+
+    clock.now += 9.9
+    with pytest.raises(CircuitOpenError):
+        call(circuit, succeed)
+    clock.now += 0.1
+    assert call(circuit, succeed) == "ok"
+    assert not circuit.is_open
+    assert not circuit.outcomes
+
+
+def test_failed_trial_opens_circuit_again(clock):
+    circuit = make_breaker()
+    open_circuit(circuit)
+
+    clock.now += 10
+    with pytest.raises(ConnectionError):
+        call(circuit, fail)
+    assert circuit.is_open
+    # Время восстановления отсчитывается от неудачного пробного вызова
+    clock.now += 9.9
+    with pytest.raises(CircuitOpenError):
+        call(circuit, succeed)
+
+
+def test_only_one_trial_call_at_a_time(clock):
+    circuit = make_breaker()
+    open_circuit(circuit)
+    clock.now += 10
+
+    async def main():
+        started = asyncio.Event()
+
+        async def slow():
+            started.set()
+            await asyncio.sleep(0.01)
+            return "ok"
+
+        trial = asyncio.ensure_future(circuit.call(slow, timeout=1))
+        await started.wait()
+        with pytest.raises(CircuitOpenError):
+            await circuit.call(succeed, timeout=1)
+        return await trial
+
+    assert asyncio.run(main()) == "ok"
+    assert not circuit.is_open
+
+
+def test_call_timeout_is_bounded_by_request_deadline(clock):
+    assert get_call_timeout(2) == 2
+    assert get_call_timeout(0) is None
+
+    token = request_deadline.set(clock.now + 0.5)
+    try:
+        assert get_call_timeout(2) == 0.5
+        assert get_call_timeout(0) == 0.5
+        clock.now += 0.5
+        with pytest.raises(asyncio.TimeoutError):
+            get_call_timeout(2)
+    finally:
+        request_deadline.reset(token)
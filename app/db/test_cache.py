@@ -0,0 +1,197 @@
+import asyncio
+import time
+
+import pytest
+
+from core import config
+from db import cache
+from db.cache import CacheEntry, LocalCache, SingleFlight, get_tags
+
+FILM_ID = b"4a74d886-eeaf-4cd6-815a-dd728b8cc0ca"
+PERSON_ID = b"82ea4033-1ed9-4639-a52e-6454b3249a3a"
+
+
+def test_details_are_tagged_by_ids_only():
+    key = b"/api/v1/film/" + FILM_ID + b"/?"
+    assert get_tags(key, b'{"actors": [{"id": "' + PERSON_ID + b'"}]}') == {FILM_ID, PERSON_ID}
+
+
+def test_ids_are_lowercased():
+    assert get_tags(b"/api/v1/film/batch/?id=" + FILM_ID.upper(), b"[]") == {FILM_ID}
+
+
+def test_lists_and_search_are_tagged_by_index():
+    assert get_tags(b"/api/v1/film/?sort=-imdb_rating", b"[]") == {b"index:movies"}
+    assert get_tags(b"/api/v1/film/search/?query=star", b"[]") == {b"index:movies"}
+    assert get_tags(b"/api/v1/genre/?", b"[]") == {b"index:genres"}
+    assert get_tags(b"/api/v1/person/suggest/?query=ma", b"[]") == {b"index:persons"}
+    assert get_tags(b"/api/v1/search/?query=star", b"[]") == {
+        b"index:movies",
+        b"index:persons",
+        b"index:genres",
+    }
+
+
+def test_query_string_does_not_make_a_list():
+    assert get_tags(b"/api/v1/person/" + PERSON_ID + b"/film/?x=/api/v1/genre/", b"[]") == {
+        PERSON_ID
+    }
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_local_cache_evicts_least_recently_used():
+    cache = LocalCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+
+
+def test_local_cache_expires_entries(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(time, "monotonic", clock)
+    cache = LocalCache(maxsize=10, ttl=5)
+    cache.set("a", 1, tags=["tag"])
+
+    clock.now += 4.9
+    assert cache.get("a") == 1
+    # Чтение не продлевает время жизни
+    clock.now += 0.1
+    assert cache.get("a") is None
+    assert not cache._tags
+
+
+def test_local_cache_deletes_tagged_entries():
+    cache = LocalCache(maxsize=10, ttl=60)
+    cache.set("a", 1, tags=["film", "person"])
+    cache.set("b", 2, tags=["person"])
+    cache.set("c", 3)
+
+    cache.delete_tagged(["film"])
+    assert cache.get("a") is None
+    assert cache.get("b") == 2
+    # Перезапись и вытеснение не оставляют ключей в индексе тегов
+    cache.set("b", 4)
+    cache.delete_tagged(["person"])
+    assert (cache.get("b"), cache.get("c")) == (4, 3)
+    assert not cache._tags
+
+
+def test_single_flight_followers_share_the_leader_result():
+    single_flight = SingleFlight()
+    calls = []
+
+    async def compute(name):
+        calls.append(name)
+        await asyncio.sleep(0.01)
+        return name
+
+    async def main():
+        results = await asyncio.gather(
+            single_flight.do("key", lambda: compute("leader")),
+            single_flight.do("key", lambda: compute("follower")),
+            single_flight.do("other", lambda: compute("other")),
+        )
+        assert not single_flight.is_running("key")
+        return results
+
+    assert asyncio.run(main()) == ["leader", "leader", "other"]
+    assert calls == ["leader", "other"]
+
+
+def test_single_flight_followers_retry_after_leader_error():
+    single_flight = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ConnectionError("elastic is down")
+
+    async def compute():
+        return "follower"
+
+    async def main():
+        return await asyncio.gather(
+            single_flight.do("key", fail),
+            single_flight.do("key", compute),
+            return_exceptions=True,
+        )
+
+    leader, follower = asyncio.run(main())
+    # Ошибка достается только лидеру, ожидающий вычисляет результат сам
+    assert isinstance(leader, ConnectionError)
+    assert follower == "follower"
+
+
+def test_cache_entry_goes_stale_then_expires(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(time, "time", clock)
+    monkeypatch.setattr(config, "CACHE_EXPIRE_IN_SECONDS", 10)
+    monkeypatch.setattr(config, "CACHE_STALE_IN_SECONDS", 20)
+    entry = CacheEntry.create(200, {"content-length": "2"}, b"[]")
+    assert entry.headers == {}
+
+    # Свежий ответ отдается из кэша
+    assert (entry.is_fresh(), entry.is_stale()) == (True, False)
+    # Устаревший ответ отдается, пока обновляется в фоне
+    clock.now += 10
+    assert (entry.is_fresh(), entry.is_stale()) == (False, True)
+    # После expire_at ответ отдается только при ошибке получения нового
+    clock.now += 20
+    assert (entry.is_fresh(), entry.is_stale()) == (False, False)
+
+
+def make_entry(body: bytes) -> CacheEntry:
+    return CacheEntry(
+        status_code=404,
+        headers={"content-type": "application/json", "x-request-id": "кэш"},
+        body=body,
+        stale_at=1000.5,
+        expire_at=1600.25,
+    )
+
+
+def test_cache_entry_round_trip(monkeypatch):
+    monkeypatch.setattr(cache, "COMPRESSION_CODEC", cache.CODEC_NONE)
+    entry = make_entry(b'{"detail": "film not found"}')
+    data = entry.to_bytes()
+
+    assert data.endswith(entry.body)
+    assert CacheEntry.from_bytes(data) == entry
+
+
+@pytest.mark.parametrize("codec_name", ["gzip", "zstd"])
+def test_cache_entry_round_trip_compressed(monkeypatch, codec_name):
+    codec = cache.CODECS[codec_name]
+    if codec not in cache.COMPRESSORS:
+        pytest.importorskip("zstandard")
+    monkeypatch.setattr(cache, "COMPRESSION_CODEC", codec)
+    monkeypatch.setattr(config, "CACHE_COMPRESSION_MIN_SIZE", 100)
+
+    small, large = make_entry(b"[]"), make_entry(b'{"id": 1}, ' * 100)
+    # Маленькие ответы не сжимаются
+    assert small.to_bytes().endswith(small.body)
+    assert len(large.to_bytes()) < len(large.body)
+    assert CacheEntry.from_bytes(small.to_bytes()) == small
+    assert CacheEntry.from_bytes(large.to_bytes()) == large
+
+
+def test_cache_entry_ignores_unknown_envelopes(monkeypatch):
+    monkeypatch.setattr(cache, "COMPRESSION_CODEC", cache.CODEC_NONE)
+    data = make_entry(b"[]").to_bytes()
+
+    assert CacheEntry.from_bytes(b"[]") is None
+    # Запись в формате другой версии
+    assert CacheEntry.from_bytes(bytes([cache.ENVELOPE_VERSION + 1]) + data[1:]) is None
+    # Запись сжата кодеком, которого нет в этом воркере
+    monkeypatch.delitem(cache.DECOMPRESSORS, cache.CODEC_GZIP)
+    assert CacheEntry.from_bytes(data[:1] + bytes([cache.CODEC_GZIP]) + data[2:]) is None
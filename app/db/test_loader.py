@@ -0,0 +1,64 @@
+import asyncio
+
+from core.timing import Timings, request_timings
+from core.utils import background_tasks
+from db.breaker import request_deadline
+from db.loader import ElasticLoader
+
+
+class RecordingElastic:
+    def __init__(self, docs):
+        self.docs = docs
+        self.calls = []
+
+    async def mget(self, index, body):
+        # Задача mget учитывается при ожидании фоновых задач на остановке
+        assert asyncio.current_task() in background_tasks
+        self.calls.append((body["ids"], request_timings.get(), request_deadline.get()))
+        await asyncio.sleep(0)
+        return {
+            "docs": [
+                {"_id": i, "found": i in self.docs, "_source": self.docs.get(i)}
+                for i in body["ids"]
+            ]
+        }
+
+
+def test_requests_are_batched_outside_the_caller_context():
+    elastic = RecordingElastic({"1": {"id": "1"}, "2": {"id": "2"}})
+    loader = ElasticLoader(elastic, "movies", timeout=3)
+
+    async def caller(doc_ids):
+        timings = Timings()
+        request_timings.set(timings)
+        request_deadline.set(0)
+        docs = await loader.load_many(doc_ids)
+        return docs, timings
+
+    async def main():
+        return await asyncio.gather(caller(["1", "2"]), caller(["2", "3"]))
+
+    (docs_a, timings_a), (docs_b, timings_b) = asyncio.run(main())
+
+    assert docs_a == {"1": {"id": "1"}, "2": {"id": "2"}}
+    assert docs_b == {"2": {"id": "2"}}
+    [(ids, timings, deadline)] = elastic.calls
+    assert ids == ["1", "2", "3"]
+    # mget не видит замеры и просроченный бюджет ни одного из запросов
+    assert timings is None
+    assert deadline is not None and deadline > 0
+    assert timings_a.counts == timings_b.counts == {"es": 1}
+
+
+def test_errors_are_passed_to_every_caller():
+    class FailingElastic:
+        async def mget(self, index, body):
+            raise ConnectionError("elastic is down")
+
+    loader = ElasticLoader(FailingElastic(), "movies")
+
+    async def main():
+        return await asyncio.gather(loader.load("1"), loader.load("2"), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert [type(e) for e in results] == [ConnectionError, ConnectionError]
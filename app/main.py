@@ -1,17 +1,50 @@
+import asyncio
+import importlib.util
 import logging
+import os
+import time
+from http import HTTPStatus
+from typing import Awaitable, Callable, Dict, Tuple
 
 import aioredis
 import uvicorn as uvicorn
 from elasticsearch import AsyncElasticsearch
 from fastapi import FastAPI, Request, Response
-from fastapi.responses import ORJSONResponse, RedirectResponse
+from fastapi.responses import ORJSONResponse
+from starlette.routing import Match
 
-from api.v1 import film, genre, person
-from core import config, json
+from api.v1 import film, genre, person, search
+from core import config
 from core.logger import LOGGING
-from core.utils import async_iterator_wrapper
-from db import elastic, redis
-from db.redis import RedisStorage
+from core.metrics import (
+    CONTENT_TYPE_LATEST,
+    REQUEST_LATENCY,
+    REQUESTS_IN_PROGRESS,
+    RESPONSE_CACHE,
+    current_route,
+    mark_process_dead,
+    prepare_multiprocess_dir,
+    render_metrics,
+    set_redis_pool_usage,
+)
+from core.timing import check_profiling, is_profiling_requested, measure, start_timings
+from core.utils import call_asgi, run_in_background, wait_background_tasks
+from db import elastic, genres, redis
+from db.breaker import CircuitOpenError, set_request_deadline
+from db.cache import (
+    CacheEntry,
+    TieredCache,
+    get_cache,
+    listen_invalidations,
+    single_flight,
+)
+
+logger = logging.getLogger(__name__)
+
+# Ответы этих путей не кэшируются
+NOT_CACHED_PATHS = {"/api/openapi", "/api/openapi.json", "/metrics"}
+# Ключ scope запроса фонового обновления ответа в кэше
+CACHE_REFRESH_SCOPE_KEY = "cache_refresh"
 
 app = FastAPI(
     title=config.PROJECT_NAME,
@@ -23,25 +56,181 @@ app = FastAPI(
 
 @app.middleware("http")
 async def cache(request: Request, call_next):
-    """Middleware для кэширования"""
-    redis_adapter = await redis.get_redis()
-    redis_cache = RedisStorage(redis_adapter)
-    key = request.get("raw_path") + request.get("query_string")
-    data_in_cache = await redis_cache.get_data_in_redis(key=key)
+    """
+    Middleware для кэширования.
+    Свежий ответ отдается из кэша. Устаревший ответ тоже отдается из кэша,
+    а обновление запускается в фоне. Если получить новый ответ не удалось,
+    отдается устаревший ответ, пока он не удален из кэша.
+    """
+    set_request_deadline(config.REQUEST_TIMEOUT)
+    if request.scope.get(CACHE_REFRESH_SCOPE_KEY):
+        # Фоновое обновление ответа: ответ сохраняет в кэш refresh_response
+        return await call_next(request)
+
+    route = current_route.get()
+    if request.url.path in NOT_CACHED_PATHS or is_profiling_requested(request):
+        RESPONSE_CACHE.labels(route=route, result="bypass").inc()
+        return await call_next(request)
+
+    response_cache = await get_cache()
+    key = request.get("raw_path") + b"?" + request.get("query_string")
+    with measure("cache"):
+        entry = await response_cache.get(key=key)
+
+    if entry is not None and entry.is_fresh():
+        RESPONSE_CACHE.labels(route=route, result="hit").inc()
+        return entry_response(entry)
+
+    if entry is not None and entry.is_stale():
+        RESPONSE_CACHE.labels(route=route, result="stale").inc()
+        if not single_flight.is_running(key):
+            run_in_background(refresh_response(request, response_cache, key))
+        return entry_response(entry)
+
+    RESPONSE_CACHE.labels(route=route, result="miss").inc()
+
+    async def get_response() -> Tuple[int, Dict[str, str], bytes]:
+        response = await call_next(request)
+        resp_body = b"".join([section async for section in response.body_iterator])
+        return response.status_code, dict(response.headers), resp_body
+
+    # Одновременные промахи по одному ключу схлопываются, в elastic идет только лидер
+    try:
+        status_code, headers, body = await single_flight.do(
+            key, lambda: fetch_response(get_response, response_cache, key)
+        )
+    except Exception:
+        if entry is None:
+            raise
+        logger.exception(f"Failed to get response for {key!r}, serving stale data")
+        return entry_response(entry)
+
+    if status_code >= HTTPStatus.INTERNAL_SERVER_ERROR and entry is not None:
+        logger.error(f'Got "{status_code}" response for {key!r}, serving stale data')
+        return entry_response(entry)
 
-    if data_in_cache:
-        return ORJSONResponse(content=json.loads(data_in_cache))
+    return Response(content=body, status_code=status_code, headers=headers)
 
-    response = await call_next(request)
-    if response.status_code == 307:
-        return RedirectResponse(url=response.headers.get("location"))
 
-    resp_body = [section async for section in response.__dict__["body_iterator"]]
-    response.__setattr__("body_iterator", async_iterator_wrapper(resp_body))
-    resp_body = resp_body[0]
-    if key not in (b"/api/openapi", b"/api/openapi.json"):
-        await redis_cache.put_data_from_redis(key=key, value=json.loads(resp_body))
-    return response
+def entry_response(entry: CacheEntry) -> Response:
+    """Ответ из кэша отдается как есть, без повторной сериализации"""
+    return Response(content=entry.body, status_code=entry.status_code, headers=entry.headers)
+
+
+async def refresh_response(request: Request, response_cache: TieredCache, key: bytes):
+    """Фоновое обновление устаревшего ответа в кэше"""
+
+    async def get_response() -> Tuple[int, Dict[str, str], bytes]:
+        # Исходный запрос уже завершен, поэтому запрос повторяется через все приложение:
+        # ошибки обрабатываются обработчиками исключений, а middleware кэша пропускает запрос
+        return await call_asgi(request.app, {**request.scope, CACHE_REFRESH_SCOPE_KEY: True})
+
+    # У фонового обновления свой бюджет времени, бюджет исходного запроса уже потрачен
+    set_request_deadline(config.REQUEST_TIMEOUT)
+
+    try:
+        await single_flight.do(key, lambda: fetch_response(get_response, response_cache, key))
+    except Exception:
+        logger.exception(f"Failed to refresh stale response for {key!r}")
+
+
+async def fetch_response(
+    get_response: Callable[[], Awaitable[Tuple[int, Dict[str, str], bytes]]],
+    response_cache: TieredCache,
+    key: bytes,
+) -> Tuple[int, Dict[str, str], bytes]:
+    """
+    Получение ответа приложения и сохранение его в кэш.
+    Если включена блокировка между воркерами и ключ уже вычисляет другой воркер,
+    ждем появления ответа в redis, не нагружая elastic повторным запросом.
+    """
+    lock_acquired = False
+    if config.CACHE_LOCK_TIMEOUT:
+        lock_acquired = await response_cache.storage.acquire_lock(
+            key, timeout=config.CACHE_LOCK_TIMEOUT
+        )
+        if not lock_acquired:
+            entry = await response_cache.wait(key, timeout=config.CACHE_LOCK_TIMEOUT)
+            if entry is not None:
+                return entry.status_code, entry.headers, entry.body
+
+    try:
+        status_code, headers, resp_body = await get_response()
+        if (
+            status_code != HTTPStatus.TEMPORARY_REDIRECT
+            and status_code < HTTPStatus.INTERNAL_SERVER_ERROR
+        ):
+            await response_cache.set(
+                key=key, status_code=status_code, headers=headers, body=resp_body
+            )
+        return status_code, headers, resp_body
+    finally:
+        if lock_acquired:
+            await response_cache.storage.release_lock(key)
+
+
+@app.middleware("http")
+async def collect_metrics(request: Request, call_next):
+    """
+    Middleware для метрик: время обработки и количество запросов в обработке
+    по шаблону пути ручки. Шаблон доступен в current_route всем обработчикам запроса.
+    Разбивка времени обработки отдается в заголовке Server-Timing.
+    """
+    timings = start_timings()
+    route = get_route_template(request)
+    current_route.set(route)
+    in_progress = REQUESTS_IN_PROGRESS.labels(method=request.method, route=route)
+    in_progress.inc()
+    status_code = HTTPStatus.INTERNAL_SERVER_ERROR
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        if timings is not None:
+            response.headers["Server-Timing"] = timings.server_timing(time.perf_counter() - start)
+        return response
+    finally:
+        REQUEST_LATENCY.labels(method=request.method, route=route, status=status_code).observe(
+            time.perf_counter() - start
+        )
+        in_progress.dec()
+        if redis.redis is not None:
+            set_redis_pool_usage(redis.redis.connection.size, redis.redis.connection.freesize)
+
+
+def get_route_template(request: Request) -> str:
+    """Шаблон пути ручки запроса, без значений параметров пути"""
+    for route in request.app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics() -> Response:
+    return Response(content=render_metrics(), media_type=CONTENT_TYPE_LATEST)
+
+
+@app.exception_handler(CircuitOpenError)
+async def circuit_open_handler(request: Request, exc: CircuitOpenError) -> Response:
+    """Зависимость недоступна, ответ отдается сразу, без ожидания таймаутов"""
+    return ORJSONResponse(status_code=HTTPStatus.SERVICE_UNAVAILABLE, content={"detail": str(exc)})
+
+
+@app.exception_handler(asyncio.TimeoutError)
+async def timeout_handler(request: Request, exc: asyncio.TimeoutError) -> Response:
+    return ORJSONResponse(
+        status_code=HTTPStatus.GATEWAY_TIMEOUT, content={"detail": "dependency timeout"}
+    )
+
+
+def get_pool_size(max_connections: int) -> int:
+    """
+    Размер пула соединений воркера - доля общего лимита соединений узла.
+    Количество воркеров передает запускающий процесс в переменной окружения WORKERS.
+    """
+    return max(max_connections // (config.WORKERS or 1), 1)
 
 
 @app.on_event("startup")
@@ -51,18 +240,38 @@ async def startup():
     Подключиться можем при работающем event-loop
     Поэтому логика подключения происходит в асинхронной функции
     """
+    check_profiling()
+    redis_pool_size = get_pool_size(config.REDIS_MAX_CONNECTIONS)
     redis.redis = await aioredis.create_redis_pool(
-        config.REDIS_DSN, minsize=10, maxsize=20, encoding="utf-8"
+        config.REDIS_DSN, minsize=max(redis_pool_size // 2, 1), maxsize=redis_pool_size
+    )
+    elastic.es = elastic.GuardedElasticsearch(
+        AsyncElasticsearch(
+            hosts=[config.ELASTIC_DSN], maxsize=get_pool_size(config.ELASTIC_MAX_CONNECTIONS)
+        )
+    )
+    try:
+        await genres.refresh_genre_catalogue(elastic.es, force=True)
+    except Exception:
+        logger.exception("Genre catalogue is not loaded, genres are read from elastic")
+    app.state.genre_catalogue = run_in_background(genres.keep_genre_catalogue_fresh(elastic.es))
+    app.state.cache_invalidation = run_in_background(
+        listen_invalidations(on_invalidate=genres.request_genre_catalogue_refresh)
     )
-    elastic.es = AsyncElasticsearch(hosts=[config.ELASTIC_DSN])
 
 
 @app.on_event("shutdown")
 async def shutdown():
     """
-    Отключаемся от баз при выключении сервера
+    Отключаемся от баз при выключении сервера.
+    Перед этим дожидаемся фоновых обновлений кэша, которым еще нужны соединения
     """
-    await redis.redis.close()
+    app.state.cache_invalidation.cancel()
+    app.state.genre_catalogue.cancel()
+    await wait_background_tasks(timeout=config.GRACEFUL_SHUTDOWN_TIMEOUT)
+    mark_process_dead(os.getpid())
+    redis.redis.close()
+    await redis.redis.wait_closed()
     await elastic.es.close()
 
 
@@ -71,12 +280,45 @@ async def shutdown():
 app.include_router(film.router, prefix="/api/v1/film", tags=["film"])
 app.include_router(genre.router, prefix="/api/v1/genre", tags=["genre"])
 app.include_router(person.router, prefix="/api/v1/person", tags=["person"])
+app.include_router(search.router, prefix="/api/v1/search", tags=["search"])
+
+
+def get_workers_count() -> int:
+    """Количество воркеров: WORKERS или число ядер, доступных процессу"""
+    if config.WORKERS:
+        return config.WORKERS
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def run_server() -> None:
+    """
+    Запуск сервера: воркеры по числу ядер, uvloop и httptools, если они установлены.
+    По SIGTERM сервер перестает принимать соединения и дожидается запросов в обработке
+    не дольше GRACEFUL_SHUTDOWN_TIMEOUT.
+    """
+    workers = get_workers_count()
+    # Воркеры читают количество воркеров для расчета размера пулов соединений
+    os.environ["WORKERS"] = str(workers)
+    prepare_multiprocess_dir(workers)
+
+    loop = "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+    http = "httptools" if importlib.util.find_spec("httptools") else "h11"
+    logger.info(f"Starting {workers} workers, loop {loop}, http {http}")
 
-if __name__ == "__main__":
     uvicorn.run(
         "main:app",
-        host="0.0.0.0",
-        port=8000,
+        host=config.HOST,
+        port=config.PORT,
+        workers=workers,
+        loop=loop,
+        http=http,
         log_config=LOGGING,
-        log_level=logging.DEBUG,
+        log_level=config.LOG_LEVEL,
+        timeout_graceful_shutdown=config.GRACEFUL_SHUTDOWN_TIMEOUT,
     )
+
+
+if __name__ == "__main__":
+    run_server()
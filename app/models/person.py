@@ -1,5 +1,5 @@
 from enum import Enum
-from typing import List
+from typing import List, Optional
 
 from pydantic import UUID4
 
@@ -14,17 +14,18 @@ class RoleType(Enum):
     writer = "writer"
 
 
-class Person(BaseModel):
-    """Персоны."""
-
-    id: UUID4
-    full_name: str
-
-
 class PersonFilm(BaseModel):
     """Фильмы в которых учавствовала персона."""
 
     id: UUID4
     title: str
-    imdb_rating: float
+    imdb_rating: Optional[float]
     roles: List[RoleType]
+
+
+class Person(BaseModel):
+    """Персоны."""
+
+    id: UUID4
+    full_name: str
+    films: List[PersonFilm] = []
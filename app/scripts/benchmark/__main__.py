@@ -0,0 +1,132 @@
+"""
+Нагрузочный тест API.
+Приложение запускается в том же процессе с заменителями elastic и redis в памяти,
+документы для elastic собираются из дампа dumps/movies_db.sql. Запросы из взвешенной смеси
+сценариев (scenarios.SCENARIOS) выполняются с постоянным числом одновременных запросов.
+Для каждого сценария выводятся пропускная способность, p50/p95/p99 и количество запросов
+к elastic, результат сохраняется в scripts/benchmark/results для сравнения запусков.
+
+Запуск из каталога app:
+    python -m scripts.benchmark --requests 5000 --concurrency 32 --es-latency 0.005
+    python -m scripts.benchmark --label after-change --compare latest
+"""
+
+import argparse
+import asyncio
+import logging
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Dict, List
+
+import httpx
+
+from db import elastic, genres, redis
+from main import app
+from scripts.benchmark.fakes import FakeElasticsearch, FakeRedis, call_label
+from scripts.benchmark.fixtures import DUMP_PATH, build_documents
+from scripts.benchmark.report import (
+    RESULTS_DIR,
+    get_git_revision,
+    load_result,
+    print_comparison,
+    print_report,
+    save_result,
+    summarize,
+)
+from scripts.benchmark.scenarios import make_plan
+
+logger = logging.getLogger(__name__)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="API load benchmark with in-memory elastic/redis")
+    parser.add_argument("--requests", type=int, default=5000, help="total number of requests")
+    parser.add_argument("--concurrency", type=int, default=32, help="requests in flight")
+    parser.add_argument("--es-latency", type=float, default=0.005, help="seconds per es call")
+    parser.add_argument(
+        "--redis-latency", type=float, default=0.0005, help="seconds per redis command"
+    )
+    parser.add_argument("--seed", type=int, default=42, help="seed of the request sequence")
+    parser.add_argument(
+        "--zipf", type=float, default=1.0, help="popularity skew of documents, 0 - uniform"
+    )
+    parser.add_argument("--dump", default=DUMP_PATH, help="postgres dump with fixtures")
+    parser.add_argument("--label", default="run", help="name of the run in the results file")
+    parser.add_argument("--results-dir", default=RESULTS_DIR)
+    parser.add_argument("--no-save", action="store_true", help="do not store the result")
+    parser.add_argument(
+        "--compare", metavar="PATH", help='stored result to compare with, "latest" - last run'
+    )
+    return parser.parse_args()
+
+
+async def run(args: argparse.Namespace) -> Dict:
+    documents = build_documents(args.dump)
+    fake_elastic = FakeElasticsearch(documents, latency=args.es_latency)
+    redis.redis = FakeRedis(latency=args.redis_latency)
+    elastic.es = elastic.GuardedElasticsearch(fake_elastic)
+    # Обработчик startup приложения не вызывается, каталог жанров загружается здесь
+    await genres.refresh_genre_catalogue(elastic.es, force=True)
+    fake_elastic.calls.clear()
+
+    plan = iter(make_plan(documents, args.requests, seed=args.seed, zipf=args.zipf))
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors: Counter = Counter()
+
+    async def worker(client: httpx.AsyncClient):
+        # Итератор общий для всех воркеров: каждый берет следующий запрос плана
+        for name, path in plan:
+            call_label.set(name)
+            start = time.perf_counter()
+            try:
+                response = await client.get(path)
+                failed = response.status_code >= 400
+            except Exception:
+                logger.exception(f"Request {path} failed")
+                failed = True
+            latencies[name].append(time.perf_counter() - start)
+            if failed:
+                errors[name] += 1
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - start
+
+    return {
+        "label": args.label,
+        "created": datetime.now().strftime("%Y%m%dT%H%M%S"),
+        "revision": get_git_revision(),
+        "params": {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "es_latency": args.es_latency,
+            "redis_latency": args.redis_latency,
+            "seed": args.seed,
+            "zipf": args.zipf,
+        },
+        "elapsed": round(elapsed, 3),
+        "endpoints": summarize(latencies, errors, fake_elastic.calls, elapsed),
+    }
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    baseline = load_result(args.compare, args.results_dir) if args.compare else None
+
+    result = asyncio.run(run(args))
+    print_report(result)
+    if baseline is not None:
+        print_comparison(baseline, result)
+    elif args.compare:
+        print(f"\nNo stored results in {args.results_dir} to compare with")
+
+    if not args.no_save:
+        print(f"\nResult saved to {save_result(result, args.results_dir)}")
+
+
+if __name__ == "__main__":
+    main()
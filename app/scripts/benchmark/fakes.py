@@ -0,0 +1,462 @@
+"""
+Локальные заменители elastic и redis для нагрузочного тестирования.
+Поддерживают только те запросы, которые делают сервисы приложения.
+"""
+
+import asyncio
+import json
+import re
+import time
+from collections import Counter
+from contextvars import ContextVar
+from functools import cmp_to_key
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple, Union
+
+from elasticsearch import NotFoundError
+from elasticsearch.client.utils import NamespacedClient
+
+# Метка, к которой относятся запросы к elastic, например название сценария нагрузки
+call_label: ContextVar[str] = ContextVar("call_label", default="background")
+
+TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    return TOKEN_RE.findall(text.lower()) if text else []
+
+
+def compare(a: Any, b: Any, order: str) -> int:
+    """Сравнение значений сортировки, документы без значения всегда в конце, как в elastic"""
+    if a == b:
+        return 0
+    if a is None:
+        return 1
+    if b is None:
+        return -1
+    result = (a > b) - (a < b)
+    return result if order == "asc" else -result
+
+
+def filter_source(doc: Dict, fields: Iterable[str]) -> Dict:
+    """Поля документа для _source, поля вложенных объектов - через точку, как в elastic"""
+    result: Dict = {}
+    for field in fields:
+        key, _, rest = field.partition(".")
+        if key not in doc:
+            continue
+        value = doc[key]
+        if not rest:
+            result[key] = value
+        elif isinstance(value, list):
+            items = result.setdefault(key, [{} for _ in value])
+            for item, item_value in zip(items, value):
+                item.update(filter_source(item_value, [rest]))
+        elif isinstance(value, dict):
+            result.setdefault(key, {}).update(filter_source(value, [rest]))
+    return result
+
+
+def get_sort_value(doc: Dict, field: str, order: str, missing: Any) -> Any:
+    """
+    Значение сортировки документа. Документ без значения поля получает missing,
+    а без missing - бесконечность в конце списка, как числовое поле в elastic
+    """
+    value = doc.get(field)
+    if value is not None:
+        return value
+    if missing is not None:
+        return missing
+    return float("inf") if order == "asc" else float("-inf")
+
+
+class FakeIndex:
+    """Документы одного индекса и обратный индекс по словам текстовых полей"""
+
+    def __init__(self, name: str, docs: List[Dict]):
+        self.name = name
+        self.docs = {doc["id"]: doc for doc in docs}
+        self.terms: Dict[str, Dict[str, Set[str]]] = {}
+
+    def get_terms(self, field: str) -> Dict[str, Set[str]]:
+        """Слово поля -> id документов, строится при первом поиске по полю"""
+        if field not in self.terms:
+            terms: Dict[str, Set[str]] = {}
+            for doc_id, doc in self.docs.items():
+                for token in tokenize(doc.get(field)):
+                    terms.setdefault(token, set()).add(doc_id)
+            self.terms[field] = terms
+        return self.terms[field]
+
+
+class FakeIndices(NamespacedClient):
+    """es.indices: версия индекса для каталога жанров"""
+
+    async def stats(self, index: str, **kwargs) -> Dict:
+        await self.client.call("indices.stats")
+        count = len(self.client.indexes[index].docs)
+        return {
+            "_all": {
+                "primaries": {
+                    "indexing": {"index_total": count, "delete_total": 0},
+                    "docs": {"count": count},
+                }
+            }
+        }
+
+    async def refresh(self, index: str, **kwargs) -> Dict:
+        await self.client.call("indices.refresh")
+        return {}
+
+
+class FakeElasticsearch:
+    """
+    Elastic в памяти с задержкой latency секунд на каждый запрос.
+    Количество запросов считается по меткам call_label и операциям.
+    Результаты поиска без учета страниц запоминаются, т.к. документы не меняются:
+    время обработки запроса заменителем почти не зависит от размера индекса.
+    """
+
+    def __init__(self, documents: Dict[str, List[Dict]], latency: float = 0):
+        self.indexes = {name: FakeIndex(name, docs) for name, docs in documents.items()}
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self.indices = FakeIndices(self)
+        self._results: Dict[str, List[Tuple[Dict, float, List]]] = {}
+
+    async def call(self, operation: str) -> None:
+        self.calls[call_label.get(), operation] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def close(self) -> None:
+        pass
+
+    async def get(self, index: str, id: str, **kwargs) -> Dict:
+        await self.call("get")
+        doc = self.indexes[index].docs.get(str(id))
+        if doc is None:
+            raise NotFoundError(404, "not_found", {"_index": index, "_id": id, "found": False})
+        return {"_index": index, "_id": doc["id"], "found": True, "_source": doc}
+
+    async def mget(self, body: Dict, index: str, **kwargs) -> Dict:
+        await self.call("mget")
+        docs = self.indexes[index].docs
+        return {
+            "docs": [
+                (
+                    {"_index": index, "_id": doc_id, "found": True, "_source": docs[doc_id]}
+                    if doc_id in docs
+                    else {"_index": index, "_id": doc_id, "found": False}
+                )
+                for doc_id in map(str, body["ids"])
+            ]
+        }
+
+    async def search(
+        self,
+        index: str,
+        body: Union[Dict, str, None] = None,
+        size: Optional[int] = None,
+        from_: Optional[int] = None,
+        sort: Optional[List[str]] = None,
+        _source: Optional[List[str]] = None,
+        **kwargs,
+    ) -> Dict:
+        await self.call("search")
+        return self._search(index, body, size=size, from_=from_, sort=sort, source=_source)
+
+    async def msearch(self, body: List[Dict], **kwargs) -> Dict:
+        await self.call("msearch")
+        headers, queries = body[::2], body[1::2]
+        responses = []
+        for header, query in zip(headers, queries):
+            response = self._search(header["index"], query)
+            response["status"] = 200
+            responses.append(response)
+        return {"took": 0, "responses": responses}
+
+    def _search(
+        self,
+        index: str,
+        body: Union[Dict, str, None],
+        size: Optional[int] = None,
+        from_: Optional[int] = None,
+        sort: Optional[List[str]] = None,
+        source: Optional[List[str]] = None,
+    ) -> Dict:
+        if isinstance(body, (str, bytes)):
+            body = json.loads(body)
+        body = body or {}
+        size = size if size is not None else body.get("size", 10)
+        from_ = from_ if from_ is not None else body.get("from", 0)
+        source = source if source is not None else body.get("_source")
+        sort_spec = self._parse_sort(sort if sort is not None else body.get("sort"))
+
+        results = self._get_results(index, body.get("query"), sort_spec)
+        search_after = body.get("search_after")
+        if search_after:
+            results = [
+                result
+                for result in results
+                if self._compare_values(result[2], search_after, sort_spec) > 0
+            ]
+
+        hits = []
+        for doc, score, sort_values in results[from_ : from_ + size]:
+            hit = {
+                "_index": index,
+                "_id": doc["id"],
+                "_score": score,
+                "_source": filter_source(doc, source) if source else doc,
+            }
+            if sort_spec:
+                hit["sort"] = sort_values
+            hits.append(hit)
+
+        return {
+            "took": 0,
+            "timed_out": False,
+            "hits": {
+                "total": {"value": len(results), "relation": "eq"},
+                "max_score": max((result[1] for result in results), default=None),
+                "hits": hits,
+            },
+        }
+
+    def _get_results(
+        self, index: str, query: Optional[Dict], sort_spec: List[Tuple[str, str, Any]]
+    ) -> List[Tuple[Dict, float, List]]:
+        """Все найденные документы в порядке сортировки: (документ, score, значения сортировки)"""
+        key = json.dumps([index, query, sort_spec], sort_keys=True)
+        if key not in self._results:
+            fake_index = self.indexes[index]
+            scores = self._match(fake_index, query)
+            results = [
+                (
+                    fake_index.docs[doc_id],
+                    score,
+                    [
+                        (
+                            score
+                            if field == "_score"
+                            else get_sort_value(fake_index.docs[doc_id], field, order, missing)
+                        )
+                        for field, order, missing in sort_spec
+                    ],
+                )
+                for doc_id, score in scores.items()
+            ]
+            if sort_spec:
+                results.sort(
+                    key=cmp_to_key(lambda a, b: self._compare_values(a[2], b[2], sort_spec))
+                )
+            self._results[key] = results
+        return self._results[key]
+
+    @staticmethod
+    def _compare_values(a: List, b: List, sort_spec: List[Tuple[str, str, Any]]) -> int:
+        for a_value, b_value, (_, order, _) in zip(a, b, sort_spec):
+            result = compare(a_value, b_value, order)
+            if result:
+                return result
+        return 0
+
+    @staticmethod
+    def _parse_sort(sort: Optional[Iterable]) -> List[Tuple[str, str, Any]]:
+        """
+        Сортировка в виде [(поле, порядок, missing)]: "field:order", "_score",
+        {"field": "order"}, {"field": {"order": order, "missing": value}}
+        """
+        spec = []
+        for item in sort or ():
+            missing = None
+            if isinstance(item, dict):
+                ((field, order),) = item.items()
+                if isinstance(order, dict):
+                    order, missing = order.get("order", "asc"), order.get("missing")
+            elif ":" in item:
+                field, order = item.split(":")
+            else:
+                field, order = item, "desc" if item == "_score" else "asc"
+            # Сортировка по keyword подполю text поля
+            spec.append((field.split(".")[0], order, missing))
+        return spec
+
+    def _match(self, index: FakeIndex, query: Optional[Dict]) -> Dict[str, float]:
+        """id найденных документов и их score"""
+        if not query:
+            return {doc_id: 1.0 for doc_id in index.docs}
+
+        ((query_type, params),) = query.items()
+        if query_type == "match":
+            ((field, text),) = params.items()
+            # Поиск по text подполю keyword поля
+            field = field.split(".")[0]
+            return self._match_terms(index, field, tokenize(text), prefix=False)
+
+        if query_type == "multi_match":
+            # bool_prefix по подполю suggest: последнее слово ищется как префикс
+            field = params["fields"][0].split(".")[0]
+            return self._match_terms(index, field, tokenize(params["query"]), prefix=True)
+
+        if query_type == "term":
+            ((field, value),) = params.items()
+            case_insensitive = isinstance(value, dict) and value.get("case_insensitive")
+            value = value["value"] if isinstance(value, dict) else value
+            return {
+                doc_id: 1.0
+                for doc_id, doc in index.docs.items()
+                if self._is_equal(doc.get(field), value, case_insensitive)
+            }
+
+        if query_type == "nested":
+            ((field, value),) = params["query"]["term"].items()
+            path, nested_field = field.split(".")
+            return {
+                doc_id: 1.0
+                for doc_id, doc in index.docs.items()
+                if any(item.get(nested_field) == value for item in doc.get(path, ()))
+            }
+
+        raise ValueError(f'Query "{query_type}" is not supported')
+
+    @staticmethod
+    def _match_terms(
+        index: FakeIndex, field: str, tokens: List[str], prefix: bool
+    ) -> Dict[str, float]:
+        """Документы, в поле которых есть хотя бы одно слово запроса, score - число слов"""
+        terms = index.get_terms(field)
+        scores: Dict[str, float] = {}
+        for i, token in enumerate(tokens):
+            if prefix and i == len(tokens) - 1:
+                doc_ids = set().union(
+                    *(ids for term, ids in terms.items() if term.startswith(token))
+                )
+            else:
+                doc_ids = terms.get(token, ())
+            for doc_id in doc_ids:
+                scores[doc_id] = scores.get(doc_id, 0) + 1.0
+        return scores
+
+    @staticmethod
+    def _is_equal(field_value: Any, value: Any, case_insensitive: bool) -> bool:
+        if case_insensitive and isinstance(field_value, str) and isinstance(value, str):
+            return field_value.lower() == value.lower()
+        return field_value == value
+
+
+class FakePool:
+    """Состояние пула соединений для метрик redis_pool_connections"""
+
+    size = 1
+    freesize = 1
+
+
+class FakePipeline:
+    def __init__(self, redis: "FakeRedis"):
+        self.redis = redis
+        self.commands: List[Tuple[str, Tuple, Dict]] = []
+
+    def __getattr__(self, name: str):
+        def command(*args, **kwargs):
+            self.commands.append((name, args, kwargs))
+
+        return command
+
+    async def execute(self) -> List:
+        await self.redis.call()
+        commands, self.commands = self.commands, []
+        return [
+            (getattr(self.redis, f"_{name}", None) or getattr(self.redis, name))(*args, **kwargs)
+            for name, args, kwargs in commands
+        ]
+
+
+class FakeRedis:
+    """
+    Redis в памяти с интерфейсом aioredis 1.x и задержкой latency секунд на каждую команду.
+    Команды конвейера выполняются за одну задержку.
+    """
+
+    SET_IF_NOT_EXIST = "SET_IF_NOT_EXIST"
+
+    def __init__(self, latency: float = 0):
+        self.latency = latency
+        self.connection = FakePool()
+        self.data: Dict[bytes, Any] = {}
+        self.expires: Dict[bytes, float] = {}
+
+    async def call(self) -> None:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def close(self) -> None:
+        pass
+
+    async def wait_closed(self) -> None:
+        pass
+
+    def pipeline(self) -> FakePipeline:
+        return FakePipeline(self)
+
+    async def get(self, key, encoding: Optional[str] = None) -> Any:
+        await self.call()
+        value = self._get(key)
+        return value.decode(encoding) if encoding and value is not None else value
+
+    async def mget(self, key, *keys) -> List:
+        await self.call()
+        return [self._get(key) for key in (key, *keys)]
+
+    async def set(self, key, value, *, expire: int = 0, pexpire: int = 0, exist=None) -> bool:
+        await self.call()
+        return self._set(key, value, expire=expire, pexpire=pexpire, exist=exist)
+
+    async def delete(self, key, *keys) -> int:
+        await self.call()
+        return sum(self._delete(key) for key in (key, *keys))
+
+    # Команды без задержки, их вызывает конвейер
+
+    def sadd(self, key, member, *members) -> int:
+        members_set = self._get(key)
+        if members_set is None:
+            members_set = self.data[self._key(key)] = set()
+        added = {self._key(item) for item in (member, *members)} - members_set
+        members_set.update(added)
+        return len(added)
+
+    def smembers(self, key) -> List[bytes]:
+        return list(self._get(key) or ())
+
+    def expire(self, key, timeout: int) -> bool:
+        if self._get(key) is None:
+            return False
+        self.expires[self._key(key)] = time.monotonic() + timeout
+        return True
+
+    def _set(self, key, value, expire: int = 0, pexpire: int = 0, exist=None) -> bool:
+        if exist == self.SET_IF_NOT_EXIST and self._get(key) is not None:
+            return False
+        key = self._key(key)
+        self.data[key] = self._key(value)
+        self.expires.pop(key, None)
+        if expire or pexpire:
+            self.expires[key] = time.monotonic() + (expire or pexpire / 1000)
+        return True
+
+    def _get(self, key) -> Any:
+        key = self._key(key)
+        expires_at = self.expires.get(key)
+        if expires_at is not None and expires_at <= time.monotonic():
+            self._delete(key)
+        return self.data.get(key)
+
+    def _delete(self, key) -> bool:
+        key = self._key(key)
+        self.expires.pop(key, None)
+        return self.data.pop(key, None) is not None
+
+    @staticmethod
+    def _key(value) -> Any:
+        return value.encode() if isinstance(value, str) else value
@@ -0,0 +1,115 @@
+"""
+Документы индексов movies, persons и genres, собранные из дампа postgres (dumps/movies_db.sql)
+так же, как их собирает etl.
+"""
+
+import os
+from collections import defaultdict
+from typing import Dict, Iterator, List, Optional
+
+# Дамп базы в корне репозитория
+DUMP_PATH = os.path.join(
+    os.path.dirname(__file__), os.pardir, os.pardir, os.pardir, "dumps", "movies_db.sql"
+)
+
+COPY_ESCAPES = {"t": "\t", "n": "\n", "r": "\r", "\\": "\\"}
+
+
+def unescape(value: str) -> Optional[str]:
+    """Значение колонки в текстовом формате COPY, \\N - NULL"""
+    if value == "\\N":
+        return None
+    if "\\" not in value:
+        return value
+
+    chars = []
+    escaped = False
+    for char in value:
+        if escaped:
+            chars.append(COPY_ESCAPES.get(char, char))
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        else:
+            chars.append(char)
+    return "".join(chars)
+
+
+def read_tables(path: str = DUMP_PATH) -> Dict[str, List[Dict]]:
+    """Строки всех таблиц из блоков COPY ... FROM stdin дампа"""
+    tables: Dict[str, List[Dict]] = {}
+    with open(path, encoding="utf-8") as dump:
+        lines: Iterator[str] = iter(dump)
+        for line in lines:
+            if not line.startswith("COPY "):
+                continue
+            # COPY public.movies_genre (created, modified, id, name, description) FROM stdin;
+            table = line.split()[1].split(".")[-1]
+            columns = line[line.index("(") + 1 : line.index(")")].split(", ")
+            rows = tables.setdefault(table, [])
+            for row in lines:
+                row = row.rstrip("\n")
+                if row == "\\.":
+                    break
+                rows.append(dict(zip(columns, map(unescape, row.split("\t")))))
+    return tables
+
+
+def get_rating(value: Optional[str]) -> Optional[float]:
+    return float(value) if value else None
+
+
+def build_documents(path: str = DUMP_PATH) -> Dict[str, List[Dict]]:
+    """Документы по названию индекса"""
+    tables = read_tables(path)
+
+    genres = {row["id"]: {"id": row["id"], "name": row["name"]} for row in tables["movies_genre"]}
+    persons = {
+        row["id"]: {
+            "id": row["id"],
+            "full_name": f"{row['first_name']} {row['last_name']}",
+            "films": [],
+        }
+        for row in tables["movies_person"]
+    }
+
+    film_genres = defaultdict(list)
+    for row in tables["movies_filmwork_genres"]:
+        film_genres[row["filmwork_id"]].append(genres[row["genre_id"]])
+
+    film_roles = defaultdict(lambda: defaultdict(list))
+    for row in tables["movies_filmwork_participants"]:
+        film_roles[row["filmwork_id"]][row["person_id"]].append(row["role"])
+
+    movies = []
+    for row in tables["movies_filmwork"]:
+        film = {
+            "id": row["id"],
+            "filmwork_type": row["filmwork_type"],
+            "title": row["title"],
+            "description": row["description"],
+            "imdb_rating": get_rating(row["rating"]),
+            "genres": film_genres[row["id"]],
+            "actors": [],
+            "writers": [],
+            "directors": [],
+        }
+        for person_id, roles in film_roles[row["id"]].items():
+            person = persons[person_id]
+            for role in roles:
+                film[f"{role}s"].append({"id": person_id, "full_name": person["full_name"]})
+            person["films"].append(
+                {
+                    "id": film["id"],
+                    "title": film["title"],
+                    "imdb_rating": film["imdb_rating"],
+                    "roles": roles,
+                }
+            )
+        movies.append(film)
+
+    return {
+        "movies": movies,
+        "persons": list(persons.values()),
+        "genres": list(genres.values()),
+    }
@@ -0,0 +1,144 @@
+"""Сводка результатов нагрузочного теста, сохранение и сравнение запусков"""
+
+import glob
+import json
+import math
+import os
+import subprocess
+from collections import Counter
+from typing import Dict, List, Optional
+
+# Каталог с результатами запусков
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+TOTAL = "total"
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    if not sorted_values:
+        return 0
+    return sorted_values[max(math.ceil(p / 100 * len(sorted_values)) - 1, 0)]
+
+
+def summarize_endpoint(
+    latencies: List[float], errors: int, es_calls: Dict[str, int], elapsed: float
+) -> Dict:
+    """Показатели одной ручки, время в миллисекундах"""
+    values = sorted(latencies)
+    count = len(values)
+    return {
+        "requests": count,
+        "errors": errors,
+        "rps": round(count / elapsed, 1) if elapsed else 0,
+        "mean_ms": round(sum(values) / count * 1000, 2) if count else 0,
+        "p50_ms": round(percentile(values, 50) * 1000, 2),
+        "p95_ms": round(percentile(values, 95) * 1000, 2),
+        "p99_ms": round(percentile(values, 99) * 1000, 2),
+        "es_calls": dict(sorted(es_calls.items())),
+        "es_calls_per_request": round(sum(es_calls.values()) / count, 3) if count else 0,
+    }
+
+
+def summarize(
+    latencies: Dict[str, List[float]],
+    errors: Counter,
+    es_calls: Counter,
+    elapsed: float,
+) -> Dict[str, Dict]:
+    """Показатели по ручкам и итог, es_calls - счетчик по (ручка, операция)"""
+    calls_by_endpoint: Dict[str, Dict[str, int]] = {}
+    for (endpoint, operation), count in es_calls.items():
+        calls_by_endpoint.setdefault(endpoint, {})[operation] = count
+
+    endpoints = {
+        name: summarize_endpoint(
+            latencies[name], errors[name], calls_by_endpoint.get(name, {}), elapsed
+        )
+        for name in sorted(latencies)
+    }
+    total_calls = Counter()
+    for operation, count in ((op, n) for (_, op), n in es_calls.items()):
+        total_calls[operation] += count
+    endpoints[TOTAL] = summarize_endpoint(
+        [value for values in latencies.values() for value in values],
+        sum(errors.values()),
+        total_calls,
+        elapsed,
+    )
+    return endpoints
+
+
+def print_report(result: Dict) -> None:
+    print(
+        f"{'endpoint':<20} {'requests':>8} {'errors':>6} {'rps':>8} "
+        f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'es/req':>7}  es calls"
+    )
+    for name, stats in result["endpoints"].items():
+        calls = ", ".join(f"{op}={count}" for op, count in stats["es_calls"].items())
+        print(
+            f"{name:<20} {stats['requests']:>8} {stats['errors']:>6} {stats['rps']:>8.1f} "
+            f"{stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f} {stats['p99_ms']:>8.2f} "
+            f"{stats['es_calls_per_request']:>7.3f}  {calls}"
+        )
+
+
+def change(before: float, after: float) -> str:
+    if not before:
+        return "n/a"
+    return f"{(after - before) / before * 100:+.1f}%"
+
+
+def print_comparison(baseline: Dict, result: Dict) -> None:
+    """Изменение показателей относительно baseline по ручкам, которые есть в обоих запусках"""
+    print(f"\nCompared with {baseline['label']} ({baseline['revision']}, {baseline['created']})")
+    if baseline["params"] != result["params"]:
+        print(f"Warning: parameters differ, baseline was run with {baseline['params']}")
+
+    print(f"{'endpoint':<20} {'rps':>9} {'p50':>9} {'p95':>9} {'p99':>9} {'es/req':>9}")
+    for name, stats in result["endpoints"].items():
+        before = baseline["endpoints"].get(name)
+        if before is None:
+            continue
+        print(
+            f"{name:<20} "
+            + " ".join(
+                f"{change(before[key], stats[key]):>9}"
+                for key in ("rps", "p50_ms", "p95_ms", "p99_ms", "es_calls_per_request")
+            )
+        )
+
+
+def get_git_revision() -> str:
+    """Коммит, на котором выполнен запуск, с пометкой о незакоммиченных изменениях"""
+    try:
+        revision = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return f"{revision}-dirty" if dirty else revision
+
+
+def save_result(result: Dict, results_dir: str = RESULTS_DIR) -> str:
+    os.makedirs(results_dir, exist_ok=True)
+    path = os.path.join(results_dir, f"{result['created']}-{result['label']}.json")
+    with open(path, "w") as file:
+        json.dump(result, file, indent=2)
+    return path
+
+
+def load_result(path: str, results_dir: str = RESULTS_DIR) -> Optional[Dict]:
+    """Результат запуска из файла, latest - последний сохраненный запуск"""
+    if path == "latest":
+        paths = sorted(glob.glob(os.path.join(results_dir, "*.json")))
+        if not paths:
+            return None
+        path = paths[-1]
+    with open(path) as file:
+        return json.load(file)
@@ -0,0 +1,131 @@
+"""Взвешенная смесь запросов к ручкам фильмов, жанров, персон и поиска"""
+
+import random
+from dataclasses import dataclass
+from itertools import accumulate
+from typing import Callable, Dict, List, Sequence, Tuple
+from urllib.parse import urlencode
+
+from scripts.benchmark.fakes import tokenize
+
+
+class Picker:
+    """
+    Выбор документов с распределением Ципфа: популярные документы запрашиваются чаще,
+    поэтому часть запросов попадает в кэш ответов. zipf=0 - равномерное распределение.
+    """
+
+    def __init__(self, rng: random.Random, zipf: float):
+        self.rng = rng
+        self.zipf = zipf
+        self._cum_weights: Dict[int, List[float]] = {}
+
+    def choice(self, items: Sequence):
+        size = len(items)
+        if size not in self._cum_weights:
+            self._cum_weights[size] = list(
+                accumulate(1 / (rank + 1) ** self.zipf for rank in range(size))
+            )
+        return self.rng.choices(items, cum_weights=self._cum_weights[size])[0]
+
+    def word(self, texts: Sequence[str]) -> str:
+        """Случайное слово из случайного текста, например для поискового запроса"""
+        words = [word for word in tokenize(self.choice(texts)) if len(word) > 2]
+        return self.rng.choice(words) if words else "star"
+
+    def prefix(self, texts: Sequence[str]) -> str:
+        """Начало случайного текста, как при вводе запроса автодополнения"""
+        text = self.choice(texts)
+        return text[: self.rng.randint(min(2, len(text)), len(text))]
+
+
+class Fixtures:
+    """id и тексты документов, из которых составляются запросы"""
+
+    def __init__(self, documents: Dict[str, List[Dict]]):
+        self.film_ids = [doc["id"] for doc in documents["movies"]]
+        self.film_titles = [doc["title"] for doc in documents["movies"]]
+        self.person_ids = [doc["id"] for doc in documents["persons"]]
+        self.person_names = [doc["full_name"] for doc in documents["persons"]]
+        self.genre_ids = [doc["id"] for doc in documents["genres"]]
+
+
+@dataclass
+class Scenario:
+    name: str
+    weight: int
+    make_path: Callable[[Fixtures, Picker], str]
+
+
+def with_params(path: str, **params) -> str:
+    return f"{path}?{urlencode(params)}"
+
+
+SCENARIOS = [
+    Scenario("film_details", 20, lambda f, p: f"/api/v1/film/{p.choice(f.film_ids)}/"),
+    Scenario(
+        "film_batch",
+        3,
+        lambda f, p: "/api/v1/film/batch/?"
+        + urlencode([("id", p.choice(f.film_ids)) for _ in range(5)]),
+    ),
+    Scenario(
+        "film_list",
+        8,
+        lambda f, p: with_params(
+            "/api/v1/film/",
+            **{
+                "sort": p.rng.choice(("-imdb_rating", "imdb_rating")),
+                "page[number]": p.choice(range(1, 11)),
+            },
+        ),
+    ),
+    Scenario(
+        "film_list_by_genre",
+        6,
+        lambda f, p: with_params(
+            "/api/v1/film/",
+            **{"filter[genre]": p.choice(f.genre_ids), "page[size]": 20},
+        ),
+    ),
+    Scenario(
+        "film_search",
+        10,
+        lambda f, p: with_params("/api/v1/film/search/", query=p.word(f.film_titles), size=20),
+    ),
+    Scenario(
+        "film_suggest",
+        5,
+        lambda f, p: with_params("/api/v1/film/suggest/", query=p.prefix(f.film_titles)),
+    ),
+    Scenario("genre_details", 4, lambda f, p: f"/api/v1/genre/{p.choice(f.genre_ids)}/"),
+    Scenario(
+        "genre_list",
+        3,
+        lambda f, p: with_params("/api/v1/genre/", sort=p.rng.choice(("name", "-name"))),
+    ),
+    Scenario("person_details", 12, lambda f, p: f"/api/v1/person/{p.choice(f.person_ids)}/"),
+    Scenario("person_films", 8, lambda f, p: f"/api/v1/person/{p.choice(f.person_ids)}/film/"),
+    Scenario(
+        "person_search",
+        8,
+        lambda f, p: with_params("/api/v1/person/search/", query=p.word(f.person_names), size=20),
+    ),
+    Scenario(
+        "person_suggest",
+        4,
+        lambda f, p: with_params("/api/v1/person/suggest/", query=p.prefix(f.person_names)),
+    ),
+    Scenario("search", 9, lambda f, p: with_params("/api/v1/search/", query=p.word(f.film_titles))),
+]
+
+
+def make_plan(
+    documents: Dict[str, List[Dict]], requests: int, seed: int, zipf: float
+) -> List[Tuple[str, str]]:
+    """Последовательность запросов (сценарий, путь), одинаковая для одного seed"""
+    rng = random.Random(seed)
+    picker = Picker(rng, zipf)
+    fixtures = Fixtures(documents)
+    scenarios = rng.choices(SCENARIOS, weights=[s.weight for s in SCENARIOS], k=requests)
+    return [(scenario.name, scenario.make_path(fixtures, picker)) for scenario in scenarios]
@@ -1,49 +1,99 @@
 from functools import lru_cache
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, List, Optional, Sequence, Tuple
 
 from aioredis import Redis
-from elasticsearch import AsyncElasticsearch, NotFoundError
+from elasticsearch import AsyncElasticsearch
 from fastapi import Depends
 
 from core import json
+from core.pagination import get_next_sort_values
 from db.elastic import get_elastic
+from db.loader import ElasticLoader
 from db.redis import get_redis
 from models.film import Film
+from services.suggest import get_suggest_query
+
+# Поля документа фильма, нужные для списков фильмов
+FILM_LIST_SOURCE_FIELDS = ("id", "title", "imdb_rating")
+# Поля документа фильма, нужные для автодополнения
+FILM_SUGGEST_SOURCE_FIELDS = ("id", "title")
+# Рейтинг, с которым фильмы без рейтинга участвуют в сортировке списка
+FILM_MISSING_RATING = 0
 
 
 class FilmService:
     def __init__(self, redis: Redis, elastic: AsyncElasticsearch):
         self.redis = redis
         self.elastic = elastic
+        self.loader = ElasticLoader(elastic, "movies")
 
     async def get_by_id(self, film_id: str) -> Optional[Film]:
         film = await self._get_film_from_elastic(film_id)
         return film
 
+    async def get_source_by_id(self, film_id: str) -> Optional[Dict]:
+        """Метод получения документа фильма из elastic без валидации"""
+        return await self.loader.load(film_id)
+
+    async def get_by_ids(self, film_ids: List[str]) -> Dict[str, Film]:
+        """Метод получения фильмов по списку id одним запросом"""
+        if not film_ids:
+            return {}
+        docs = await self.loader.load_many(film_ids)
+        return {film_id: Film(**doc) for film_id, doc in docs.items()}
+
     async def get_page(
-        self, filter_map: dict, page_number: int, page_size: int, sort_value: str, sort_order: str
-    ) -> List[Film]:
+        self,
+        filter_map: dict,
+        page_number: int,
+        page_size: int,
+        sort_value: str,
+        sort_order: str,
+        search_after: Optional[List] = None,
+        source_fields: Sequence[str] = FILM_LIST_SOURCE_FIELDS,
+    ) -> Tuple[List[Dict], Optional[List]]:
         return await self._get_films_page_from_elastic(
             filter_map=filter_map,
             page_number=page_number,
             page_size=page_size,
             sort_value=sort_value,
             sort_order=sort_order,
+            search_after=search_after,
+            source_fields=source_fields,
         )
 
     async def _get_film_from_elastic(self, film_id: str) -> Optional[Film]:
-        try:
-            doc = await self.elastic.get(index="movies", id=film_id)
-        except NotFoundError:
+        doc = await self.loader.load(film_id)
+        if not doc:
             return None
 
-        return Film(**doc["_source"])
+        return Film(**doc)
 
     async def _get_films_page_from_elastic(
-        self, filter_map: dict, page_number: int, page_size: int, sort_value: str, sort_order: str
-    ) -> List[Film]:
-
-        search_query = {}
+        self,
+        filter_map: dict,
+        page_number: int,
+        page_size: int,
+        sort_value: str,
+        sort_order: str,
+        search_after: Optional[List] = None,
+        source_fields: Sequence[str] = FILM_LIST_SOURCE_FIELDS,
+    ) -> Tuple[List[Dict], Optional[List]]:
+        """
+        Метод получения страницы фильмов и значений сортировки для следующей страницы.
+        Из elastic запрашиваются только поля source_fields.
+        Если передан search_after, страница читается после указанного документа
+        и номер страницы не учитывается.
+        """
+        search_query: Dict = {
+            "_source": list(source_fields),
+            # У фильма без рейтинга значение сортировки - missing. Без него elastic вернул бы
+            # бесконечность, которая не переживает сериализацию в курсор
+            "sort": [
+                {sort_value: {"order": sort_order, "missing": FILM_MISSING_RATING}},
+                {"id": "asc"},
+            ],
+        }
         if "genre_id" in filter_map:
             search_query["query"] = {
                 "nested": {
@@ -52,25 +102,49 @@ class FilmService:
                 }
             }
 
+        if search_after:
+            search_query["search_after"] = search_after
+
         response = await self.elastic.search(
             index="movies",
             size=page_size,
-            from_=(page_number - 1) * page_size,
-            sort=[f"{sort_value}:{sort_order}"],
+            from_=0 if search_after else (page_number - 1) * page_size,
             body=search_query,
         )
-        return [Film(**doc["_source"]) for doc in response["hits"]["hits"]]
+        hits = response["hits"]["hits"]
+        return [doc["_source"] for doc in hits], get_next_sort_values(hits, page_size)
 
-    async def search_films(self, page: int, size: int, match_obj: str) -> List[Dict]:
+    async def search_films(
+        self,
+        page: int,
+        size: int,
+        match_obj: str,
+        search_after: Optional[List] = None,
+        source_fields: Sequence[str] = FILM_LIST_SOURCE_FIELDS,
+    ) -> Tuple[List[Dict], Optional[List]]:
         """Метод поиска фильмов по названию"""
         query = await self.get_search_query(
-            _source_param=("id", "title", "imdb_rating"), field="title", match_obj=match_obj
+            _source_param=tuple(source_fields), field="title", match_obj=match_obj
         )
+        query["sort"] = ["_score", {"id": "asc"}]
+        if search_after:
+            query["search_after"] = search_after
         films = await self.elastic.search(
-            index="movies", body=json.dumps(query), from_=(page - 1) * size, size=size
+            index="movies",
+            body=json.dumps(query),
+            from_=0 if search_after else (page - 1) * size,
+            size=size,
         )
         films = films["hits"]["hits"]
-        return films
+        return films, get_next_sort_values(films, size)
+
+    async def suggest_films(self, match_obj: str, size: int) -> List[Dict]:
+        """Метод автодополнения названий фильмов"""
+        films = await self.elastic.search(
+            index="movies",
+            body=get_suggest_query("title", match_obj, size, FILM_SUGGEST_SOURCE_FIELDS),
+        )
+        return [doc["_source"] for doc in films["hits"]["hits"]]
 
     @staticmethod
     async def get_search_query(field: str, match_obj: str, _source_param: Tuple = ()) -> Dict:
@@ -1,11 +1,14 @@
 from functools import lru_cache
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 
 from aioredis import Redis
-from elasticsearch import AsyncElasticsearch, NotFoundError
+from elasticsearch import AsyncElasticsearch
 from fastapi import Depends
 
+from core.pagination import get_next_sort_values
 from db.elastic import get_elastic
+from db.genres import get_genre_catalogue
+from db.loader import ElasticLoader
 from db.redis import get_redis
 from models.genre import Genre
 
@@ -13,35 +16,99 @@ GENRE_CACHE_EXPIRE_IN_SECONDS = 60 * 5
 
 
 class GenreService:
-    """Бизнесс логика получения жанров"""
+    """
+    Бизнесс логика получения жанров.
+    Жанры читаются из каталога в памяти, пока он не загружен - из elastic.
+    """
 
     def __init__(self, redis: Redis, elastic: AsyncElasticsearch):
         self.redis = redis
         self.elastic = elastic
+        self.loader = ElasticLoader(elastic, "genres")
 
     async def get_by_id(self, genre_id: str) -> Optional[Genre]:
         """Метод получения данных о жанре"""
-        genre = await self._get_genre_from_elastic(genre_id)
-        if not genre:
+        doc = await self.get_source_by_id(genre_id)
+        if not doc:
             return None
-        return genre
+        return Genre(**doc)
+
+    async def get_source_by_id(self, genre_id: str) -> Optional[Dict]:
+        """Метод получения документа жанра из каталога или elastic без валидации"""
+        catalogue = get_genre_catalogue()
+        if catalogue is not None:
+            return catalogue.get(str(genre_id))
+        return await self.loader.load(genre_id)
+
+    async def get_by_ids(self, genre_ids: List[str]) -> Dict[str, Genre]:
+        """Метод получения жанров по списку id одним запросом"""
+        if not genre_ids:
+            return {}
+        catalogue = get_genre_catalogue()
+        if catalogue is not None:
+            docs = {genre_id: catalogue.get(genre_id) for genre_id in genre_ids}
+            return {genre_id: Genre(**doc) for genre_id, doc in docs.items() if doc}
+        docs = await self.loader.load_many(genre_ids)
+        return {genre_id: Genre(**doc) for genre_id, doc in docs.items()}
 
     async def get_genres_list(
-        self, page: int, size: int, sort_value: str, sort_order: str
-    ) -> List[Genre]:
-        """Метод получения данных о списке жанров из elastic"""
+        self,
+        page: int,
+        size: int,
+        sort_value: str,
+        sort_order: str,
+        search_after: Optional[List] = None,
+    ) -> Tuple[List[Genre], Optional[List]]:
+        """
+        Метод получения данных о списке жанров из elastic
+        и значений сортировки для следующей страницы
+        """
+        docs, next_sort_values = await self.get_genres_source_list(
+            page=page,
+            size=size,
+            sort_value=sort_value,
+            sort_order=sort_order,
+            search_after=search_after,
+        )
+        return [Genre(**doc) for doc in docs], next_sort_values
+
+    async def get_genres_source_list(
+        self,
+        page: int,
+        size: int,
+        sort_value: str,
+        sort_order: str,
+        search_after: Optional[List] = None,
+    ) -> Tuple[List[Dict], Optional[List]]:
+        """Метод получения документов списка жанров из каталога или elastic без валидации"""
+        catalogue = get_genre_catalogue()
+        if catalogue is not None:
+            return catalogue.get_page(
+                page=page,
+                size=size,
+                sort_value=sort_value,
+                sort_order=sort_order,
+                search_after=search_after,
+            )
+
         docs = await self.elastic.search(
-            index="genres", sort=f"{sort_value}:{sort_order}", from_=(page - 1) * size, size=size
+            index="genres",
+            sort=[f"{sort_value}:{sort_order}", "id:asc"],
+            from_=0 if search_after else (page - 1) * size,
+            size=size,
+            _source=["id", "name"],
+            body={"search_after": search_after} if search_after else None,
         )
-        return [Genre(**doc["_source"]) for doc in docs["hits"]["hits"]]
+        hits = docs["hits"]["hits"]
+        return [doc["_source"] for doc in hits], get_next_sort_values(hits, size)
 
-    async def _get_genre_from_elastic(self, genre_id: str) -> Optional[Genre]:
-        """Метод получения данных о жанре из elastic."""
-        try:
-            doc = await self.elastic.get("genres", id=genre_id)
-        except NotFoundError:
-            return None
-        return Genre(**doc["_source"])
+    @staticmethod
+    async def get_search_query(match_obj: str) -> Dict:
+        """Метод формирует запрос полнотекстового поиска жанра по text подполю названия."""
+        return {
+            "_source": ["id", "name"],
+            "query": {"match": {"name.text": match_obj}},
+        }
 
 
 @lru_cache()
@@ -2,23 +2,32 @@ from functools import lru_cache
 from typing import Dict, List, Optional, Tuple
 
 from aioredis import Redis
-from elasticsearch import AsyncElasticsearch, NotFoundError
+from elasticsearch import AsyncElasticsearch
 from fastapi import Depends
 
 from core import json
+from core.pagination import get_next_sort_values
 from db.elastic import get_elastic
+from db.loader import ElasticLoader
 from db.redis import get_redis
-from models.person import Person, PersonFilm, RoleType
+from models.person import Person, RoleType
+from services.suggest import get_suggest_query
 
 PERSON_CACHE_EXPIRE_IN_SECONDS = 60 * 5
+# Поля документа персоны, нужные результату поиска: роли и id фильмов без их названий
+PERSON_SEARCH_SOURCE_FIELDS = ("id", "full_name", "films.id", "films.roles")
 
 
 class PersonService:
-    """Бизнес логика получения персон."""
+    """
+    Бизнес логика получения персон.
+    Фильмы персоны и ее роли в них хранятся в документе персоны, их заполняет etl.
+    """
 
     def __init__(self, redis: Redis, elastic: AsyncElasticsearch):
         self.redis = redis
         self.elastic = elastic
+        self.loader = ElasticLoader(elastic, "persons")
 
     async def get_by_id(self, person_id: str) -> Optional[Tuple[Person, List[str], List[str]]]:
         """Метод получения данных о персоне."""
@@ -26,77 +35,99 @@ class PersonService:
         person = await self._get_person_from_elastic(person_id)
         if not person:
             return None, None, None
-        films = await self.get_person_film_data(person, source_param=["id"])
-        film_ids = set()
-        person_roles = []
-        for role, film in films.items():
-            person_roles.append(role)
-            film_ids.update({film_param["id"] for film_param in film})
-        return person, person_roles, list(film_ids)
+        person_roles, film_ids = self.get_roles_and_film_ids(person)
+        return person, person_roles, film_ids
+
+    async def get_by_ids(
+        self, person_ids: List[str]
+    ) -> Dict[str, Tuple[Person, List[str], List[str]]]:
+        """Метод получения данных о персонах по списку id одним запросом."""
+        if not person_ids:
+            return {}
+        docs = await self.loader.load_many(person_ids)
+        persons_data = {}
+        for person_id, doc in docs.items():
+            person = Person(**doc)
+            person_roles, film_ids = self.get_roles_and_film_ids(person)
+            persons_data[person_id] = (person, person_roles, film_ids)
+        return persons_data
 
     async def get_person_film_list(self, person_id: str) -> Optional[List[Dict]]:
         """Метод получения списка фильмов в которых принимала участие персона."""
 
         person = await self._get_person_from_elastic(person_id)
-        films = await self.get_person_film_data(person, source_param=["id", "title", "imdb_rating"])
-        person_films = {}
-        for role, film in films.items():
-            for film_param in film:
-                if film_param["id"] not in person_films:
-                    film_param["roles"] = [role]
-                    person_films[film_param["id"]] = film_param
-                else:
-                    person_films[film_param["id"]]["roles"].append(role)
-        return [film_param for film_param in person_films.values()]
+        if not person:
+            return []
+        # Роли отдаются значениями, у модели ответа свое перечисление ролей
+        return [
+            {**film.dict(), "roles": [role.value for role in film.roles]} for film in person.films
+        ]
+
+    async def get_person_film_source_list(self, person_id: str) -> List[Dict]:
+        """Метод получения фильмов персоны из документа elastic без валидации."""
+        doc = await self.loader.load(person_id)
+        if not doc:
+            return []
+        return doc["films"]
 
     async def search_person_by_full_name(
-        self, page: int, size: int, match_obj: str
-    ) -> Optional[List[Tuple[Person, List[str], List[str]]]]:
+        self, page: int, size: int, match_obj: str, search_after: Optional[List] = None
+    ) -> Tuple[List[Tuple[Person, List[str], List[str]]], Optional[List]]:
         """Метод поиска персон по полному имени"""
         query = await self.get_search_query(field="full_name", match_obj=match_obj)
+        query["sort"] = ["_score", {"id": "asc"}]
+        if search_after:
+            query["search_after"] = search_after
+        persons = await self.elastic.search(
+            index="persons",
+            body=json.dumps(query),
+            from_=0 if search_after else (page - 1) * size,
+            size=size,
+        )
+        hits = persons["hits"]["hits"]
+        full_persons_data = [self.get_search_result(doc["_source"]) for doc in hits]
+        return full_persons_data, get_next_sort_values(hits, size)
+
+    async def suggest_persons(self, match_obj: str, size: int) -> List[Dict]:
+        """Метод автодополнения полного имени персоны"""
         persons = await self.elastic.search(
-            index="persons", body=json.dumps(query), from_=(page - 1) * size, size=size
+            index="persons",
+            body=get_suggest_query("full_name", match_obj, size, ("id", "full_name")),
         )
-        persons = [person["_source"] for person in persons["hits"]["hits"]]
-        full_persons_data = []
-        for person in persons:
-            person, person_roles, film_ids = await self.get_by_id(person.get("id"))
-            full_persons_data.append((person, person_roles, film_ids))
-        return full_persons_data
+        return [doc["_source"] for doc in persons["hits"]["hits"]]
 
     async def _get_person_from_elastic(self, person_id: str) -> Optional[Person]:
         """Метод получения данных о персоне из elastic."""
-        try:
-            doc = await self.elastic.get("persons", id=person_id)
-        except NotFoundError:
+        doc = await self.loader.load(person_id)
+        if not doc:
             return None
-        return Person(**doc["_source"])
-
-    async def get_person_film_data(self, person: Person, source_param: List) -> Dict:
-        """Метод возвращает данные фильмов в которых учавствовала персона."""
-        person_films_data = {}
-        all_roles = [role.value for role in RoleType]
-        for role in all_roles:
-            path = f"{role}s"
-            term = {f"{path}.id": person.id}
-            query = await self.get_query(_source_param=source_param, path=path, term=term)
-            films = await self.elastic.search(index="movies", body=json.dumps(query))
-            films = films["hits"]["hits"]
-            if films:
-                person_films_data[role] = [film["_source"] for film in films]
-        return person_films_data
+        return Person(**doc)
 
     @staticmethod
-    async def get_query(_source_param: List, path: str, term: Dict) -> Dict:
-        """Метод формирует запрос к elastic в зависимости от параметров."""
-        query = {
-            "_source": _source_param,
-            "query": {"nested": {"path": path, "query": {"term": term}}},
-        }
-        return query
+    def get_roles_and_film_ids(person: Person) -> Tuple[List[str], List[str]]:
+        """Метод возвращает роли персоны и id фильмов, в которых она учавствовала."""
+        person_roles = {role for film in person.films for role in film.roles}
+        film_ids = [str(film.id) for film in person.films]
+        return [role.value for role in RoleType if role in person_roles], film_ids
+
+    @staticmethod
+    def get_search_result(source: Dict) -> Tuple[Person, List[str], List[str]]:
+        """
+        Персона из найденного документа с полями PERSON_SEARCH_SOURCE_FIELDS,
+        ее роли и id фильмов
+        """
+        films = source.get("films", [])
+        person_roles = {role for film in films for role in film["roles"]}
+        return (
+            Person(id=source["id"], full_name=source["full_name"]),
+            [role.value for role in RoleType if role.value in person_roles],
+            [film["id"] for film in films],
+        )
 
     @staticmethod
-    async def get_search_query(field: str, match_obj: str, _source_param: Tuple = ()) -> Dict:
+    async def get_search_query(
+        field: str, match_obj: str, _source_param: Tuple = PERSON_SEARCH_SOURCE_FIELDS
+    ) -> Dict:
         """Метод формирует поисковой запрос к elastic в зависимости от параметров."""
         query = {"_source": _source_param, "query": {"match": {field: match_obj}}}
         return query
@@ -0,0 +1,69 @@
+from functools import lru_cache
+from typing import Dict, List, Tuple
+
+from elasticsearch import AsyncElasticsearch, TransportError
+from fastapi import Depends
+
+from db.elastic import get_elastic
+from models.genre import Genre
+from models.person import Person
+from services.film import FILM_LIST_SOURCE_FIELDS, FilmService
+from services.genre import GenreService
+from services.person import PersonService
+
+
+class SearchService:
+    """Поиск по фильмам, персонам и жанрам одним запросом msearch к elastic"""
+
+    def __init__(self, elastic: AsyncElasticsearch):
+        self.elastic = elastic
+
+    async def search(
+        self, match_obj: str, films_size: int, persons_size: int, genres_size: int
+    ) -> Tuple[List[Dict], List[Tuple[Person, List[str], List[str]]], List[Genre]]:
+        """
+        Метод возвращает найденные фильмы (_source с полями для списка фильмов),
+        персоны с их ролями и id фильмов и жанры.
+        """
+        films_query = await FilmService.get_search_query(
+            field="title", match_obj=match_obj, _source_param=FILM_LIST_SOURCE_FIELDS
+        )
+        persons_query = await PersonService.get_search_query(field="full_name", match_obj=match_obj)
+        genres_query = await GenreService.get_search_query(match_obj=match_obj)
+
+        films_query["size"] = films_size
+        persons_query["size"] = persons_size
+        genres_query["size"] = genres_size
+
+        response = await self.elastic.msearch(
+            body=[
+                {"index": "movies"},
+                films_query,
+                {"index": "persons"},
+                persons_query,
+                {"index": "genres"},
+                genres_query,
+            ]
+        )
+        films_hits, persons_hits, genres_hits = (
+            self.get_hits(result) for result in response["responses"]
+        )
+
+        return (
+            [doc["_source"] for doc in films_hits],
+            [PersonService.get_search_result(doc["_source"]) for doc in persons_hits],
+            [Genre(**doc["_source"]) for doc in genres_hits],
+        )
+
+    @staticmethod
+    def get_hits(result: Dict) -> List[Dict]:
+        """Метод возвращает документы одного поиска из ответа msearch."""
+        if "error" in result:
+            error = result["error"]
+            raise TransportError(result.get("status", 500), error.get("type"), error)
+        return result["hits"]["hits"]
+
+
+@lru_cache()
+def get_search_service(elastic: AsyncElasticsearch = Depends(get_elastic)) -> SearchService:
+    return SearchService(elastic)
@@ -0,0 +1,21 @@
+from typing import Dict, Sequence
+
+
+def get_suggest_query(field: str, match_obj: str, size: int, source_fields: Sequence[str]) -> Dict:
+    """
+    Запрос автодополнения по search_as_you_type подполю suggest поля field.
+    Последнее слово запроса ищется как префикс, общее количество найденных документов не считается.
+    """
+    suggest_field = f"{field}.suggest"
+    return {
+        "_source": list(source_fields),
+        "size": size,
+        "track_total_hits": False,
+        "query": {
+            "multi_match": {
+                "query": match_obj,
+                "type": "bool_prefix",
+                "fields": [suggest_field, f"{suggest_field}._2gram", f"{suggest_field}._3gram"],
+            }
+        },
+    }
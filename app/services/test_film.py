@@ -0,0 +1,67 @@
+import asyncio
+from typing import List, Optional
+
+from core.pagination import decode_cursor, encode_cursor
+from db import genres
+from scripts.benchmark.fakes import FakeElasticsearch
+from services.film import FilmService
+
+FILMS = [
+    {"id": f"00000000-0000-0000-0000-00000000000{i}", "title": f"film {i}", "imdb_rating": rating}
+    for i, rating in enumerate([7.5, None, 8.1, 7.5, None, 6.0, 9.2])
+]
+
+
+def read_all_pages(sort_order: str, page_size: int) -> List[str]:
+    """id фильмов со всех страниц списка, курсор проходит через кодирование, как у клиента"""
+    service = FilmService(redis=None, elastic=FakeElasticsearch({"movies": FILMS}))
+
+    async def read() -> List[str]:
+        film_ids = []
+        cursor: Optional[str] = None
+        while True:
+            films, next_sort_values = await service.get_page(
+                filter_map={},
+                page_number=1,
+                page_size=page_size,
+                sort_value="imdb_rating",
+                sort_order=sort_order,
+                search_after=decode_cursor(cursor) if cursor else None,
+            )
+            film_ids.extend(film["id"] for film in films)
+            if not next_sort_values:
+                return film_ids
+            cursor = encode_cursor(next_sort_values)
+
+    return asyncio.run(read())
+
+
+def test_cursor_pages_across_films_without_rating():
+    for sort_order in ("asc", "desc"):
+        for page_size in (1, 2, 3):
+            film_ids = read_all_pages(sort_order, page_size)
+            assert sorted(film_ids) == sorted(film["id"] for film in FILMS)
+
+
+def test_films_without_rating_sort_as_zero_rating():
+    film_ids = read_all_pages("desc", page_size=10)
+    assert film_ids[-2:] == [FILMS[1]["id"], FILMS[4]["id"]]
+
+
+def test_genre_missing_from_catalogue_is_read_from_elastic(monkeypatch):
+    genre_id = "10000000-0000-0000-0000-000000000001"
+    film = dict(FILMS[0], genres=[{"id": genre_id, "name": "New genre"}])
+    # Снимок каталога жанров загружен до появления нового жанра
+    monkeypatch.setattr(genres, "genre_catalogue", genres.GenreCatalogue([], version=()))
+    service = FilmService(redis=None, elastic=FakeElasticsearch({"movies": [film]}))
+
+    films, _ = asyncio.run(
+        service.get_page(
+            filter_map={"genre_id": genre_id},
+            page_number=1,
+            page_size=10,
+            sort_value="imdb_rating",
+            sort_order="desc",
+        )
+    )
+    assert [f["id"] for f in films] == [film["id"]]
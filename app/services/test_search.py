@@ -0,0 +1,23 @@
+import asyncio
+
+from scripts.benchmark.fakes import FakeElasticsearch
+from services.search import SearchService
+
+GENRES = [
+    {"id": "5373d043-3f41-4ea8-9947-4b746c601601", "name": "Science Fiction", "description": ""},
+    {"id": "5373d043-3f41-4ea8-9947-4b746c601602", "name": "Drama", "description": ""},
+]
+
+
+def search_genres(match_obj: str):
+    service = SearchService(FakeElasticsearch({"movies": [], "persons": [], "genres": GENRES}))
+    _, _, genres = asyncio.run(
+        service.search(match_obj, films_size=10, persons_size=10, genres_size=10)
+    )
+    return [genre.name for genre in genres]
+
+
+def test_genres_are_found_by_words_of_the_name():
+    assert search_genres("fiction") == ["Science Fiction"]
+    assert search_genres("DRAMA") == ["Drama"]
+    assert search_genres("comedy") == []
@@ -0,0 +1,17 @@
+-- Индексы для постраничного чтения изменений etl по курсору (modified, id).
+-- Выполняется после init_db.sh, на существующей базе: make pg-create-etl-indexes
+
+CREATE INDEX IF NOT EXISTS movies_filmwork_modified_id_idx
+    ON public.movies_filmwork USING btree (modified, id);
+CREATE INDEX IF NOT EXISTS movies_person_modified_id_idx
+    ON public.movies_person USING btree (modified, id);
+CREATE INDEX IF NOT EXISTS movies_genre_modified_id_idx
+    ON public.movies_genre USING btree (modified, id);
+
+-- Строки связей читаются по id измененной записи в порядке id строки связи
+CREATE INDEX IF NOT EXISTS movies_filmwork_participants_person_id_id_idx
+    ON public.movies_filmwork_participants USING btree (person_id, id);
+CREATE INDEX IF NOT EXISTS movies_filmwork_participants_filmwork_id_id_idx
+    ON public.movies_filmwork_participants USING btree (filmwork_id, id);
+CREATE INDEX IF NOT EXISTS movies_filmwork_genres_genre_id_id_idx
+    ON public.movies_filmwork_genres USING btree (genre_id, id);
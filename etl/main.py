@@ -1,45 +1,85 @@
+import sys
+import threading
 from datetime import datetime
 from time import sleep
-from typing import Callable, List
+from typing import Callable, List, Optional, Tuple
 
-from pydantic import AnyHttpUrl, BaseSettings, PostgresDsn
+from pydantic import AnyHttpUrl, BaseSettings, PostgresDsn, RedisDsn
 from repo import BaseRepository, FilmworkRepository, GenreRepository, PersonRepository
-from storage import ElasticWriter, JsonFileStorage, PGReader, State
-from utils import coroutine, get_logger, load_indexes, logger
+from storage import CachePublisher, ElasticWriter, JsonFileStorage, PGReader, State
+from utils import coroutine, get_logger, load_indexes, logger, run_pipeline
 
-from models import Filmwork
+from models import Filmwork, Person
 
 
 class Settings(BaseSettings):
     elastic_dsn: AnyHttpUrl
     postgres_dsn: PostgresDsn
+    # Постоянные соединения с postgres и размер пачки строк серверного курсора.
+    # Каждый из 3 пайплайнов одновременно читает данные в 2 стадиях
+    postgres_pool_size: int = 6
+    postgres_itersize: int = 2000
+    # Соединение, простаивавшее дольше (сек), проверяется перед выдачей
+    postgres_health_check_interval: float = 30
     local_storage_path: str = "/var/lib/ymp/etl.json"
     chunk_size: int = 100
+    # Если задан, id обновленных документов публикуются для сброса кэша api
+    redis_dsn: Optional[RedisDsn] = None
+    cache_invalidation_channel: str = "cache:invalidate"
+    # Чтение, обогащение и запись чанков выполняются одновременно в разных потоках
+    pipelined: bool = True
+    # Число потоков записи в elastic и размер очередей чанков между стадиями
+    load_workers: int = 2
+    pipeline_queue_size: int = 4
+    # Ограничения размера bulk запроса в elastic и число одновременных запросов на чанк
+    elastic_bulk_max_items: int = 500
+    elastic_bulk_max_bytes: int = 5 * 1024 * 1024
+    elastic_bulk_in_flight: int = 2
+    # Число повторов документов, отклоненных elastic из-за перегрузки (429)
+    elastic_rejected_retries: int = 8
+    # Пауза между запусками пайплайнов жанров, персон и фильмов (сек)
+    genre_sync_interval: float = 1
+    person_sync_interval: float = 2
+    filmwork_sync_interval: float = 5
 
 
 def beat_coro(
     get_last_timestamp: Callable[[], datetime],
     set_last_timestamp: Callable[[datetime], None],
     consumers_coro,
+    interval: float = 10,
+    name: str = "beat",
 ):
     """
     Корутина для запуска процесса etl.
     1. Получает последнее время синхронизации данных
     2. Передает время обновлении другим корутинам для получения списка обновленных фильмов
     3. После успешной загрузки данных в elastic обновляет последнее время синхронизации
+    4. Ждет interval секунд до следующего запуска
     """
+    beat_logger = get_logger(name)
     while True:
         new_timestamp = datetime.utcnow()
         last_timestamp = get_last_timestamp()
-        logger.info(f'Starting etl process for last timestamp "{last_timestamp}"')
+        beat_logger.info(f'Starting etl process for last timestamp "{last_timestamp}"')
 
         for consumer in consumers_coro:
             consumer.send(last_timestamp)
 
-        logger.info(f'Set new last timestamp to "{new_timestamp}"')
+        beat_logger.info(f'Set new last timestamp to "{new_timestamp}"')
         set_last_timestamp(new_timestamp)
 
-        sleep(10)
+        sleep(interval)
+
+
+def run_beat(name: str, failed: threading.Event, **beat_kwargs):
+    """Запуск beat_coro в отдельном потоке, ошибка пайплайна отмечается в failed"""
+    try:
+        beat_coro(name=name, **beat_kwargs)
+    except Exception:
+        logger.exception(f'Etl process "{name}" failed')
+    finally:
+        failed.set()
 
 
 class BaseEtl:
@@ -49,15 +89,30 @@ class BaseEtl:
 
     etl_name: str = ""
 
-    def __init__(self, repo: BaseRepository, chunk_size: int = 100):
+    def __init__(
+        self,
+        repo: BaseRepository,
+        chunk_size: int = 100,
+        cache_publisher: Optional[CachePublisher] = None,
+        pipelined: bool = False,
+        load_workers: int = 1,
+        queue_size: int = 4,
+    ):
         self.repo = repo
         self.chunk_size = chunk_size
+        self.cache_publisher = cache_publisher
+        self.pipelined = pipelined
+        self.load_workers = load_workers
+        self.queue_size = queue_size
         self.logger = get_logger(self.etl_name)
 
     def get_pipeline(self):
         """
         Формирует корутину для обработки etl пайплайна
         """
+        if self.pipelined:
+            return self.run_pipelined()
+
         # Обновление данных в индексе
         update_index_coro = self.update_items_index()
         # Добавление недостающих данных
@@ -81,8 +136,32 @@ class BaseEtl:
     @coroutine
     def update_items_index(self):
         while items := (yield):
-            self.repo.update_items_index(items)
-            self.logger.info(f'Updated index for "{len(items)}" items.')
+            self.load_items_chunk(items)
+
+    @coroutine
+    def run_pipelined(self):
+        """
+        Корутина для конвейерной обработки: пока одни чанки записываются в elastic,
+        следующие читаются из postgres и обогащаются. Управление возвращается после записи
+        всех чанков, поэтому beat_coro обновляет время синхронизации только после них.
+        Чанки записываются в нескольких потоках и могут попасть в индекс не по порядку:
+        документ, измененный во время обработки, будет перечитан на следующем запуске.
+        """
+        while last_timestamp := (yield):
+            run_pipeline(
+                self.repo.get_modified_items(last_timestamp, chunk_size=self.chunk_size),
+                stages=[(self.enrich_items_chunk, 1), (self.load_items_chunk, self.load_workers)],
+                queue_size=self.queue_size,
+            )
+
+    def load_items_chunk(self, items):
+        self.repo.update_items_index(items)
+        self.logger.info(f'Updated index for "{len(items)}" items.')
+        if self.cache_publisher:
+            # После сброса кэша api не должно закэшировать прежние данные заново,
+            # поэтому документы чанка сначала становятся доступны для поиска
+            self.repo.refresh_index()
+            self.cache_publisher.publish(self.repo.index_name, [i.id for i in items])
 
     def enrich_items_chunk(self, items):
         return items
@@ -95,6 +174,12 @@ class GenreEtl(BaseEtl):
 class PersonEtl(BaseEtl):
     etl_name = "person"
 
+    def enrich_items_chunk(self, items: List[Person]):
+        persons_films_map = self.repo.get_persons_films([p.id for p in items])
+        for person in items:
+            person.films = persons_films_map.get(person.id, [])
+        return items
+
 
 class FilmworkEtl(BaseEtl):
     etl_name = "filmwork"
@@ -125,8 +210,24 @@ def main():
     load_indexes(es_dsn=settings.elastic_dsn)
     # Клиенты для хранилищ
     state_storage = State(JsonFileStorage(str(settings.local_storage_path)))
-    pg_reader = PGReader(str(settings.postgres_dsn))
-    elastic_writer = ElasticWriter(str(settings.elastic_dsn))
+    pg_reader = PGReader(
+        str(settings.postgres_dsn),
+        pool_size=settings.postgres_pool_size,
+        itersize=settings.postgres_itersize,
+        health_check_interval=settings.postgres_health_check_interval,
+    )
+    elastic_writer = ElasticWriter(
+        str(settings.elastic_dsn),
+        max_bulk_items=settings.elastic_bulk_max_items,
+        max_bulk_bytes=settings.elastic_bulk_max_bytes,
+        max_in_flight=settings.elastic_bulk_in_flight,
+        rejected_retries=settings.elastic_rejected_retries,
+    )
+    cache_publisher = (
+        CachePublisher(str(settings.redis_dsn), channel=settings.cache_invalidation_channel)
+        if settings.redis_dsn
+        else None
+    )
 
     # Репозитории моделей для получения и обновления данных
     genre_repo = GenreRepository(pg_reader=pg_reader, elastic_writer=elastic_writer)
@@ -134,30 +235,63 @@ def main():
     filmwork_repo = FilmworkRepository(pg_reader=pg_reader, elastic_writer=elastic_writer)
 
     # Etl пайплайны для жанров, персонажей, фильмов
-    genre_etl = GenreEtl(repo=genre_repo, chunk_size=settings.chunk_size)
-    person_etl = PersonEtl(repo=person_repo, chunk_size=settings.chunk_size)
-    filmwork_etl = FilmworkEtl(repo=filmwork_repo, chunk_size=settings.chunk_size)
-
-    genre_pipeline = genre_etl.get_pipeline()
-    person_pipeline = person_etl.get_pipeline()
-    filmwork_pipeline = filmwork_etl.get_pipeline()
-
-    def last_timestamp_getter() -> datetime:
-        last_timestampt = state_storage.get_state("timestamp")
-        if last_timestampt:
-            return datetime.fromisoformat(last_timestampt)
-
-        return datetime.min
-
-    def last_timestamp_setter(timestamp: datetime):
-        state_storage.set_state("timestamp", timestamp.isoformat())
-
-    # Корутина для запуска процесса ETL
-    beat_coro(
-        get_last_timestamp=last_timestamp_getter,
-        set_last_timestamp=last_timestamp_setter,
-        consumers_coro=[genre_pipeline, person_pipeline, filmwork_pipeline],
+    etl_options = dict(
+        chunk_size=settings.chunk_size,
+        cache_publisher=cache_publisher,
+        pipelined=settings.pipelined,
+        load_workers=settings.load_workers,
+        queue_size=settings.pipeline_queue_size,
     )
+    genre_etl = GenreEtl(repo=genre_repo, **etl_options)
+    person_etl = PersonEtl(repo=person_repo, **etl_options)
+    filmwork_etl = FilmworkEtl(repo=filmwork_repo, **etl_options)
+
+    def last_timestamp_accessors(
+        key: str,
+    ) -> Tuple[Callable[[], datetime], Callable[[datetime], None]]:
+        def last_timestamp_getter() -> datetime:
+            # Общее время синхронизации всех пайплайнов, сохраненное до их разделения
+            last_timestampt = state_storage.get_state(key) or state_storage.get_state("timestamp")
+            if last_timestampt:
+                return datetime.fromisoformat(last_timestampt)
+
+            return datetime.min
+
+        def last_timestamp_setter(timestamp: datetime):
+            state_storage.set_state(key, timestamp.isoformat())
+
+        return last_timestamp_getter, last_timestamp_setter
+
+    # Пайплайны работают одновременно, каждый со своим временем синхронизации и интервалом,
+    # поэтому долгая обработка фильмов не задерживает обновление жанров и персон
+    failed = threading.Event()
+    for etl, interval in (
+        (genre_etl, settings.genre_sync_interval),
+        (person_etl, settings.person_sync_interval),
+        (filmwork_etl, settings.filmwork_sync_interval),
+    ):
+        get_last_timestamp, set_last_timestamp = last_timestamp_accessors(
+            f"{etl.etl_name}_timestamp"
+        )
+        threading.Thread(
+            target=run_beat,
+            name=etl.etl_name,
+            kwargs=dict(
+                name=etl.etl_name,
+                failed=failed,
+                get_last_timestamp=get_last_timestamp,
+                set_last_timestamp=set_last_timestamp,
+                consumers_coro=[etl.get_pipeline()],
+                interval=interval,
+            ),
+            daemon=True,
+        ).start()
+
+    # Остановка одного пайплайна завершает процесс, чтобы его перезапустил оркестратор.
+    # Время синхронизации обновляется только после записи всех данных,
+    # поэтому прерванные пайплайны повторят обработку после перезапуска
+    failed.wait()
+    sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -16,10 +16,19 @@ class FilmworkPerson:
         return asdict(self)
 
 
+@dataclass
+class PersonFilm:
+    id: str
+    title: str
+    imdb_rating: Optional[float] = field(default=None)
+    roles: List[str] = field(default_factory=list)
+
+
 @dataclass
 class Person:
     id: str
     full_name: str
+    films: List[PersonFilm] = field(default_factory=list)
 
     def to_dict(self):
         return asdict(self)
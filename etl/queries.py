@@ -1,33 +1,49 @@
+"""
+Запросы etl к postgres.
+Запросы обновленных записей читают страницы по курсору: строки упорядочены по ключу
+(modified, id) таблицы изменений, для запросов с join - (modified, id, id строки связи).
+Последние колонки результата - ключ сортировки, ключ последней строки страницы передается
+в {cursor} для чтения следующей страницы.
+"""
+
 select_modified_filmworks_from_persons = """
-SELECT fw_p.filmwork_id
+SELECT fw_p.filmwork_id,
+       p.modified,
+       p.id,
+       fw_p.id
   FROM movies_person p
   JOIN movies_filmwork_participants fw_p
     ON p.id = fw_p.person_id
  WHERE p.modified > {last_timestamp}
- ORDER BY p.modified ASC
-OFFSET {offset}
+   AND (p.modified, p.id, fw_p.id) > ({cursor})
+ ORDER BY p.modified ASC, p.id ASC, fw_p.id ASC
  LIMIT {limit}
 """
 
 
 select_modified_filmworks_from_genres = """
-SELECT fw_g.filmwork_id
+SELECT fw_g.filmwork_id,
+       g.modified,
+       g.id,
+       fw_g.id
   FROM movies_genre g
   JOIN movies_filmwork_genres fw_g
     ON g.id = fw_g.genre_id
  WHERE g.modified > {last_timestamp}
- ORDER BY g.modified ASC
-OFFSET {offset}
+   AND (g.modified, g.id, fw_g.id) > ({cursor})
+ ORDER BY g.modified ASC, g.id ASC, fw_g.id ASC
  LIMIT {limit}
 """
 
 
 select_modified_filmworks = """
-SELECT id
+SELECT id,
+       modified,
+       id
   FROM movies_filmwork
  WHERE modified > {last_timestamp}
- ORDER BY modified ASC
-OFFSET {offset}
+   AND (modified, id) > ({cursor})
+ ORDER BY modified ASC, id ASC
  LIMIT {limit}
 """
 
@@ -75,23 +91,63 @@ SELECT fw_g.filmwork_id,
 
 
 select_modified_persons = """
+SELECT id,
+       modified,
+       id
+  FROM movies_person
+ WHERE modified > {last_timestamp}
+   AND (modified, id) > ({cursor})
+ ORDER BY modified ASC, id ASC
+ LIMIT {limit}
+"""
+
+
+select_modified_persons_from_filmworks = """
+SELECT fw_p.person_id,
+       fw.modified,
+       fw.id,
+       fw_p.id
+  FROM movies_filmwork fw
+  JOIN movies_filmwork_participants fw_p
+    ON fw.id = fw_p.filmwork_id
+ WHERE fw.modified > {last_timestamp}
+   AND (fw.modified, fw.id, fw_p.id) > ({cursor})
+ ORDER BY fw.modified ASC, fw.id ASC, fw_p.id ASC
+ LIMIT {limit}
+"""
+
+
+select_persons_query = """
 SELECT id,
        first_name,
        last_name
   FROM movies_person
- WHERE modified > {last_timestamp}
+ WHERE id in ({persons_ids})
  ORDER BY modified ASC
-OFFSET {offset}
- LIMIT {limit}
+"""
+
+
+select_persons_films_query = """
+SELECT fw_p.person_id,
+       fw.id,
+       fw.title,
+       fw.rating,
+       fw_p.role
+  FROM movies_filmwork fw
+  JOIN movies_filmwork_participants fw_p
+    ON fw.id = fw_p.filmwork_id
+ WHERE fw_p.person_id in ({persons_ids})
 """
 
 
 select_modified_genres = """
 SELECT id,
-       name
+       name,
+       modified,
+       id
   FROM movies_genre
  WHERE modified > {last_timestamp}
- ORDER BY modified ASC
-OFFSET {offset}
+   AND (modified, id) > ({cursor})
+ ORDER BY modified ASC, id ASC
  LIMIT {limit}
 """
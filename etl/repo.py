@@ -2,12 +2,20 @@ from abc import ABC, abstractmethod
 from collections import defaultdict
 from datetime import datetime
 from itertools import chain
-from typing import Any, Dict, Iterator, List, Set
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple
 
-from storage import ElasticWriter, PGReader
+from storage import Cursor, ElasticWriter, PGReader
 from utils import logger
 
-from models import Filmwork, FilmworkIDType, FilmworkPerson, Genre, Person
+from models import (
+    Filmwork,
+    FilmworkIDType,
+    FilmworkPerson,
+    Genre,
+    Person,
+    PersonFilm,
+    PersonIDType,
+)
 
 
 class BaseRepository(ABC):
@@ -15,6 +23,9 @@ class BaseRepository(ABC):
     Базовый класс для описания запросов к postgres, elastic в рамках конкретной модели данных
     """
 
+    # Индекс elastic, в котором хранятся документы модели
+    index_name: str = ""
+
     def __init__(self, pg_reader: PGReader, elastic_writer: ElasticWriter):
         self.pg_reader = pg_reader
         self.elastic_writer = elastic_writer
@@ -35,19 +46,43 @@ class BaseRepository(ABC):
         """
         pass
 
+    def refresh_index(self) -> None:
+        """Документы, записанные в индекс, становятся доступны для поиска"""
+        self.elastic_writer.refresh(self.index_name)
+
+    @staticmethod
+    def read_pages(
+        read_page: Callable[[datetime, Optional[Cursor], int], Tuple[List[Any], Optional[Cursor]]],
+        last_timestamp: datetime,
+        limit: int,
+    ) -> Iterator[List[Any]]:
+        """
+        Постраничное чтение записей, обновленных после last_timestamp, по курсору (modified, id).
+        Каждая страница читается по индексу без пропуска предыдущих строк. Запись, обновленная
+        во время чтения, получает ключ больше курсора и будет прочитана позже, а не пропущена.
+        """
+        cursor = None
+        while True:
+            rows, cursor = read_page(last_timestamp, cursor, limit)
+            if not rows:
+                return
+            yield rows
+
 
 class GenreRepository(BaseRepository):
+    index_name = "genres"
+
     def get_modified_items(
         self, last_timestamp: datetime, chunk_size: int = 100
     ) -> Iterator[List[Genre]]:
-        offset = 0
-        while items := self.pg_reader.read_modified_genres(last_timestamp, offset, chunk_size):
-            offset += len(items)
+        for items in self.read_pages(
+            self.pg_reader.read_modified_genres, last_timestamp, limit=chunk_size
+        ):
             yield [Genre(id=genre_id, name=name) for genre_id, name in items]
 
     def update_items_index(self, items: List[Genre]) -> None:
-        result = self.elastic_writer.bulk_create_or_update(
-            index_name="genres", items=[(i.id, i.to_dict()) for i in items]
+        result = self.elastic_writer.bulk_index(
+            index_name=self.index_name, items=[(i.id, i.to_dict()) for i in items]
         )
         for item_id, error in result:
             if error:
@@ -57,20 +92,103 @@ class GenreRepository(BaseRepository):
 
 
 class PersonRepository(BaseRepository):
+    index_name = "persons"
+
     def get_modified_items(
         self, last_timestamp: datetime, chunk_size: int = 100
     ) -> Iterator[List[Person]]:
-        offset = 0
-        while items := self.pg_reader.read_modified_persons(last_timestamp, offset, chunk_size):
-            offset += len(items)
-            yield [
-                Person(id=person_id, full_name=f"{first_name} {last_name}")
-                for person_id, first_name, last_name in items
-            ]
+        """
+        Получение списка обновленных персон. id обновленных персон собираются из 2 источников:
+        1. Непосредственно обновленные персоны
+        2. Обновленные фильмы, в которых участвуют персоны. В документе персоны хранятся
+           ее фильмы и роли в них, поэтому изменение фильма или состава его участников
+           требует обновления документов персон.
+        3. Персоны, в документах которых в индексе есть обновленные фильмы. Участника,
+           удаленного из фильма, уже нет в postgres, но его документ еще содержит фильм.
+
+        Чтобы исключить дублирование id персон обработанные id записываются в unique_ids.
+        Данные о персонах возвращаются пачками по chunk_size записей.
+        """
+        unique_ids: Set[PersonIDType] = set()
+        chunk_person_ids: List[PersonIDType] = []
+
+        for possible_person_ids in chain(
+            self._get_modified_persons(last_timestamp, limit=chunk_size),
+            self._get_modified_persons_from_filmworks(last_timestamp, limit=chunk_size),
+            self._get_indexed_persons_of_modified_filmworks(last_timestamp, limit=chunk_size),
+        ):
+            for person_id in possible_person_ids:
+                if person_id in unique_ids:
+                    continue
+
+                unique_ids.add(person_id)
+                chunk_person_ids.append(person_id)
+
+                if len(chunk_person_ids) >= chunk_size:
+                    yield self.get_persons(chunk_person_ids)
+                    chunk_person_ids = []
+
+        if chunk_person_ids:
+            yield self.get_persons(chunk_person_ids)
+
+    def _get_modified_persons(
+        self, last_timestamp: datetime, limit: int
+    ) -> Iterator[List[PersonIDType]]:
+        return self.read_pages(self.pg_reader.read_modified_persons, last_timestamp, limit=limit)
+
+    def _get_modified_persons_from_filmworks(
+        self, last_timestamp: datetime, limit: int
+    ) -> Iterator[List[PersonIDType]]:
+        return self.read_pages(
+            self.pg_reader.read_modified_persons_from_filmworks, last_timestamp, limit=limit
+        )
+
+    def _get_indexed_persons_of_modified_filmworks(
+        self, last_timestamp: datetime, limit: int
+    ) -> Iterator[List[PersonIDType]]:
+        for filmworks_ids in self.read_pages(
+            self.pg_reader.read_modified_filmworks, last_timestamp, limit=limit
+        ):
+            yield from self.elastic_writer.read_ids_by_query(
+                index_name=self.index_name,
+                query={
+                    "nested": {
+                        "path": "films",
+                        "query": {"terms": {"films.id": [str(i) for i in filmworks_ids]}},
+                    }
+                },
+                page_size=limit,
+            )
+
+    def get_persons(self, persons_ids: List[PersonIDType]) -> List[Person]:
+        return [
+            Person(id=person_id, full_name=f"{first_name} {last_name}")
+            for person_id, first_name, last_name in self.pg_reader.read_persons(persons_ids)
+        ]
+
+    def get_persons_films(
+        self, persons_ids: List[PersonIDType]
+    ) -> Dict[PersonIDType, List[PersonFilm]]:
+        """
+        Получение фильмов персон с ролями персоны в каждом фильме
+        """
+        persons_to_films_map: Dict[PersonIDType, Dict[FilmworkIDType, PersonFilm]] = defaultdict(
+            dict
+        )
+        for person_id, filmwork_id, title, rating, role in self.pg_reader.read_persons_films(
+            persons_ids
+        ):
+            person_film = persons_to_films_map[person_id].setdefault(
+                filmwork_id, PersonFilm(id=filmwork_id, title=title, imdb_rating=rating)
+            )
+            person_film.roles.append(role)
+        return {
+            person_id: list(films.values()) for person_id, films in persons_to_films_map.items()
+        }
 
     def update_items_index(self, items: List[Person]) -> None:
-        result = self.elastic_writer.bulk_create_or_update(
-            index_name="persons", items=[(i.id, i.to_dict()) for i in items]
+        result = self.elastic_writer.bulk_index(
+            index_name=self.index_name, items=[(i.id, i.to_dict()) for i in items]
         )
         for item_id, error in result:
             if error:
@@ -80,6 +198,8 @@ class PersonRepository(BaseRepository):
 
 
 class FilmworkRepository(BaseRepository):
+    index_name = "movies"
+
     def get_modified_items(
         self, last_timestamp: datetime, chunk_size: int = 100
     ) -> Iterator[List[Filmwork]]:
@@ -117,30 +237,21 @@ class FilmworkRepository(BaseRepository):
     def _get_modified_filmworks(
         self, last_timestamp: datetime, limit: int
     ) -> Iterator[List[FilmworkIDType]]:
-        offset = 0
-        while filmwork_ids := self.pg_reader.read_modified_filmworks(last_timestamp, offset, limit):
-            offset += len(filmwork_ids)
-            yield filmwork_ids
+        return self.read_pages(self.pg_reader.read_modified_filmworks, last_timestamp, limit=limit)
 
     def _get_modified_filmworks_from_genres(
         self, last_timestamp: datetime, limit: int
     ) -> Iterator[List[FilmworkIDType]]:
-        offset = 0
-        while filmwork_ids := self.pg_reader.read_modified_filmworks_from_genres(
-            last_timestamp, offset, limit
-        ):
-            offset += len(filmwork_ids)
-            yield filmwork_ids
+        return self.read_pages(
+            self.pg_reader.read_modified_filmworks_from_genres, last_timestamp, limit=limit
+        )
 
     def _get_modified_filmworks_from_persons(
         self, last_timestamp: datetime, limit: int
     ) -> Iterator[List[FilmworkIDType]]:
-        offset = 0
-        while filmwork_ids := self.pg_reader.read_modified_filmworks_from_persons(
-            last_timestamp, offset, limit
-        ):
-            offset += len(filmwork_ids)
-            yield filmwork_ids
+        return self.read_pages(
+            self.pg_reader.read_modified_filmworks_from_persons, last_timestamp, limit=limit
+        )
 
     def get_filmworks(self, filmworks_ids: List[FilmworkIDType]) -> List[Filmwork]:
         filmworks = []
@@ -184,13 +295,13 @@ class FilmworkRepository(BaseRepository):
         Получение жанров фильмов
         """
         filmworks_to_genres_map: Dict[FilmworkIDType, Genre] = defaultdict(list)
-        for (filmwork_id, genre_id, name) in self.pg_reader.read_filmworks_genres(filmworks_ids):
+        for filmwork_id, genre_id, name in self.pg_reader.read_filmworks_genres(filmworks_ids):
             filmworks_to_genres_map[filmwork_id].append(Genre(id=genre_id, name=name))
         return filmworks_to_genres_map
 
     def update_items_index(self, items: List[Filmwork]) -> None:
-        result = self.elastic_writer.bulk_create_or_update(
-            index_name="movies", items=[(i.id, i.to_dict()) for i in items]
+        result = self.elastic_writer.bulk_index(
+            index_name=self.index_name, items=[(i.id, i.to_dict()) for i in items]
         )
         for item_id, error in result:
             if error:
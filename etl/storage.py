@@ -1,13 +1,21 @@
 import abc
 import json
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
 from functools import partialmethod
 from pathlib import Path
-from typing import Any, List, Optional, Tuple
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 import psycopg2
+import redis
 import requests
 from psycopg2 import sql
+from psycopg2.extensions import connection
+from psycopg2.pool import ThreadedConnectionPool
 from queries import (
     select_filmworks_genres_query,
     select_filmworks_participants_query,
@@ -17,61 +25,233 @@ from queries import (
     select_modified_filmworks_from_persons,
     select_modified_genres,
     select_modified_persons,
+    select_modified_persons_from_filmworks,
+    select_persons_films_query,
+    select_persons_query,
 )
-from utils import backoff
+from utils import backoff, logger
 
 from models import FilmworkIDType, GenreIDType, PersonIDType
 
+# Курсор постраничного чтения обновленных записей: ключ сортировки последней прочитанной строки
+Cursor = Tuple[Any, ...]
+# id меньше любого uuid, начальное значение id в курсоре
+MIN_ID = "00000000-0000-0000-0000-000000000000"
+
 
 def is_db_reader_connection_error(e: Exception):
-    return isinstance(e, psycopg2.OperationalError) and "Connection refused" in str(e)
+    # Отказ в соединении и разрыв установленного соединения
+    return isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError))
 
 
 def is_writer_connection_error(e: Exception):
+    # Отказ всего bulk запроса из-за перегрузки elastic повторяется так же, как недоступность
+    if isinstance(e, requests.exceptions.HTTPError):
+        return e.response is not None and e.response.status_code == 429
     return isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
 
 
 class PGReader:
     """
-    Класс для чтения данных из postgres
+    Класс для чтения данных из postgres.
+    Соединения берутся из пула. Соединение, которое простаивало дольше health_check_interval,
+    перед использованием проверяется запросом SELECT 1. Разорванное соединение закрывается,
+    а запрос повторяется через backoff с новым соединением.
     """
 
-    def __init__(self, postgres_dsn: str):
+    def __init__(
+        self,
+        postgres_dsn: str,
+        pool_size: int = 4,
+        itersize: int = 2000,
+        health_check_interval: float = 30,
+    ):
         self.postgres_dsn = postgres_dsn
+        self.pool_size = pool_size
+        self.itersize = itersize
+        self.health_check_interval = health_check_interval
+        self._pool: Optional[ThreadedConnectionPool] = None
+        self._pool_lock = threading.Lock()
+        # Пул не ждет освобождения соединения, поэтому ожидание ограничивается семафором
+        self._pool_slots = threading.BoundedSemaphore(pool_size)
+        self._last_used: Dict[int, float] = {}
+
+    def _get_pool(self) -> ThreadedConnectionPool:
+        with self._pool_lock:
+            if self._pool is None:
+                # Пул хранит не больше minconn свободных соединений, остальные закрывает
+                self._pool = ThreadedConnectionPool(
+                    self.pool_size, self.pool_size, self.postgres_dsn
+                )
+            return self._pool
+
+    def _acquire(self) -> connection:
+        self._pool_slots.acquire()
+        try:
+            conn = self._get_pool().getconn()
+        except Exception:
+            self._pool_slots.release()
+            raise
+
+        try:
+            self._check_connection(conn)
+        except Exception as e:
+            self._release(conn, broken=is_db_reader_connection_error(e))
+            raise
+        return conn
+
+    def _check_connection(self, conn: connection) -> None:
+        if conn.closed:
+            raise psycopg2.InterfaceError("connection already closed")
+
+        last_used = self._last_used.get(id(conn))
+        if last_used is None:
+            # Новое соединение: etl только читает данные
+            conn.set_session(readonly=True)
+        elif time.monotonic() - last_used > self.health_check_interval:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+
+    def _release(self, conn: connection, broken: bool = False) -> None:
+        """Возврат соединения в пул, разорванное соединение закрывается"""
+        if not broken and not conn.closed:
+            try:
+                # Завершаем транзакцию чтения, чтобы соединение не простаивало в транзакции
+                conn.rollback()
+            except psycopg2.Error:
+                broken = True
+
+        broken = broken or bool(conn.closed)
+        if broken:
+            self._last_used.pop(id(conn), None)
+        else:
+            self._last_used[id(conn)] = time.monotonic()
+        try:
+            self._get_pool().putconn(conn, close=broken)
+            if conn.closed:
+                self._last_used.pop(id(conn), None)
+        finally:
+            self._pool_slots.release()
+
+    @contextmanager
+    def connection(self) -> Iterator[connection]:
+        conn = self._acquire()
+        broken = False
+        try:
+            yield conn
+        except Exception as e:
+            broken = is_db_reader_connection_error(e)
+            raise
+        finally:
+            self._release(conn, broken=broken)
+
+    def close(self) -> None:
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.closeall()
+                self._pool = None
+                self._last_used.clear()
 
     @backoff(
         on_predicate=is_db_reader_connection_error,
         border_sleep_time=60,
     )
-    def read(self, query):
-        with psycopg2.connect(self.postgres_dsn) as conn:
+    def read(self, query) -> List[Tuple]:
+        """Чтение небольшого результата целиком, например страницы изменений"""
+        with self.connection() as conn:
             with conn.cursor() as cursor:
                 cursor.execute(query)
                 return cursor.fetchall()
 
-    def read_modified_filmworks_by_query(
-        self, query: str, last_timestamp: datetime, offset: int, limit: int
-    ) -> List[str]:
+    @backoff(
+        on_predicate=is_db_reader_connection_error,
+        border_sleep_time=60,
+    )
+    def _open_stream(self, query) -> Tuple[connection, Any, List[Tuple]]:
+        """Открытие именованного курсора и чтение первых itersize строк"""
+        conn = self._acquire()
+        try:
+            cursor = conn.cursor(name=f"etl_{uuid.uuid4().hex}")
+            cursor.itersize = self.itersize
+            cursor.execute(query)
+            return conn, cursor, cursor.fetchmany(self.itersize)
+        except Exception as e:
+            self._release(conn, broken=is_db_reader_connection_error(e))
+            raise
+
+    def stream(self, query) -> Iterator[Tuple]:
+        """
+        Чтение результата серверным (именованным) курсором по itersize строк,
+        память не зависит от размера результата.
+        Запрос повторяется через backoff только до получения первых строк,
+        разрыв соединения во время чтения завершает чтение ошибкой.
+        """
+        conn, cursor, rows = self._open_stream(query)
+        broken = False
+        try:
+            while rows:
+                yield from rows
+                rows = cursor.fetchmany(self.itersize)
+            cursor.close()
+        except Exception as e:
+            broken = is_db_reader_connection_error(e)
+            raise
+        finally:
+            self._release(conn, broken=broken)
+
+    def read_modified_by_query(
+        self,
+        query: str,
+        last_timestamp: datetime,
+        cursor: Optional[Cursor],
+        limit: int,
+        cursor_size: int = 2,
+    ) -> Tuple[List[Tuple], Optional[Cursor]]:
         """
-        Получение id фильмов, обновленных после last_timestamp
+        Получение страницы строк, обновленных после last_timestamp, следующей за cursor.
+        Последние cursor_size колонок запроса - ключ сортировки, они в строки не попадают.
+        Возвращает строки и курсор следующей страницы.
         """
+        if cursor is None:
+            cursor = (last_timestamp, *[MIN_ID] * (cursor_size - 1))
         result = self.read(
             sql.SQL(query).format(
                 last_timestamp=sql.Literal(last_timestamp.isoformat()),
-                offset=sql.Literal(offset),
+                cursor=sql.SQL(", ").join(sql.Literal(value) for value in cursor),
                 limit=sql.Literal(limit),
             )
         )
-        return [t[0] for t in result]
+        if not result:
+            return [], cursor
+        return [row[:-cursor_size] for row in result], tuple(result[-1][-cursor_size:])
+
+    def read_modified_ids_by_query(
+        self,
+        query: str,
+        last_timestamp: datetime,
+        cursor: Optional[Cursor],
+        limit: int,
+        cursor_size: int = 2,
+    ) -> Tuple[List[str], Optional[Cursor]]:
+        """
+        Получение id фильмов или персон, обновленных после last_timestamp
+        """
+        rows, next_cursor = self.read_modified_by_query(
+            query, last_timestamp, cursor, limit, cursor_size=cursor_size
+        )
+        return [t[0] for t in rows], next_cursor
 
     read_modified_filmworks_from_persons = partialmethod(
-        read_modified_filmworks_by_query, select_modified_filmworks_from_persons
+        read_modified_ids_by_query, select_modified_filmworks_from_persons, cursor_size=3
     )
     read_modified_filmworks_from_genres = partialmethod(
-        read_modified_filmworks_by_query, select_modified_filmworks_from_genres
+        read_modified_ids_by_query, select_modified_filmworks_from_genres, cursor_size=3
     )
-    read_modified_filmworks = partialmethod(
-        read_modified_filmworks_by_query, select_modified_filmworks
+    read_modified_filmworks = partialmethod(read_modified_ids_by_query, select_modified_filmworks)
+    read_modified_persons = partialmethod(read_modified_ids_by_query, select_modified_persons)
+    read_modified_persons_from_filmworks = partialmethod(
+        read_modified_ids_by_query, select_modified_persons_from_filmworks, cursor_size=3
     )
 
     def read_filmworks(self, filmworks_ids: List[FilmworkIDType]):
@@ -81,7 +261,7 @@ class PGReader:
         query = sql.SQL(select_filmworks_query).format(
             filmworks_ids=sql.SQL(",").join(sql.Literal(fw_id) for fw_id in filmworks_ids)
         )
-        return self.read(query)
+        return self.stream(query)
 
     def read_filmworks_participants(self, filmworks_ids: List[FilmworkIDType]):
         """
@@ -90,7 +270,7 @@ class PGReader:
         query = sql.SQL(select_filmworks_participants_query).format(
             filmworks_ids=sql.SQL(",").join(sql.Literal(fw_id) for fw_id in filmworks_ids)
         )
-        return self.read(query)
+        return self.stream(query)
 
     def read_filmworks_genres(self, filmworks_ids: List[FilmworkIDType]):
         """
@@ -99,35 +279,37 @@ class PGReader:
         query = sql.SQL(select_filmworks_genres_query).format(
             filmworks_ids=sql.SQL(",").join(sql.Literal(fw_id) for fw_id in filmworks_ids)
         )
-        return self.read(query)
+        return self.stream(query)
 
-    def read_modified_persons(
-        self, last_timestamp: datetime, offset: int, limit: int
-    ) -> List[Tuple[PersonIDType, str, str]]:
+    def read_persons(self, persons_ids: List[PersonIDType]):
         """
-        Получения данных о персонах, обновленных после last_timestamp
+        Получение персон по списку id
         """
-        return self.read(
-            sql.SQL(select_modified_persons).format(
-                last_timestamp=sql.Literal(last_timestamp.isoformat()),
-                offset=sql.Literal(offset),
-                limit=sql.Literal(limit),
-            )
+        query = sql.SQL(select_persons_query).format(
+            persons_ids=sql.SQL(",").join(sql.Literal(p_id) for p_id in persons_ids)
         )
+        return self.stream(query)
+
+    def read_persons_films(self, persons_ids: List[PersonIDType]):
+        """
+        Получение фильмов и ролей в них по списку id персон
+        """
+        query = sql.SQL(select_persons_films_query).format(
+            persons_ids=sql.SQL(",").join(sql.Literal(p_id) for p_id in persons_ids)
+        )
+        return self.stream(query)
 
     def read_modified_genres(
-        self, last_timestamp: datetime, offset: int, limit: int
-    ) -> List[Tuple[GenreIDType, str]]:
+        self, last_timestamp: datetime, cursor: Optional[Cursor], limit: int
+    ) -> Tuple[List[Tuple[GenreIDType, str]], Optional[Cursor]]:
         """
         Получения данных о жанрах, обновленных после last_timestamp
         """
-        return self.read(
-            sql.SQL(select_modified_genres).format(
-                last_timestamp=sql.Literal(last_timestamp.isoformat()),
-                offset=sql.Literal(offset),
-                limit=sql.Literal(limit),
-            )
-        )
+        return self.read_modified_by_query(select_modified_genres, last_timestamp, cursor, limit)
+
+
+class BulkRejectedError(Exception):
+    """Elastic продолжает отклонять документы из-за переполнения очереди записи"""
 
 
 class ElasticWriter:
@@ -135,10 +317,38 @@ class ElasticWriter:
     Класс для записи данных в elastic
     """
 
-    def __init__(self, elastic_url: str):
+    def __init__(
+        self,
+        elastic_url: str,
+        max_bulk_items: int = 500,
+        max_bulk_bytes: int = 5 * 1024 * 1024,
+        max_in_flight: int = 2,
+        rejected_retries: int = 8,
+        rejected_start_sleep_time: float = 0.5,
+        rejected_border_sleep_time: float = 30,
+    ):
         self.elastic_url = elastic_url
-        self.session = requests.Session()
-        self.session.headers["Content-Type"] = "application/json"
+        self.max_bulk_items = max_bulk_items
+        self.max_bulk_bytes = max_bulk_bytes
+        self.rejected_retries = rejected_retries
+        self.rejected_start_sleep_time = rejected_start_sleep_time
+        self.rejected_border_sleep_time = rejected_border_sleep_time
+        self._local = threading.local()
+        # Пачки одного вызова bulk_index отправляются параллельно
+        self._executor = (
+            ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="elastic-bulk")
+            if max_in_flight > 1
+            else None
+        )
+
+    @property
+    def session(self) -> requests.Session:
+        """Сессия текущего потока: запись в elastic может выполняться в нескольких потоках"""
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+            session.headers["Content-Type"] = "application/x-ndjson"
+        return session
 
     @backoff(
         on_predicate=is_writer_connection_error,
@@ -149,89 +359,154 @@ class ElasticWriter:
         response.raise_for_status()
         return response.json()
 
-    def bulk_create(
-        self, index_name: str, items: List[Tuple[str, Any]]
-    ) -> List[Tuple[str, Optional[str]]]:
+    def read_ids_by_query(
+        self, index_name: str, query: dict, page_size: int = 1000
+    ) -> Iterator[List[str]]:
         """
-        Создание документов в индексе
+        Постраничное получение id документов индекса, подходящих под запрос
+        """
+        search_after = None
+        while True:
+            body = {"query": query, "size": page_size, "_source": False, "sort": [{"id": "asc"}]}
+            if search_after is not None:
+                body["search_after"] = search_after
+            response = self.write(
+                "POST",
+                f"{self.elastic_url}/{index_name}/_search",
+                headers={"Content-Type": "application/json"},
+                data=json.dumps(body),
+            )
+            hits = response["hits"]["hits"]
+            if not hits:
+                return
+            yield [hit["_id"] for hit in hits]
+            search_after = hits[-1]["sort"]
+
+    def split_batches(self, actions: List[Tuple[str, bytes]]) -> List[List[Tuple[str, bytes]]]:
+        """Разбиение действий bulk на пачки не больше max_bulk_items и max_bulk_bytes"""
+        batches: List[List[Tuple[str, bytes]]] = []
+        batch: List[Tuple[str, bytes]] = []
+        batch_bytes = 0
+        for action in actions:
+            size = len(action[1])
+            if batch and (
+                len(batch) >= self.max_bulk_items or batch_bytes + size > self.max_bulk_bytes
+            ):
+                batches.append(batch)
+                batch, batch_bytes = [], 0
+            batch.append(action)
+            batch_bytes += size
+
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def write_batch(self, batch: List[Tuple[str, bytes]]) -> Dict[str, str]:
+        """
+        Отправка пачки документов, возвращает ошибки по id документов.
+        Документы, отклоненные из-за переполнения очереди записи (429), отправляются повторно
+        с растущей паузой. Если они отклоняются и после rejected_retries повторов, возникает
+        BulkRejectedError, чтобы время синхронизации не обновилось и документы не потерялись.
         """
-        data = []
-        for item_id, item in items:
-            data.append(json.dumps({"create": {"_index": index_name, "_id": item_id}}))
-            data.append(json.dumps(item))
-
-        response = self.write("PUT", f"{self.elastic_url}/_bulk", data="\n".join(data) + "\n")
-
         errors_map = {}
-        for item_error in response["items"]:
-            create_result = item_error.get("create")
-            if not create_result:
-                continue
-
-            create_error = create_result.get("error")
-            if not create_error:
-                continue
+        sleep_time = self.rejected_start_sleep_time
+        for attempt in range(self.rejected_retries + 1):
+            if attempt:
+                logger.warning(
+                    f'Elastic rejected "{len(batch)}" documents, sleep for {sleep_time}s'
+                )
+                time.sleep(sleep_time)
+                sleep_time = min(sleep_time * 2, self.rejected_border_sleep_time)
+
+            response = self.write(
+                "POST", f"{self.elastic_url}/_bulk", data=b"".join(action for _, action in batch)
+            )
 
-            error_type, error_msg = create_error["type"], create_error["reason"]
-            errors_map[create_result["_id"]] = f"{error_type}: {error_msg}"
+            rejected_ids = set()
+            for item_result in response["items"]:
+                index_result = item_result["index"]
+                index_error = index_result.get("error")
+                if not index_error:
+                    continue
+
+                if (
+                    index_result.get("status") == 429
+                    or index_error["type"] == "es_rejected_execution_exception"
+                ):
+                    rejected_ids.add(index_result["_id"])
+                else:
+                    error_type, error_msg = index_error["type"], index_error["reason"]
+                    errors_map[index_result["_id"]] = f"{error_type}: {error_msg}"
+
+            batch = [(item_id, action) for item_id, action in batch if item_id in rejected_ids]
+            if not batch:
+                return errors_map
+
+        raise BulkRejectedError(
+            f'Elastic rejected "{len(batch)}" documents after {self.rejected_retries} retries'
+        )
 
-        return [(item_id, errors_map.get(item_id)) for item_id, _ in items]
+    def refresh(self, index_name: str) -> None:
+        """Записанные в индекс документы становятся доступны для поиска"""
+        self.write("POST", f"{self.elastic_url}/{index_name}/_refresh")
 
-    def bulk_update(
+    def bulk_index(
         self, index_name: str, items: List[Tuple[str, Any]]
     ) -> List[Tuple[str, Optional[str]]]:
         """
-        Обновление документов в индексе
+        Создание или замена документов в индексе одним действием index, без чтения
+        существующих документов. Документы отправляются пачками по числу и размеру.
         """
-        data = []
-        for item_id, item in items:
-            data.append(json.dumps({"update": {"_index": index_name, "_id": item_id}}))
-            data.append(json.dumps({"doc": item}))
-
-        response = self.write("PUT", f"{self.elastic_url}/_bulk", data="\n".join(data) + "\n")
+        actions = [
+            (
+                item_id,
+                (
+                    json.dumps({"index": {"_index": index_name, "_id": item_id}})
+                    + "\n"
+                    + json.dumps(item)
+                    + "\n"
+                ).encode(),
+            )
+            for item_id, item in items
+        ]
+        batches = self.split_batches(actions)
+        if self._executor is not None and len(batches) > 1:
+            results = self._executor.map(self.write_batch, batches)
+        else:
+            results = map(self.write_batch, batches)
 
         errors_map = {}
-        for item_error in response["items"]:
-            update_result = item_error.get("update")
-            if not update_result:
-                continue
-
-            update_error = update_result.get("error")
-            if not update_error:
-                continue
-
-            error_type, error_msg = update_error["type"], update_error["reason"]
-            errors_map[update_result["_id"]] = f"{error_type}: {error_msg}"
+        for batch_errors in results:
+            errors_map.update(batch_errors)
 
         return [(item_id, errors_map.get(item_id)) for item_id, _ in items]
 
-    def bulk_create_or_update(
-        self, index_name: str, items: List[Tuple[str, Any]]
-    ) -> List[Tuple[str, Optional[str]]]:
-        """
-        Создание или обновление документов в индексе
-        """
-        create_result = self.bulk_create(index_name=index_name, items=items)
-
-        already_exists_ids = set()
-        for item_id, error in create_result:
-            if error is not None and "document already exists" in error:
-                already_exists_ids.add(item_id)
 
-        if not already_exists_ids:
-            return create_result
+class CachePublisher:
+    """
+    Класс для публикации id обновленных документов в redis.
+    Api подписывается на канал и удаляет из кэша ответы, содержащие эти документы.
+    """
 
-        update_result = self.bulk_update(
-            index_name=index_name,
-            items=[(item_id, item) for item_id, item in items if item_id in already_exists_ids],
+    def __init__(self, redis_dsn: str, channel: str):
+        self.redis = redis.Redis.from_url(redis_dsn)
+        self.channel = channel
+
+    def publish(self, index_name: str, items_ids: List[str]) -> None:
+        # Тег индекса сбрасывает списки и поиск, которые изменение могло затронуть
+        # без упоминания id в ответе: новые документы, изменение порядка или фильтра
+        message = json.dumps(
+            {
+                "index": index_name,
+                "ids": [str(i) for i in items_ids],
+                "tags": [f"index:{index_name}"],
+            }
         )
-
-        errors_map = {
-            **{item_id: error for item_id, error in create_result},
-            **{item_id: error for item_id, error in update_result},
-        }
-
-        return [(item_id, errors_map.get(item_id)) for item_id, _ in items]
+        try:
+            self.redis.publish(self.channel, message)
+        except redis.RedisError as e:
+            # Кэш сбросится по истечении времени жизни, etl из-за этого не останавливаем
+            logger.error(f'Cache invalidation for "{index_name}" failed with {e!r}')
 
 
 class BaseStorage:
@@ -276,6 +551,8 @@ class State:
 
     def __init__(self, storage: BaseStorage):
         self.storage = storage
+        # Состояние обновляют пайплайны из разных потоков
+        self._lock = threading.Lock()
         self.state = self.retrieve_state()
 
     def retrieve_state(self) -> dict:
@@ -284,9 +561,11 @@ class State:
 
     def set_state(self, key: str, value: Any) -> None:
         """Установить состояние для определённого ключа"""
-        self.state[key] = value
-        self.storage.save_state(self.state)
+        with self._lock:
+            self.state[key] = value
+            self.storage.save_state(self.state)
 
     def get_state(self, key: str) -> Any:
         """Получить состояние по определённому ключу"""
-        return self.state.get(key)
+        with self._lock:
+            return self.state.get(key)
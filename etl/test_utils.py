@@ -0,0 +1,60 @@
+import itertools
+import threading
+
+import pytest
+from utils import run_pipeline
+
+
+def test_pipeline_passes_every_item_through_all_stages():
+    results = []
+    lock = threading.Lock()
+
+    def collect(item):
+        with lock:
+            results.append(item)
+
+    run_pipeline(
+        range(20),
+        stages=[(lambda item: item * 2, 3), (lambda item: item + 1, 2), (collect, 1)],
+        queue_size=2,
+        poll_interval=0.01,
+    )
+    assert sorted(results) == [item * 2 + 1 for item in range(20)]
+
+
+def test_pipeline_stops_on_stage_error():
+    read = []
+    loaded = []
+
+    def source():
+        for item in itertools.count():
+            read.append(item)
+            yield item
+
+    def enrich(item):
+        if item == 3:
+            raise ValueError("broken item")
+        return item
+
+    with pytest.raises(ValueError, match="broken item"):
+        run_pipeline(
+            source(),
+            stages=[(enrich, 1), (loaded.append, 1)],
+            queue_size=1,
+            poll_interval=0.01,
+        )
+    # Бесконечный источник перестает читаться, а элементы после ошибки не загружаются
+    assert len(read) < 10
+    assert 3 not in loaded
+    assert all(item < 3 for item in loaded)
+
+
+def test_pipeline_stops_stages_on_source_error():
+    def source():
+        yield 1
+        raise ConnectionError("postgres is down")
+
+    loaded = []
+    with pytest.raises(ConnectionError):
+        run_pipeline(source(), stages=[(loaded.append, 2)], poll_interval=0.01)
+    assert threading.active_count() == 1
@@ -1,9 +1,11 @@
 import json
 import logging
 import os
+import threading
 from functools import wraps
+from queue import Empty, Full, Queue
 from time import sleep
-from typing import Callable
+from typing import Any, Callable, Iterable, List, Optional, Sequence, Tuple
 
 import requests
 from requests.exceptions import ConnectionError, ConnectTimeout
@@ -79,6 +81,93 @@ def backoff(
     return func_wrapper
 
 
+# Признак конца данных в очереди между стадиями конвейера
+_STOP = object()
+
+
+def run_pipeline(
+    source: Iterable[Any],
+    stages: Sequence[Tuple[Callable[[Any], Any], int]],
+    queue_size: int = 4,
+    poll_interval: float = 0.5,
+) -> None:
+    """
+    Конвейерная обработка элементов source: каждая стадия выполняется в своих потоках,
+    стадии соединены очередями размером queue_size. Заполненная очередь приостанавливает
+    предыдущую стадию, поэтому в обработке одновременно находится ограниченное число элементов.
+
+    :param source: итератор элементов, читается в вызывающем потоке
+    :param stages: функции стадий и число потоков каждой. Результат функции передается
+        следующей стадии, результат последней стадии отбрасывается
+    :param queue_size: размер очереди перед каждой стадией
+    :param poll_interval: как часто ожидающие потоки проверяют, не остановлен ли конвейер
+    :return: управление возвращается после обработки всех элементов последней стадией.
+        Ошибка в любой стадии останавливает конвейер и пробрасывается вызывающему
+
+    """
+    queues: List[Queue] = [Queue(maxsize=queue_size) for _ in stages]
+    failed = threading.Event()
+    errors: List[Exception] = []
+
+    def put(queue: Queue, item: Any) -> bool:
+        while not failed.is_set():
+            try:
+                queue.put(item, timeout=poll_interval)
+                return True
+            except Full:
+                continue
+        return False
+
+    def get(queue: Queue) -> Any:
+        while not failed.is_set():
+            try:
+                return queue.get(timeout=poll_interval)
+            except Empty:
+                continue
+        return _STOP
+
+    def work(func: Callable[[Any], Any], inbox: Queue, outbox: Optional[Queue] = None):
+        try:
+            while (item := get(inbox)) is not _STOP:
+                result = func(item)
+                if outbox is not None and not put(outbox, result):
+                    return
+        except Exception as e:
+            logger.exception(f"Pipeline stage {func.__name__} failed")
+            errors.append(e)
+            failed.set()
+
+    stages_threads: List[List[threading.Thread]] = []
+    for number, (func, workers) in enumerate(stages):
+        outbox = queues[number + 1] if number + 1 < len(stages) else None
+        threads = [
+            threading.Thread(target=work, args=(func, queues[number], outbox), daemon=True)
+            for _ in range(max(workers, 1))
+        ]
+        for thread in threads:
+            thread.start()
+        stages_threads.append(threads)
+
+    try:
+        for item in source:
+            if not put(queues[0], item):
+                break
+    except BaseException:
+        failed.set()
+        raise
+    finally:
+        # Стадии завершаются по порядку: каждый поток стадии получает признак конца данных
+        # после всех элементов, следующая стадия завершается после предыдущей
+        for queue, threads in zip(queues, stages_threads):
+            for _ in threads:
+                put(queue, _STOP)
+            for thread in threads:
+                thread.join()
+
+    if errors:
+        raise errors[0]
+
+
 def load_indexes(es_dsn: str):
     """Функция для загрузки индексов в elastic"""
 